@@ -10,8 +10,10 @@ class PassCounter:
         self.team_assigner = team_assigner
         self.pass_graph = defaultdict(int)  # (from_id, to_id) -> count
 
-    def count_pass(self, players, ball_bbox, frame_num):
-        current_player_with_ball = self.player_ball_assigner.assign_ball_to_player(players, ball_bbox)
+    def count_pass(self, players, ball_bbox, frame_num, current_player_with_ball=None):
+        # current_player_with_ball can be passed in when possession was already computed for the frame
+        if current_player_with_ball is None:
+            current_player_with_ball = self.player_ball_assigner.assign_ball_to_player(players, ball_bbox)
         print(f"Frame {frame_num}:")
 
         if current_player_with_ball != -1:
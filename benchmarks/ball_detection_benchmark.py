@@ -0,0 +1,98 @@
+"""
+Ball recall and inference cost of the two-tier detection (downscaled
+full-frame pass plus a full-resolution ball crop, Tracker ball_crop_size)
+against single full-frame passes at different sizes.
+
+For every configuration, on the first --frames frames of the video:
+- ball frames: share of frames with a ball before interpolation;
+- crop / full / missed: where the ball came from (two-tier only);
+- ball px: mean distance to the ball of the --reference configuration, on
+  the frames where both found one;
+- players: players and referees per frame;
+- ms/frame: detection time per frame (both passes).
+
+Needs the model weights (models/best.pt by default); the bundled Git LFS
+pointer is not enough.
+
+Run from the repository root:
+    python benchmarks/ball_detection_benchmark.py
+    python benchmarks/ball_detection_benchmark.py --configs full_1280 two_tier_640
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_DIR)
+from utils import read_video
+from trackers import Tracker
+from instrumentation import metrics
+
+# name: Tracker options
+CONFIGS = {
+    "full_640": {"imgsz": 640},
+    "full_960": {"imgsz": 960},
+    "full_1280": {"imgsz": 1280},
+    "two_tier_480": {"imgsz": 480, "ball_crop_size": 320},
+    "two_tier_640": {"imgsz": 640, "ball_crop_size": 320},
+}
+
+
+def get_ball_centers(tracks):
+    return [np.array([(ball[1]["bbox"][0] + ball[1]["bbox"][2]) / 2, (ball[1]["bbox"][1] + ball[1]["bbox"][3]) / 2])
+            if ball else None for ball in tracks["ball"]]
+
+
+def get_ball_sources():
+    snapshot = metrics.snapshot()
+    return {labels["source"]: value for name, labels, value in snapshot["values"] if name == "ball_detections_total"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default=os.path.join(REPO_DIR, 'input_videos', 'videoplayback - Trim.mp4'))
+    parser.add_argument('--model', default=os.path.join(REPO_DIR, 'models', 'best.pt'))
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--configs', nargs='*', choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument('--reference', choices=list(CONFIGS), default="full_1280")
+    args = parser.parse_args()
+
+    frames = read_video(args.video)[:args.frames]
+    configs = [args.reference] + [name for name in args.configs if name != args.reference]
+    print(f"{args.video}: {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, ball against {args.reference}")
+    print(f"{'configuration':>16} {'ball frames':>12} {'crop':>6} {'full':>6} {'missed':>7} {'ball px':>8} "
+          f"{'players':>8} {'ms/frame':>9}")
+    reference = None
+    for name in configs:
+        try:
+            tracker = Tracker(args.model, **CONFIGS[name])
+        except Exception as e:
+            print(f"Unable to load {args.model}: {str(e).splitlines()[0]}")
+            return
+        metrics.clear()
+        tracks = {"player": [], "referees": [], "ball": []}
+        seconds = 0.0
+        for i in range(0, len(frames), tracker.batch_size):
+            batch = frames[i:i + tracker.batch_size]
+            start = time.perf_counter()
+            detections = tracker.detect_frames(batch)
+            seconds += time.perf_counter() - start
+            tracker.add_detections_to_tracks(tracks, detections, batch)
+
+        centers = get_ball_centers(tracks)
+        if reference is None:
+            reference = centers
+        errors = [np.hypot(*(center - reference_center)) for center, reference_center in zip(centers, reference)
+                  if center is not None and reference_center is not None]
+        sources = get_ball_sources()
+        people = np.mean([len(players) + len(referees) for players, referees in zip(tracks["player"], tracks["referees"])])
+        print(f"{name:>16} {np.mean([center is not None for center in centers]):12.1%} "
+              f"{sources.get('crop', 0):6.0f} {sources.get('full_frame', 0):6.0f} {sources.get('missed', 0):7.0f} "
+              f"{np.mean(errors) if errors else float('nan'):8.2f} {people:8.1f} {1000 * seconds / len(frames):9.1f}")
+
+
+if __name__ == '__main__':
+    main()
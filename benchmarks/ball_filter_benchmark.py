@@ -0,0 +1,147 @@
+"""
+Accuracy and cost of the Kalman ball filter (trackers/ball_filter.py) against
+the linear interpolation it replaced, on the ball track of the bundled stub.
+
+For every seed, --holdout of the ball detections are hidden and --outliers of
+the remaining ones are replaced by a false positive anywhere in the frame;
+each method then fills in the track and is scored per frame kind:
+- hidden px: median distance to the hidden detections (gap filling);
+- outlier px: median distance to the detection a false positive replaced;
+- followed: share of false positives the output stayed within --follow-px of;
+- kept px: median distance to the untouched detections (smoothing);
+- ms/1000 frames: time to process the track.
+Distances are between box centers; the detections themselves are the
+reference, so the numbers include the detector's own jitter.
+
+The kick case is a synthetic ball at rest that is kicked to each of
+--kick-speeds px/frame, detected on every frame with 1 px of noise; kick px is
+the mean and max distance to the true position over the 10 frames after the
+kick, where the gate has to let the detections through.
+
+Run from the repository root:
+    python benchmarks/ball_filter_benchmark.py
+    python benchmarks/ball_filter_benchmark.py --outliers 0.1 --lookahead 25
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_DIR)
+from trackers import BallKalmanFilter
+
+
+def interpolate_linear(ball_positions):
+    # the pandas interpolation Tracker.interpolate_ball_positions used before the filter
+    ball_positions = [x.get(1, {}).get('bbox', []) for x in ball_positions]
+    df_ball_positions = pd.DataFrame(ball_positions, columns=['x1', 'y1', 'x2', 'y2'])
+    df_ball_positions = df_ball_positions.interpolate().bfill()
+    return [{1: {"bbox": x}} for x in df_ball_positions.to_numpy().tolist()]
+
+
+def run_streaming(ball_filter, ball_positions, batch_size):
+    ball_filter.reset()
+    output = []
+    for i in range(0, len(ball_positions), batch_size):
+        output += ball_filter.update(ball_positions[i:i + batch_size])
+    return output + ball_filter.flush()
+
+
+def get_centers(ball_positions):
+    boxes = np.array([ball.get(1, {}).get('bbox', [np.nan] * 4) for ball in ball_positions], dtype=np.float64)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+
+def corrupt(ball_positions, holdout, outliers, frame_size, rng):
+    # hidden and outlier frame numbers, and the track with them applied
+    detected = np.flatnonzero([1 in ball for ball in ball_positions])
+    hidden = rng.choice(detected, int(round(holdout * len(detected))), replace=False)
+    remaining = np.setdiff1d(detected, hidden)
+    replaced = rng.choice(remaining, int(round(outliers * len(remaining))), replace=False)
+    corrupted = [dict(ball) for ball in ball_positions]
+    for frame_num in hidden:
+        corrupted[frame_num] = {}
+    for frame_num in replaced:
+        x1, y1, x2, y2 = ball_positions[frame_num][1]["bbox"]
+        x, y = rng.uniform(0, frame_size[0] - (x2 - x1)), rng.uniform(0, frame_size[1] - (y2 - y1))
+        corrupted[frame_num] = {1: {"bbox": [x, y, x + x2 - x1, y + y2 - y1]}}
+    kept = np.setdiff1d(remaining, replaced)
+    return corrupted, hidden, replaced, kept
+
+
+def make_kick(speed, rng, rest_frames=20, moving_frames=30, start=(500.0, 500.0)):
+    # ball track at rest then moving at speed px/frame, with 1 px of detection noise, and its true centers
+    steps = np.r_[np.zeros(rest_frames), np.arange(1, moving_frames + 1)] * speed
+    truth = np.stack([start[0] + steps, start[1] + steps / 2], axis=1)
+    centers = truth + rng.normal(0, 1, truth.shape)
+    ball_positions = [{1: {"bbox": [x - 8, y - 8, x + 8, y + 8]}} for x, y in centers.tolist()]
+    return ball_positions, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks-stub', default=os.path.join(REPO_DIR, 'stubs', 'track_stubs.pkl'))
+    parser.add_argument('--frame-size', type=int, nargs=2, default=(1920, 1080))
+    parser.add_argument('--holdout', type=float, default=0.2, help='share of the detections to hide')
+    parser.add_argument('--outliers', type=float, default=0.05, help='share of the rest to replace by false positives')
+    parser.add_argument('--follow-px', type=float, default=50)
+    parser.add_argument('--lookahead', type=int, default=12)
+    parser.add_argument('--batch-size', type=int, default=20, help='frames per update() in streaming mode')
+    parser.add_argument('--seeds', type=int, default=10)
+    parser.add_argument('--kick-speeds', type=float, nargs='*', default=[20, 40, 60])
+    args = parser.parse_args()
+
+    with open(args.tracks_stub, 'rb') as f:
+        ball_positions = pickle.load(f)["ball"]
+    methods = {
+        "linear": interpolate_linear,
+        "kalman_velocity": BallKalmanFilter("velocity").smooth,
+        "kalman_acceleration": BallKalmanFilter("acceleration").smooth,
+        f"streaming_{args.lookahead}": lambda ball_positions: run_streaming(
+            BallKalmanFilter("velocity", lookahead=args.lookahead), ball_positions, args.batch_size),
+    }
+    print(f"{args.tracks_stub}: {len(ball_positions)} frames, {sum(1 in ball for ball in ball_positions)} with a ball, "
+          f"{args.holdout:.0%} hidden, {args.outliers:.0%} of the rest false positives, {args.seeds} seeds")
+    print(f"{'method':>20} {'hidden px':>10} {'outlier px':>11} {'followed':>9} {'kept px':>8} {'ms/1000 frames':>15}")
+
+    truth = get_centers(ball_positions)
+    for name, method in methods.items():
+        errors = {"hidden": [], "outlier": [], "kept": []}
+        followed, seconds = [], 0.0
+        for seed in range(args.seeds):
+            rng = np.random.default_rng(seed)
+            corrupted, hidden, replaced, kept = corrupt(ball_positions, args.holdout, args.outliers,
+                                                        args.frame_size, rng)
+            start = time.perf_counter()
+            output = method(corrupted)
+            seconds += time.perf_counter() - start
+            distances = np.hypot(*(get_centers(output) - truth).T)
+            errors["hidden"].extend(distances[hidden])
+            errors["outlier"].extend(distances[replaced])
+            errors["kept"].extend(distances[kept])
+            outlier_distances = np.hypot(*(get_centers(output)[replaced] - get_centers(corrupted)[replaced]).T)
+            followed.extend(outlier_distances < args.follow_px)
+        print(f"{name:>20} {np.median(errors['hidden']):10.2f} {np.median(errors['outlier']):11.2f} "
+              f"{np.mean(followed) if followed else 0:9.1%} {np.median(errors['kept']):8.2f} "
+              f"{1000 * 1000 * seconds / (args.seeds * len(ball_positions)):15.1f}")
+
+    print(f"\nKick from rest, {args.seeds} seeds: mean / max px over the 10 frames after the kick")
+    print(f"{'method':>20}" + "".join(f"{f'{speed:g} px/frame':>16}" for speed in args.kick_speeds))
+    for name, method in methods.items():
+        row = f"{name:>20}"
+        for speed in args.kick_speeds:
+            distances = []
+            for seed in range(args.seeds):
+                kick, truth = make_kick(speed, np.random.default_rng(seed))
+                distances.extend(np.hypot(*(get_centers(method(kick)) - truth).T)[20:30])
+            row += f"{f'{np.mean(distances):.1f} / {np.max(distances):.1f}':>16}"
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Speed and drift of the camera motion backends.
+
+Every backend runs on
+- the input video: drift is the accumulated camera position compared to the
+  Lucas-Kanade result, which the pipeline used so far;
+- a synthetic pan cropped out of the first frame: the crop offsets are the exact
+  camera movement, so the error is measured against ground truth.
+
+Run from the repository root:
+    python benchmarks/camera_motion_benchmark.py --video "input_videos/videoplayback - Trim.mp4"
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import read_video
+from camera_movment_estimator import CameraMovmentEstimator
+
+BACKENDS = {
+    "lucas_kanade": ("lucas_kanade", {}),
+    "lucas_kanade_0.5x": ("lucas_kanade", {}),
+    "phase_correlation": ("phase_correlation", {}),
+    "phase_correlation_strips": ("phase_correlation", {"rois": [(0.0, 0.0, 0.2, 1.0), (0.4, 0.0, 0.6, 1.0), (0.8, 0.0, 1.0, 1.0)]}),
+}
+DOWNSCALES = {"lucas_kanade_0.5x": 0.5}
+
+
+def run_backend(name, frames):
+    motion_backend, backend_params = BACKENDS[name]
+    estimator = CameraMovmentEstimator(frames[0], downscale=DOWNSCALES.get(name, 1.0),
+                                       motion_backend=motion_backend, backend_params=backend_params)
+    start = time.perf_counter()
+    camera_movement = estimator.get_camera_movment(frames)
+    seconds = time.perf_counter() - start
+    return np.asarray(camera_movement, dtype=np.float64), seconds
+
+
+def make_synthetic_pan(frame, num_frames, crop_fraction=0.75, seed=0):
+    # smooth random walk of a crop window; the offset change is the true camera movement
+    height, width = frame.shape[:2]
+    crop_height, crop_width = int(height * crop_fraction), int(width * crop_fraction)
+    rng = np.random.default_rng(seed)
+    velocity = np.cumsum(rng.normal(0, 0.6, size=(num_frames, 2)), axis=0)
+    offsets = np.cumsum(velocity, axis=0)
+    offsets -= offsets.min(axis=0)
+    offsets *= np.minimum(1.0, np.array([width - crop_width, height - crop_height]) / np.maximum(offsets.max(axis=0), 1))
+    offsets = np.round(offsets).astype(int)
+
+    frames = [frame[y:y + crop_height, x:x + crop_width].copy() for x, y in offsets]
+    truth = np.zeros((num_frames, 2))
+    truth[1:] = np.diff(offsets, axis=0)
+    return frames, truth
+
+
+def drift(camera_movement, reference):
+    # distance between the accumulated camera positions
+    difference = np.cumsum(camera_movement - reference, axis=0)
+    distances = np.hypot(difference[:, 0], difference[:, 1])
+    return distances[-1], distances.max()
+
+
+def print_row(name, num_frames, seconds, final_drift, max_drift, frame_error):
+    print(f"{name:>26} {num_frames / seconds:9.1f} {1000 * seconds / num_frames:8.2f} "
+          f"{final_drift:12.1f} {max_drift:10.1f} {frame_error:12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default='input_videos/videoplayback - Trim.mp4')
+    parser.add_argument('--frames', type=int, default=300, help='frames to use from the video (0 = all)')
+    parser.add_argument('--synthetic-frames', type=int, default=200)
+    args = parser.parse_args()
+
+    frames = read_video(args.video)
+    if args.frames > 0:
+        frames = frames[:args.frames]
+    if not frames:
+        raise ValueError(f"Unable to read video file: {args.video}")
+
+    header = f"{'backend':>26} {'fps':>9} {'ms/frame':>8} {'final drift':>12} {'max drift':>10} {'mean error':>12}"
+
+    print(f"\n{args.video}: {len(frames)} frames, drift against lucas_kanade (px)")
+    print(header)
+    results = {name: run_backend(name, frames) for name in BACKENDS}
+    reference = results["lucas_kanade"][0]
+    for name, (camera_movement, seconds) in results.items():
+        frame_error = np.hypot(*(camera_movement - reference).T).mean()
+        print_row(name, len(frames), seconds, *drift(camera_movement, reference), frame_error)
+
+    synthetic_frames, truth = make_synthetic_pan(frames[0], args.synthetic_frames)
+    print(f"\nsynthetic pan: {len(synthetic_frames)} frames, drift against ground truth (px)")
+    print(header)
+    for name in BACKENDS:
+        camera_movement, seconds = run_backend(name, synthetic_frames)
+        frame_error = np.hypot(*(camera_movement - truth).T).mean()
+        print_row(name, len(synthetic_frames), seconds, *drift(camera_movement, truth), frame_error)
+
+
+if __name__ == '__main__':
+    main()
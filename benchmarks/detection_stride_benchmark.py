@@ -0,0 +1,208 @@
+"""
+Accuracy and speed of detecting on keyframes only (Tracker detection_stride)
+against detecting on every frame.
+
+Every configuration tracks the same frames; its players and referees are
+matched per frame to the stride 1 tracks (Hungarian matching on IoU) and the
+interpolated ball to the stride 1 ball:
+- mean IoU: over all stride 1 boxes, unmatched boxes count as 0;
+- recall: share of stride 1 boxes matched with IoU >= 0.5;
+- center error: mean distance of matched box centers in pixels;
+- ball error: mean distance of the interpolated ball centers in pixels.
+
+Sources:
+- model: the weights given with --model on the input video;
+- replay (used when the weights cannot be loaded): synthetic frames with a
+  textured sprite at every box of the track stub, and a detector that returns
+  the stub boxes of the frame. The boxes match the pixels, so both the
+  "motion" and the "flow" propagation can be measured, but the detector costs
+  nothing: the time column is tracking and propagation only, and the keyframe
+  share is what scales the detector time.
+
+Run from the repository root:
+    python benchmarks/detection_stride_benchmark.py
+    python benchmarks/detection_stride_benchmark.py --strides 1 2 4 8 --motion-threshold 6
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_DIR)
+from utils import read_video, get_center_of_bbox
+from trackers import Tracker, get_model
+
+CLASS_NAMES = {0: 'ball', 1: 'goalkeeper', 2: 'player', 3: 'referee'}
+CLASS_IDS = {"player": 2, "referees": 3, "ball": 0}
+
+
+class ReplayDetector:
+    """
+    Detector with the predict() interface of the YOLO model that returns the
+    stub boxes of each frame; the frame number is read from the first two pixels.
+    """
+
+    def __init__(self, tracks, scale):
+        self.tracks = tracks
+        self.scale = scale
+
+    def predict(self, frames, conf=0.1):
+        import torch
+        from ultralytics.engine.results import Results
+
+        results = []
+        for frame in frames:
+            frame_num = int(frame[0, 0, 0]) * 256 + int(frame[0, 1, 0])
+            boxes = [[value * self.scale for value in track["bbox"]] + [0.9, CLASS_IDS[name]]
+                     for name in CLASS_IDS for track in self.tracks[name][frame_num].values()]
+            results.append(Results(frame, path='replay', names=CLASS_NAMES,
+                                   boxes=torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6)))
+        return results
+
+
+def make_replay_frames(tracks, background, num_frames, scale, seed=0):
+    # a fixed noise texture per track id, so the sprites can be followed by optical flow
+    rng = np.random.default_rng(seed)
+    textures = {}
+    frames = []
+    for frame_num in range(num_frames):
+        frame = background.copy()
+        for name in ("player", "referees"):
+            for track_id, track in tracks[name][frame_num].items():
+                x1, y1, x2, y2 = [int(round(value * scale)) for value in track["bbox"]]
+                x1, y1 = max(x1, 0), max(y1, 0)
+                x2, y2 = min(x2, frame.shape[1]), min(y2, frame.shape[0])
+                if x2 <= x1 or y2 <= y1:
+                    continue
+                texture = textures.get((name, track_id))
+                if texture is None:
+                    texture = textures[(name, track_id)] = rng.integers(0, 256, size=(64, 32, 3), dtype=np.uint8)
+                frame[y1:y2, x1:x2] = cv2.resize(texture, (x2 - x1, y2 - y1), interpolation=cv2.INTER_NEAREST)
+        for track in tracks["ball"][frame_num].values():
+            x, y = get_center_of_bbox([value * scale for value in track["bbox"]])
+            cv2.circle(frame, (x, y), 4, (255, 255, 255), -1)
+        frame[0, 0] = frame_num // 256
+        frame[0, 1] = frame_num % 256
+        frames.append(frame)
+    return frames
+
+
+def make_tracker(model, batch_size, detection_stride=1, propagation="motion", motion_threshold=None,
+                 uncertainty_threshold=None):
+    return Tracker(None, batch_size=batch_size, detection_stride=detection_stride, propagation=propagation,
+                   keyframe_motion_threshold=motion_threshold, keyframe_uncertainty_threshold=uncertainty_threshold,
+                   model=model)
+
+
+def get_iou(boxes_a, boxes_b):
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def compare_tracks(tracks, reference, tracker):
+    ious, center_errors = [], []
+    for name in ("player", "referees"):
+        for frame_tracks, reference_tracks in zip(tracks[name], reference[name]):
+            reference_boxes = np.array([track["bbox"] for track in reference_tracks.values()]).reshape(-1, 4)
+            boxes = np.array([track["bbox"] for track in frame_tracks.values()]).reshape(-1, 4)
+            frame_ious = np.zeros(len(reference_boxes))
+            if len(boxes) and len(reference_boxes):
+                iou = get_iou(reference_boxes, boxes)
+                rows, cols = linear_sum_assignment(-iou)
+                frame_ious[rows] = iou[rows, cols]
+                matched = iou[rows, cols] > 0
+                centers = (reference_boxes[rows[matched], :2] + reference_boxes[rows[matched], 2:]) / 2
+                matched_centers = (boxes[cols[matched], :2] + boxes[cols[matched], 2:]) / 2
+                center_errors.extend(np.hypot(*(centers - matched_centers).T))
+            ious.extend(frame_ious)
+
+    ious = np.array(ious)
+    ball = np.array([track[1]["bbox"] for track in tracker.interpolate_ball_positions(tracks["ball"])])
+    reference_ball = np.array([track[1]["bbox"] for track in tracker.interpolate_ball_positions(reference["ball"])])
+    ball_errors = np.hypot(*((ball[:, :2] + ball[:, 2:]) / 2 - (reference_ball[:, :2] + reference_ball[:, 2:]) / 2).T)
+    return {
+        "mean_iou": float(ious.mean()) if len(ious) else 0.0,
+        "recall": float((ious >= 0.5).mean()) if len(ious) else 0.0,
+        "center_error": float(np.mean(center_errors)) if center_errors else 0.0,
+        "ball_error": float(np.nanmean(ball_errors)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default=os.path.join(REPO_DIR, 'input_videos', 'videoplayback - Trim.mp4'))
+    parser.add_argument('--tracks-stub', default=os.path.join(REPO_DIR, 'stubs', 'track_stubs.pkl'))
+    parser.add_argument('--model', default=os.path.join(REPO_DIR, 'models', 'best.pt'))
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--replay-scale', type=float, default=0.5, help='size of the replay frames, 1 = 1920x1080')
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--strides', type=int, nargs='*', default=[1, 2, 3, 4, 6, 8])
+    parser.add_argument('--propagation', nargs='*', choices=["motion", "flow"], default=["motion", "flow"])
+    parser.add_argument('--motion-threshold', type=float, help='also run every stride with motion keyframes')
+    parser.add_argument('--uncertainty-threshold', type=float, help='also run every stride with uncertainty keyframes')
+    args = parser.parse_args()
+
+    try:
+        model = get_model(args.model)
+        frames = read_video(args.video)[:args.frames]
+        source = f"model {args.model} on {args.video}"
+    except Exception as e:
+        print(f"Unable to load {args.model} ({str(e).splitlines()[0]}), replaying {args.tracks_stub}")
+        with open(args.tracks_stub, 'rb') as f:
+            stub_tracks = pickle.load(f)
+        num_frames = min(args.frames, len(stub_tracks["player"]))
+        size = (round(1920 * args.replay_scale), round(1080 * args.replay_scale))
+        background = cv2.resize(read_video(args.video)[0], size, interpolation=cv2.INTER_AREA)
+        frames = make_replay_frames(stub_tracks, background, num_frames, args.replay_scale)
+        model = ReplayDetector(stub_tracks, args.replay_scale)
+        source = f"replay of {args.tracks_stub}"
+
+    # the first configuration, stride 1, is the reference
+    configs = []
+    for stride in [1] + [stride for stride in args.strides if stride > 1]:
+        for propagation in (args.propagation if stride > 1 else ["motion"]):
+            configs.append((f"stride {stride} {propagation}" if stride > 1 else "stride 1",
+                            dict(detection_stride=stride, propagation=propagation)))
+            if stride > 1 and args.motion_threshold is not None:
+                configs.append((f"stride {stride} {propagation} +motion",
+                                dict(detection_stride=stride, propagation=propagation,
+                                     motion_threshold=args.motion_threshold)))
+            if stride > 1 and args.uncertainty_threshold is not None:
+                configs.append((f"stride {stride} {propagation} +uncertainty",
+                                dict(detection_stride=stride, propagation=propagation,
+                                     uncertainty_threshold=args.uncertainty_threshold)))
+
+    print(f"\n{source}: {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'configuration':>30} {'keyframes':>10} {'ms/frame':>9} {'mean IoU':>9} {'recall':>7} "
+          f"{'center px':>10} {'ball px':>8}")
+    reference = None
+    for name, options in configs:
+        tracker = make_tracker(model, args.batch_size, **options)
+        detected = []
+        start = time.perf_counter()
+        tracks = {"player": [], "referees": [], "ball": []}
+        for i in range(0, len(frames), args.batch_size):
+            batch = frames[i:i + args.batch_size]
+            detections = tracker.detect_frames(batch)
+            detected += [detection is not None for detection in detections]
+            tracker.add_detections_to_tracks(tracks, detections, batch)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = tracks
+        accuracy = compare_tracks(tracks, reference, tracker)
+        print(f"{name:>30} {np.mean(detected):10.1%} {1000 * seconds / len(frames):9.2f} {accuracy['mean_iou']:9.3f} "
+              f"{accuracy['recall']:7.1%} {accuracy['center_error']:10.2f} {accuracy['ball_error']:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
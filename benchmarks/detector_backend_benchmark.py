@@ -0,0 +1,116 @@
+"""
+Parity and throughput of the detector backends (trackers/detector_backends.py)
+against the PyTorch model.
+
+Every backend exports the weights on first use (the export time is reported
+once), then detects on the first --frames frames of the video and on the
+held-out validation images of the training dataset (INT8 is calibrated on the
+train split). Its detections are matched per image and class to the PyTorch
+ones with compare_detections (Hungarian matching on IoU), the check Tracker
+also runs on the validation images before it uses an exported backend:
+- recall / precision: PyTorch / backend boxes above --conf matched with
+  IoU >= 0.5; both sides detect at half of --conf, so a box whose confidence
+  only moved across --conf still counts as matched;
+- mean IoU and mean |conf diff| of the matched boxes;
+- frames/s: best of --repeats, with batch 1 and with --batch-size.
+
+A backend fails the parity check when its recall or precision is below
+--min-recall; the script then exits with status 1.
+Backends whose runtime is not installed are skipped.
+
+Run from the repository root:
+    python benchmarks/detector_backend_benchmark.py
+    python benchmarks/detector_backend_benchmark.py --backends onnx openvino_int8
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+import time
+
+import cv2
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_DIR)
+from utils import read_video
+from trackers import ModelRegistry, DETECTOR_BACKENDS
+from trackers.detector_backends import detect, compare_detections, DEFAULT_PARITY_IMAGES
+
+# name: (backend, export settings)
+BACKENDS = {
+    "pytorch": ("pytorch", {}),
+    "onnx": ("onnx", {}),
+    "onnx_int8": ("onnx", {"int8": True}),
+    "openvino": ("openvino", {}),
+    "openvino_int8": ("openvino", {"int8": True}),
+}
+
+
+def measure_fps(model, images, batch_size, conf, imgsz, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detect(model, images, batch_size, conf, imgsz)
+        best = min(best, time.perf_counter() - start)
+    return len(images) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default=os.path.join(REPO_DIR, 'input_videos', 'videoplayback - Trim.mp4'))
+    parser.add_argument('--model', default=os.path.join(REPO_DIR, 'models', 'best.pt'))
+    parser.add_argument('--backends', nargs='*', choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument('--frames', type=int, default=40, help='frames of the video to use')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.1)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    args = parser.parse_args()
+
+    images = read_video(args.video)[:args.frames] + [cv2.imread(path) for path in sorted(glob.glob(DEFAULT_PARITY_IMAGES))]
+    registry = ModelRegistry()
+    print(f"{args.model}: {args.frames} video frames and {len(images) - args.frames} validation images, imgsz {args.imgsz}")
+    print(f"{'backend':>14} {'export s':>9} {'recall':>7} {'precision':>10} {'mean IoU':>9} {'conf diff':>10} "
+          f"{'fps b1':>7} {f'fps b{args.batch_size}':>8}")
+
+    reference, failures = None, []
+    for name in ["pytorch"] + [name for name in args.backends if name != "pytorch"]:
+        backend, settings = BACKENDS[name]
+        runtime = DETECTOR_BACKENDS[backend][1]
+        if importlib.util.find_spec(runtime) is None:
+            print(f"{name:>14} skipped: {runtime} is not installed")
+            continue
+        start = time.perf_counter()
+        try:
+            model = registry.get_model(args.model, backend, imgsz=args.imgsz, batch=args.batch_size, **settings)
+        except Exception as e:
+            print(f"{name:>14} skipped: {str(e).splitlines()[0]}")
+            if reference is None:
+                return
+            continue
+        export_seconds = time.perf_counter() - start
+
+        detections = detect(model, images, args.batch_size, args.conf / 2, args.imgsz)
+        if reference is None:
+            reference = detections
+        parity = compare_detections(detections, reference, args.conf)
+        fps = [measure_fps(model, images[:args.frames], batch_size, args.conf, args.imgsz, args.repeats)
+               for batch_size in (1, args.batch_size)]
+        print(f"{name:>14} {export_seconds:9.1f} {parity['recall']:7.1%} {parity['precision']:10.1%} "
+              f"{parity['mean_iou']:9.3f} {parity['conf_diff']:10.4f} {fps[0]:7.1f} {fps[1]:8.1f}")
+
+        if min(parity["recall"], parity["precision"]) < args.min_recall:
+            failures.append(f"{name}: recall {parity['recall']:.1%}, precision {parity['precision']:.1%}, "
+                            f"required {args.min_recall:.0%}")
+
+    if failures:
+        print("\nParity check failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+MB/s of the upload cipher: the original per-byte xor_encrypt_decrypt against
+XorCipher on the whole buffer and chunk by chunk (in place, as the client and
+server use it). Every variant is checked against the original output.
+
+Run from the repository root:
+    python benchmarks/encryption_benchmark.py --size-mb 64
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from encryption import XorCipher, SECRET_KEY
+
+
+def xor_per_byte(data, key):
+    # the implementation XorCipher replaced
+    key_length = len(key)
+    return bytes([data[i] ^ key[i % key_length] for i in range(len(data))])
+
+
+def whole_buffer(data, key):
+    return bytes(XorCipher(key).process(data))
+
+
+def chunked_in_place(data, key, chunk_size):
+    buffer = bytearray(data)
+    view = memoryview(buffer)
+    cipher = XorCipher(key)
+    for start in range(0, len(buffer), chunk_size):
+        cipher.process_into(view[start:start + chunk_size])
+    return bytes(buffer)
+
+
+def measure(name, function, data, reference, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(data)
+        best = min(best, time.perf_counter() - start)
+    checked = min(len(result), len(reference))
+    status = "ok" if result[:checked] == reference[:checked] else "MISMATCH"
+    print(f"{name:>28}: {len(data) / 1e6 / best:10.1f} MB/s  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=64)
+    parser.add_argument('--per-byte-mb', type=float, default=2,
+                        help='the per-byte version only runs on this prefix, it is too slow for the full size')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(int(args.size_mb * 1e6))
+    per_byte_data = data[:int(args.per_byte_mb * 1e6)]
+    reference = xor_per_byte(per_byte_data, SECRET_KEY)
+
+    measure("per-byte (original)", lambda d: xor_per_byte(d, SECRET_KEY), per_byte_data, reference, 1)
+    measure("XorCipher whole buffer", lambda d: whole_buffer(d, SECRET_KEY), data, reference, args.repeats)
+    for chunk_size in (4096, 64 * 1024, 1024 * 1024):
+        measure(f"XorCipher in place, {chunk_size // 1024} KB", lambda d: chunked_in_place(d, SECRET_KEY, chunk_size),
+                data, reference, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+"""
+Time, frames/s and peak memory of every pipeline stage, compared to a stored
+baseline.
+
+Datasets:
+- video: the first --frames frames of the sample video with the bundled
+  track and camera movement stubs (stubs/track_stubs.pkl,
+  stubs/camera_movment_stub.pkl);
+- synthetic_x<scale>: random-walk tracks (22 players, 3 referees and a ball
+  that is missing in some frames) <scale> times as long as the stub. Stages
+  that need pixels (decode, detection, camera movement, team assignment,
+  rendering, encoding) only run on the video dataset.
+
+Each stage is timed best of --repeats on fresh inputs (building the inputs is
+not timed), after an untimed run with tracemalloc that measures peak memory;
+tracemalloc counts Python and NumPy allocations but not OpenCV / torch
+internals.
+Detection is skipped when the model weights cannot be loaded. Everything runs
+offline on the CPU.
+
+A stage regresses when its time per frame exceeds the baseline by more than
+--threshold (and by more than --min-seconds overall), or its peak memory by
+more than --memory-threshold; the script then exits with status 1.
+
+Run from the repository root:
+    python benchmarks/stage_benchmark.py
+    python benchmarks/stage_benchmark.py --save-baseline
+"""
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_DIR)
+from utils import iter_video_frames, get_video_info, VideoEncoder, TrackTable
+from trackers import Tracker
+from camera_movment_estimator import CameraMovmentEstimator
+from view_transformer import ViewTransformer
+from speed_and_distance_estimator import SpeedAndDistance_Estimator
+from team_assigner import TeamAssigner
+from player_ball_assigner import PlayerBallAssigner
+from PassCounter import PassCounter
+from frame_compositor import FrameCompositor
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stage_baseline.json')
+CLASS_NAMES = {0: 'ball', 1: 'goalkeeper', 2: 'player', 3: 'referee'}
+
+
+def load_video_dataset(args):
+    with open(args.tracks_stub, 'rb') as f:
+        tracks = pickle.load(f)
+    with open(args.camera_stub, 'rb') as f:
+        camera_movement = pickle.load(f)
+    num_frames = min(args.frames, len(tracks['player']), len(camera_movement))
+    frames = list(islice(iter_video_frames(args.video), num_frames))
+    num_frames = len(frames)
+    return {
+        "name": "video",
+        "video": args.video,
+        "fps": get_video_info(args.video)["fps"],
+        "frames": frames,
+        "frame_size": (frames[0].shape[1], frames[0].shape[0]),
+        "num_frames": num_frames,
+        "tracks": {name: object_tracks[:num_frames] for name, object_tracks in tracks.items()},
+        "camera_movement": [list(movement) for movement in camera_movement[:num_frames]],
+    }
+
+
+def make_synthetic_tracks(num_frames, num_players=22, num_referees=3, frame_size=(1920, 1080), seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = frame_size
+    num_people = num_players + num_referees
+    start = rng.uniform((100, 200), (width - 100, height - 100), size=(num_people, 2))
+    steps = rng.normal(0, 3, size=(num_frames, num_people, 2))
+    feet = np.clip(start + np.cumsum(steps, axis=0), (30, 100), (width - 30, height - 10))
+
+    ball_owner = (np.arange(num_frames) // 50) % num_players
+    ball = feet[np.arange(num_frames), ball_owner] + rng.normal(0, 5, size=(num_frames, 2))
+    ball_visible = rng.random(num_frames) > 0.2
+
+    tracks = {"player": [], "referees": [], "ball": []}
+    for frame_num in range(num_frames):
+        players, referees = {}, {}
+        for person in range(num_people):
+            x, y = feet[frame_num, person]
+            bbox = [x - 20, y - 90, x + 20, y]
+            if person < num_players:
+                track_id = person + 1
+                players[track_id] = {"bbox": bbox, "player_id": track_id, "team": "team1"}
+            else:
+                referees[person + 1] = {"bbox": bbox}
+        tracks["player"].append(players)
+        tracks["referees"].append(referees)
+        x, y = ball[frame_num]
+        tracks["ball"].append({1: {"bbox": [x - 6, y - 6, x + 6, y + 6]}} if ball_visible[frame_num] else {})
+    return tracks
+
+
+def load_synthetic_dataset(num_frames, fps, frame_size):
+    return {
+        "name": f"synthetic_{num_frames}",
+        "fps": fps,
+        "frames": None,
+        "frame_size": frame_size,
+        "num_frames": num_frames,
+        "tracks": make_synthetic_tracks(num_frames, frame_size=frame_size),
+        "camera_movement": np.random.default_rng(1).normal(0, 1, size=(num_frames, 2)).tolist(),
+    }
+
+
+class NoDetector:
+    # the track-level stages and drawing do not use the detector, the model weights are not needed
+    def predict(self, *args, **kwargs):
+        raise RuntimeError("The stage benchmark tracker has no detector")
+
+
+def make_tracker():
+    return Tracker(None, model=NoDetector())
+
+
+def make_detections(dataset):
+    # detector output for the stub boxes, in the format Tracker.add_detections_to_tracks expects
+    import torch
+    from ultralytics.engine.results import Results
+
+    class_ids = {"player": 2, "referees": 3, "ball": 0}
+    width, height = dataset["frame_size"]
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    detections = []
+    for frame_num in range(dataset["num_frames"]):
+        boxes = [list(track["bbox"]) + [0.9, class_ids[name]]
+                 for name in class_ids for track in dataset["tracks"][name][frame_num].values()]
+        detections.append(Results(image, path='benchmark', names=CLASS_NAMES,
+                                  boxes=torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6)))
+    return detections
+
+
+def make_table(dataset, analyzed=False):
+    tracks = TrackTable.from_tracks(dataset["tracks"])
+    if analyzed:
+        tracker = make_tracker()
+        team_assigner = make_team_assigner(tracks)
+        team_assigner.add_teams_to_tracks(tracks)
+        ViewTransformer().add_all_positions_to_tracks(tracks, dataset["camera_movement"])
+        tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"])
+        SpeedAndDistance_Estimator(frame_rate=dataset["fps"]).add_speed_and_distance_to_tracks(tracks)
+    return tracks
+
+
+def make_team_assigner(tracks):
+    # fixed teams by track id and fixed colours, as if assign_teams_by_vote had run (no pixels needed)
+    team_assigner = TeamAssigner()
+    player_ids = np.unique(tracks.track_id[tracks.get_object_rows('player')])
+    team_assigner.player_team_dict = {int(player_id): int(player_id) % 2 + 1 for player_id in player_ids}
+    team_assigner.team_colors = {1: np.array([255.0, 255.0, 255.0]), 2: np.array([0.0, 0.0, 255.0])}
+    team_assigner.kmeans = True
+    return team_assigner
+
+
+def get_team_ball_control(tracks, assigned_players):
+    team_ball_control = []
+    for frame_num, assigned_player in enumerate(assigned_players):
+        if assigned_player != -1:
+            team_ball_control.append(tracks['player'][frame_num][int(assigned_player)].get('team'))
+        else:
+            team_ball_control.append(team_ball_control[-1] if team_ball_control else None)
+    return team_ball_control
+
+
+def setup_decode(dataset, args):
+    return ()
+
+
+def run_decode(dataset, args):
+    return sum(1 for _ in islice(iter_video_frames(dataset["video"]), dataset["num_frames"]))
+
+
+def setup_detection(dataset, args):
+    return (Tracker(args.model),)
+
+
+def run_detection(dataset, args, tracker):
+    return tracker.detect_frames(dataset["frames"])
+
+
+def setup_tracking(dataset, args):
+    return make_tracker(), make_detections(dataset)
+
+
+def run_tracking(dataset, args, tracker, detections):
+    return tracker.add_detections_to_tracks({"player": [], "referees": [], "ball": []}, detections)
+
+
+def setup_table(dataset, args):
+    return (make_table(dataset),)
+
+
+def run_add_position(dataset, args, tracks):
+    make_tracker().add_position_to_tracks(tracks)
+
+
+def setup_camera_movement(dataset, args):
+    return (CameraMovmentEstimator(dataset["frames"][0]),)
+
+
+def run_camera_movement(dataset, args, estimator):
+    return estimator.get_camera_movment(dataset["frames"])
+
+
+def run_view_transform(dataset, args, tracks):
+    ViewTransformer().add_all_positions_to_tracks(tracks, dataset["camera_movement"])
+
+
+def run_ball_interpolation(dataset, args, tracks):
+    return make_tracker().interpolate_ball_positions(tracks["ball"])
+
+
+def setup_speed_and_distance(dataset, args):
+    tracks = make_table(dataset)
+    ViewTransformer().add_all_positions_to_tracks(tracks, dataset["camera_movement"])
+    return (tracks,)
+
+
+def run_speed_and_distance(dataset, args, tracks):
+    SpeedAndDistance_Estimator(frame_rate=dataset["fps"]).add_speed_and_distance_to_tracks(tracks)
+
+
+def setup_team_assignment(dataset, args):
+    return make_table(dataset), TeamAssigner()
+
+
+def run_team_assignment(dataset, args, tracks, team_assigner):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        team_assigner.add_color_samples(dataset["frames"], tracks['player'])
+        team_assigner.assign_teams_by_vote()
+        team_assigner.add_teams_to_tracks(tracks)
+
+
+def run_ball_assignment(dataset, args, tracks):
+    return PlayerBallAssigner().assign_ball_to_players(tracks)
+
+
+def setup_pass_counting(dataset, args):
+    tracks = make_table(dataset, analyzed=True)
+    return tracks, make_team_assigner(tracks), PlayerBallAssigner().assign_ball_to_players(tracks)
+
+
+def run_pass_counting(dataset, args, tracks, team_assigner, assigned_players):
+    pass_counter = PassCounter(team_assigner)
+    # count_pass prints every frame, as in main.py; the printing is part of the cost but not the terminal
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for frame_num, player_track in enumerate(tracks['player']):
+            assigned_player = int(assigned_players[frame_num])
+            if assigned_player != -1:
+                pass_counter.count_pass(player_track, tracks['ball'][frame_num][1]['bbox'], frame_num, assigned_player)
+    return pass_counter.passes_count
+
+
+def setup_rendering(dataset, args):
+    tracks = make_table(dataset, analyzed=True)
+    team_ball_control = get_team_ball_control(tracks, PlayerBallAssigner().assign_ball_to_players(tracks))
+    compositor = FrameCompositor(make_tracker(), tracks, team_ball_control, dataset["camera_movement"])
+    return compositor, [frame.copy() for frame in dataset["frames"]]
+
+
+def run_rendering(dataset, args, compositor, frames):
+    for _ in compositor.draw_frames(frames):
+        pass
+
+
+def setup_encoding(dataset, args, backend="opencv"):
+    if backend == "ffmpeg" and shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg is not installed")
+    compositor, frames = setup_rendering(dataset, args)
+    run_rendering(dataset, args, compositor, frames)
+    output_dir = tempfile.mkdtemp(prefix='stage_benchmark_')
+    return frames, os.path.join(output_dir, 'output.mp4'), backend
+
+
+def run_encoding(dataset, args, frames, output_path, backend):
+    try:
+        with VideoEncoder(output_path, fps=dataset["fps"], backend=backend, codec='mp4v') as encoder:
+            for frame in frames:
+                encoder.write(frame)
+    finally:
+        shutil.rmtree(os.path.dirname(output_path), ignore_errors=True)
+
+
+# name: (needs frames, setup, run), in pipeline order
+STAGES = {
+    "decode": (True, setup_decode, run_decode),
+    "detection": (True, setup_detection, run_detection),
+    "tracking": (False, setup_tracking, run_tracking),
+    "add_position_to_tracks": (False, setup_table, run_add_position),
+    "camera_movement": (True, setup_camera_movement, run_camera_movement),
+    "view_transform": (False, setup_table, run_view_transform),
+    "ball_interpolation": (False, setup_table, run_ball_interpolation),
+    "speed_and_distance": (False, setup_speed_and_distance, run_speed_and_distance),
+    "team_assignment": (True, setup_team_assignment, run_team_assignment),
+    "ball_assignment": (False, setup_table, run_ball_assignment),
+    "pass_counting": (False, setup_pass_counting, run_pass_counting),
+    "rendering": (True, setup_rendering, run_rendering),
+    "encoding_opencv": (True, setup_encoding, run_encoding),
+    "encoding_ffmpeg": (True, lambda dataset, args: setup_encoding(dataset, args, "ffmpeg"), run_encoding),
+}
+
+
+def measure_stage(stage, dataset, args):
+    _, setup, run = STAGES[stage]
+    # the tracemalloc run also warms up caches and lazy imports before the timed runs
+    inputs = setup(dataset, args)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        run(dataset, args, *inputs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = float('inf')
+    for _ in range(args.repeats):
+        inputs = setup(dataset, args)
+        start = time.perf_counter()
+        run(dataset, args, *inputs)
+        best = min(best, time.perf_counter() - start)
+    return {"seconds": best, "fps": dataset["num_frames"] / best if best > 0 else float('inf'),
+            "peak_mb": peak / 1e6, "frames": dataset["num_frames"]}
+
+
+def compare(key, result, baseline, args):
+    # list of regression messages for one stage
+    if baseline is None:
+        return []
+    regressions = []
+    per_frame = result["seconds"] / result["frames"]
+    baseline_per_frame = baseline["seconds"] / baseline["frames"]
+    if (per_frame > baseline_per_frame * (1 + args.threshold)
+            and result["seconds"] - baseline_per_frame * result["frames"] > args.min_seconds):
+        regressions.append(f"{key}: {per_frame * 1e3:.3f} ms/frame, baseline {baseline_per_frame * 1e3:.3f}")
+    if result["peak_mb"] > baseline["peak_mb"] * (1 + args.memory_threshold) + 1:
+        regressions.append(f"{key}: peak {result['peak_mb']:.1f} MB, baseline {baseline['peak_mb']:.1f}")
+    return regressions
+
+
+def get_machine():
+    return {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(),
+            "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default=os.path.join(REPO_DIR, 'input_videos', 'videoplayback - Trim.mp4'))
+    parser.add_argument('--tracks-stub', default=os.path.join(REPO_DIR, 'stubs', 'track_stubs.pkl'))
+    parser.add_argument('--camera-stub', default=os.path.join(REPO_DIR, 'stubs', 'camera_movment_stub.pkl'))
+    parser.add_argument('--model', default=os.path.join(REPO_DIR, 'models', 'best.pt'))
+    parser.add_argument('--frames', type=int, default=120, help='frames of the sample video to use')
+    parser.add_argument('--scales', type=int, nargs='*', default=[1, 10],
+                        help='synthetic datasets, in multiples of the track stub length')
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown per frame, 0.25 = 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help='allowed peak memory growth')
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help='slowdowns smaller than this are timer noise, not regressions')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    video_dataset = load_video_dataset(args)
+    with open(args.tracks_stub, 'rb') as f:
+        stub_length = len(pickle.load(f)['player'])
+    datasets = [video_dataset] + [load_synthetic_dataset(stub_length * scale, video_dataset["fps"],
+                                                         video_dataset["frame_size"]) for scale in args.scales]
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored.get("machine") != get_machine():
+            print(f"Note: the baseline was recorded on a different machine ({stored.get('machine')})")
+
+    results, skipped, regressions = {}, {}, []
+    print(f"{'stage':>24} {'dataset':>16} {'frames':>7} {'seconds':>9} {'frames/s':>10} {'peak MB':>9} {'vs baseline':>12}")
+    for dataset in datasets:
+        for stage in args.stages:
+            if STAGES[stage][0] and dataset["frames"] is None:
+                continue
+            key = f"{stage}@{dataset['name']}"
+            try:
+                result = measure_stage(stage, dataset, args)
+            except Exception as e:
+                reason = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+                skipped[key] = reason
+                print(f"{stage:>24} {dataset['name']:>16}  skipped: {reason}")
+                continue
+            results[key] = result
+            regressions += compare(key, result, baseline.get(key), args)
+            change = ""
+            if key in baseline:
+                baseline_per_frame = baseline[key]["seconds"] / baseline[key]["frames"]
+                change = f"{result['seconds'] / result['frames'] / baseline_per_frame - 1:+.0%}"
+            print(f"{stage:>24} {dataset['name']:>16} {result['frames']:>7} {result['seconds']:>9.4f} "
+                  f"{result['fps']:>10.1f} {result['peak_mb']:>9.1f} {change:>12}")
+
+    report = {"created": time.strftime('%Y-%m-%dT%H:%M:%S'), "machine": get_machine(),
+              "settings": {"frames": args.frames, "scales": args.scales, "repeats": args.repeats},
+              "results": results, "skipped": skipped}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions" if baseline else "\nNo baseline yet, run with --save-baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
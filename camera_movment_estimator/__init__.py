@@ -1 +1,2 @@
-from .camera_movment_estimator import CameraMovmentEstimator
\ No newline at end of file
+from .camera_movment_estimator import CameraMovmentEstimator
+from .motion_backends import PhaseCorrelationBackend, MOTION_BACKENDS
@@ -4,11 +4,16 @@ import numpy as np
 import sys
 import os
 sys.path.append('../')
-from utils import measure_distance, measure_xy_distance
+from utils import measure_distance, measure_xy_distance, save_stub, TrackTable
+from concurrent.futures import ProcessPoolExecutor
+from .motion_backends import MOTION_BACKENDS
+
 class CameraMovmentEstimator():
-    def __init__(self, frame):
+    def __init__(self, frame, downscale=1.0, motion_backend="lucas_kanade", backend_params=None):
         
         self.minimum_distance = 5
+        # optical flow runs on frames resized by this factor, movements are reported in full-resolution pixels
+        self.downscale = downscale
         self.lk_params = dict(
             winSize = (15,15),
             maxLevel = 2,
@@ -20,6 +25,8 @@ class CameraMovmentEstimator():
         mask_features = np.zeros_like(first_frame_grayscale)
         mask_features[:,0:20] = 1
         mask_features[:,900:1050] = 1
+        if self.downscale != 1.0:
+            mask_features = cv2.resize(mask_features, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_NEAREST)
         self.features = dict(
             maxCorners = 100,
             qualityLevel = 0.3,
@@ -27,10 +34,56 @@ class CameraMovmentEstimator():
             blockSize = 7,
             mask = mask_features
         ) 
-        
+        self.old_gray = None
+        self.old_features = None
+
+        # "lucas_kanade" is the feature tracker below; any other name is looked up in
+        # MOTION_BACKENDS, or an object with estimate(frame) / reset() / get_params() can be passed
+        if isinstance(motion_backend, str):
+            if motion_backend != "lucas_kanade" and motion_backend not in MOTION_BACKENDS:
+                raise ValueError(f"Unknown motion backend: {motion_backend}")
+            self.motion_backend = None if motion_backend == "lucas_kanade" else \
+                MOTION_BACKENDS[motion_backend](frame, **(backend_params or {}))
+        else:
+            self.motion_backend = motion_backend
         
     
+    def get_backend_params(self):
+        if self.motion_backend is None:
+            return {"name": "lucas_kanade"}
+        return self.motion_backend.get_params()
+
+    def get_cache_params(self):
+        features = {key: value for key, value in self.features.items() if key != 'mask'}
+        features['mask_shape'] = self.features['mask'].shape
+        return {
+            "lk_params": self.lk_params,
+            "features": features,
+            "minimum_distance": self.minimum_distance,
+            "downscale": self.downscale,
+            "motion_backend": self.get_backend_params(),
+        }
+
+    def get_settings(self):
+        # parameters a worker process needs to rebuild an identical estimator
+        return {
+            "lk_params": self.lk_params,
+            "features": {key: value for key, value in self.features.items() if key != 'mask'},
+            "minimum_distance": self.minimum_distance,
+            "motion_backend": self.get_backend_params(),
+        }
+
+    def to_gray(self, frame):
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.downscale != 1.0:
+            frame_gray = cv2.resize(frame_gray, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+        return frame_gray
+
     def add_adjust_positions_to_tracks (self, tracks, camera_movement_per_frame): 
+        if isinstance(tracks, TrackTable):
+            camera_movement = np.asarray(camera_movement_per_frame, dtype=np.float32).reshape(-1, 2)
+            tracks.position_adjusted = tracks.position - camera_movement[tracks.frame]
+            return
         for object, object_tracks in tracks.items():
             for frame_num, track in enumerate(object_tracks):
                 for track_id, track_info in track.items():
@@ -38,47 +91,109 @@ class CameraMovmentEstimator():
                     camera_movement = camera_movement_per_frame[frame_num]
                     position_adjusted = (position[0]-camera_movement[0], position [1]-camera_movement [1])
                     tracks [object][frame_num] [track_id]['position_adjusted'] = position_adjusted       
+    def update_camera_movment(self, frames):
+        """
+        Estimate the camera movement for the next window of frames.
+        The last grayscale frame and its features are kept on the estimator,
+        so consecutive windows give the same result as one pass over the whole video.
+        """
+        if self.motion_backend is not None:
+            return [self.motion_backend.estimate(frame) for frame in frames]
+
+        camera_movement = []
+        for frame in frames:
+            frame_gray = self.to_gray(frame)
+            if self.old_gray is None:
+                self.old_gray = frame_gray
+                self.old_features = cv2.goodFeaturesToTrack(frame_gray, **self.features)
+                camera_movement.append([0, 0])
+                continue
+
+            if self.old_features is None:
+                # No corners found in the previous frame, look again on this one
+                self.old_features = cv2.goodFeaturesToTrack(frame_gray, **self.features)
+                self.old_gray = frame_gray
+                camera_movement.append([0, 0])
+                continue
+
+            new_features, _, _ = cv2.calcOpticalFlowPyrLK(self.old_gray, frame_gray, self.old_features, None, **self.lk_params)
+
+            # largest feature displacement, old - new as in measure_xy_distance
+            displacements = (self.old_features - new_features).reshape(-1, 2) / self.downscale
+            distances = np.hypot(displacements[:, 0], displacements[:, 1])
+            max_index = int(distances.argmax()) if len(distances) else 0
+            max_distance = distances[max_index] if len(distances) else 0
+            if max_distance > self.minimum_distance:
+                camera_movement_x, camera_movement_y = displacements[max_index].tolist()
+                camera_movement.append([camera_movement_x, camera_movement_y])
+                self.old_features = cv2.goodFeaturesToTrack(frame_gray,**self.features)
+            else:
+                camera_movement.append([0, 0])
+                
+            self.old_gray = frame_gray.copy()
+            
+        return camera_movement
+
     def get_camera_movment(self, frames, read_from_stub = False, stub_path = None):
         # Read the stub
         if read_from_stub and stub_path is not None and os.path.exists(stub_path):
             with open(stub_path, 'rb') as f:
                 return pickle.load(f)  
         
-        camera_movement = [[0, 0]] * len(frames)
-
-        old_gray = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
-        old_features = cv2.goodFeaturesToTrack(old_gray, **self.features)
+        self.old_gray = None
+        self.old_features = None
+        if self.motion_backend is not None:
+            self.motion_backend.reset()
+        camera_movement = self.update_camera_movment(frames)
+            
+        if stub_path is not None:
+            save_stub(stub_path, camera_movement)
+            
+        return camera_movement
+    
+    def get_camera_movment_parallel(self, video_path, num_workers=None, chunk_size=500, overlap=10,
+                                    read_from_stub = False, stub_path = None):
+        """
+        Estimate the camera movement of a video file with a process pool.
+        The video is split into chunks of chunk_size frames; every worker decodes
+        its chunk starting overlap frames early, so the tracked features have
+        settled by the time the chunk starts, and only the chunk's own frames are kept.
+        The chunk results are stitched back into one camera_movement list.
+        """
+        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
+            with open(stub_path, 'rb') as f:
+                return pickle.load(f)
 
-        for frame_num in range(1, len(frames)):
-            frame_gray = cv2.cvtColor(frames[frame_num], cv2.COLOR_BGR2GRAY)
-            new_features, _, _ = cv2.calcOpticalFlowPyrLK(old_gray, frame_gray, old_features, None, **self.lk_params)
+        cap = cv2.VideoCapture(video_path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
 
-            max_distance = 0
-            camera_movement_x, camera_movement_y = 0,0
+        chunk_starts = list(range(0, max(frame_count, 1), chunk_size))
+        chunks = [(start, start + chunk_size if index < len(chunk_starts) - 1 else None)
+                  for index, start in enumerate(chunk_starts)]
 
-            for i, (new, old) in enumerate(zip(new_features, old_features)):
-                new_features_point = new.ravel()
-                old_features_point = old.ravel()
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(
+                _estimate_chunk,
+                [video_path] * len(chunks),
+                [start for start, _ in chunks],
+                [end for _, end in chunks],
+                [overlap] * len(chunks),
+                [self.downscale] * len(chunks),
+                [self.get_settings()] * len(chunks),
+            )
+            camera_movement = []
+            for chunk_movement in results:
+                camera_movement.extend(chunk_movement)
 
-                distance = measure_distance(new_features_point, old_features_point)
-                if distance > max_distance:
-                    max_distance = distance
-                    camera_movement_x, camera_movement_y = measure_xy_distance(old_features_point, new_features_point)
-            if max_distance > self.minimum_distance:
-                camera_movement[frame_num] = [camera_movement_x, camera_movement_y]
-                old_features = cv2.goodFeaturesToTrack(frame_gray,**self.features)
-                
-            old_gray = frame_gray.copy()
-            
         if stub_path is not None:
-            with open(stub_path,'wb') as f:
-                pickle.dump(camera_movement, f)
-            
+            save_stub(stub_path, camera_movement)
+
         return camera_movement
-    
-    def draw_camera_movment(self, frames, camera_movment_per_frame):
+
+    def draw_camera_movment(self, frames, camera_movment_per_frame, start_frame=0):
         output_frames = []
-        for frame_num, frame in enumerate(frames):
+        for frame_num, frame in enumerate(frames, start_frame):
             frame = frame.copy()
             
             overlay = frame.copy()
@@ -93,7 +208,33 @@ class CameraMovmentEstimator():
             output_frames.append(frame)
             
         return output_frames
-          
 
-        
-        
\ No newline at end of file
+
+def _estimate_chunk(video_path, start, end, overlap, downscale, settings):
+    # runs in a worker process: camera movement of frames [start, end), end=None means until the end
+    warmup_start = max(start - overlap, 0)
+    cap = cv2.VideoCapture(video_path)
+    if warmup_start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+
+    estimator = None
+    camera_movement = []
+    frame_num = warmup_start
+    while end is None or frame_num < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if estimator is None:
+            backend_params = dict(settings["motion_backend"])
+            estimator = CameraMovmentEstimator(frame, downscale=downscale,
+                                               motion_backend=backend_params.pop("name"), backend_params=backend_params)
+            estimator.lk_params = settings["lk_params"]
+            estimator.features.update(settings["features"])
+            estimator.minimum_distance = settings["minimum_distance"]
+        movement = estimator.update_camera_movment([frame])[0]
+        if frame_num >= start:
+            camera_movement.append(movement)
+        frame_num += 1
+    cap.release()
+    return camera_movement
+
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+
+
+class PhaseCorrelationBackend:
+    """
+    Cheap global-translation camera motion: cv2.phaseCorrelate between
+    consecutive downscaled grayscale frames, on the whole frame or on a few ROIs.
+
+    rois are (x1, y1, x2, y2) fractions of the frame size, e.g. the side strips
+    of a broadcast layout; the ROI with the strongest correlation peak wins.
+    Movements below minimum_distance pixels are reported as 0, and the result
+    uses the same sign as the Lucas-Kanade path (old position - new position).
+    """
+
+    name = "phase_correlation"
+
+    def __init__(self, frame, rois=None, downscale=0.25, minimum_distance=0.5):
+        self.downscale = downscale
+        self.minimum_distance = minimum_distance
+        self.rois = rois if rois is not None else [(0.0, 0.0, 1.0, 1.0)]
+
+        height, width = self.to_gray(frame).shape
+        self.roi_slices = []
+        for x1, y1, x2, y2 in self.rois:
+            self.roi_slices.append((slice(int(y1 * height), max(int(y2 * height), int(y1 * height) + 1)),
+                                    slice(int(x1 * width), max(int(x2 * width), int(x1 * width) + 1))))
+        self.windows = [cv2.createHanningWindow((roi_x.stop - roi_x.start, roi_y.stop - roi_y.start), cv2.CV_32F)
+                        for roi_y, roi_x in self.roi_slices]
+        self.old_gray = None
+
+    def get_params(self):
+        return {
+            "name": self.name,
+            "rois": self.rois,
+            "downscale": self.downscale,
+            "minimum_distance": self.minimum_distance,
+        }
+
+    def reset(self):
+        self.old_gray = None
+
+    def to_gray(self, frame):
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.downscale != 1.0:
+            frame_gray = cv2.resize(frame_gray, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+        return np.float32(frame_gray)
+
+    def estimate(self, frame):
+        frame_gray = self.to_gray(frame)
+        if self.old_gray is None:
+            self.old_gray = frame_gray
+            return [0, 0]
+
+        best_shift, best_response = (0.0, 0.0), -1.0
+        for (roi_y, roi_x), window in zip(self.roi_slices, self.windows):
+            shift, response = cv2.phaseCorrelate(self.old_gray[roi_y, roi_x], frame_gray[roi_y, roi_x], window)
+            if response > best_response:
+                best_shift, best_response = shift, response
+        self.old_gray = frame_gray
+
+        movement_x = -best_shift[0] / self.downscale
+        movement_y = -best_shift[1] / self.downscale
+        if (movement_x ** 2 + movement_y ** 2) ** 0.5 <= self.minimum_distance:
+            return [0, 0]
+        return [movement_x, movement_y]
+
+
+MOTION_BACKENDS = {
+    PhaseCorrelationBackend.name: PhaseCorrelationBackend,
+}
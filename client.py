@@ -3,6 +3,10 @@ import socket
 import struct
 import cv2
 import os
+import time
+import json
+import ssl
+import urllib.request
 import numpy as np
 import tqdm
 from PyQt5.QtWidgets import (
@@ -10,10 +14,89 @@ from PyQt5.QtWidgets import (
     QSizePolicy, QSlider, QHBoxLayout
 )
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import Qt, QUrl
+from PyQt5.QtCore import Qt, QUrl, QThread, pyqtSignal
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from encryption import xor_encrypt_decrypt, SECRET_KEY
+from encryption import SECRET_KEY
+from upload_protocol import send_file, recv_message, UploadError
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_RETRIES = 5
+UPLOAD_RETRY_DELAY = 2
+JOB_POLL_INTERVAL = 2
+
+class UploadWorker(QThread):
+    # ההעלאה, הניסיונות החוזרים ובדיקת הסטטוס רצים בחוט נפרד כדי שהחלון לא יקפא;
+    # הממשק מקבל את כתובת הווידאו באות
+    video_ready = pyqtSignal(str)
+
+    def __init__(self, server_address, file_path):
+        super().__init__()
+        self.server_address = server_address
+        self.file_path = file_path
+
+    def run(self):
+        self.send_video_to_server(self.file_path)
+
+    def send_video_to_server(self, file_path):
+        # אם החיבור נופל, מתחברים מחדש וממשיכים מהמקום שהשרת כבר שמר
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            progress = tqdm.tqdm(unit="B", unit_scale=True, total=os.path.getsize(file_path), desc="Uploading", colour="green")
+            try:
+                client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                client_socket.connect(self.server_address)
+                send_file(client_socket, file_path, SECRET_KEY, UPLOAD_CHUNK_SIZE, on_progress=progress.update)
+                progress.close()
+
+                print("✅ Video sent to server successfully.")
+                self.receive_video_stream(client_socket)
+                return
+
+            except (ConnectionError, socket.timeout, UploadError) as e:
+                progress.close()
+                client_socket.close()
+                print(f"❌ Upload interrupted ({e}), attempt {attempt}/{UPLOAD_RETRIES}")
+                time.sleep(UPLOAD_RETRY_DELAY)
+            except Exception as e:
+                print(f"❌ Error: {e}")
+                return
+
+    def receive_video_stream(self, client_socket):
+        print("📡 Waiting for the analysis job...")
+        try:
+            reply = recv_message(client_socket)
+            client_socket.close()
+            if "error" in reply:
+                print(f"❌ Server refused the video: {reply['error']}")
+                return
+
+            # השרת מחזיר מזהה עבודה מיד; בודקים את הסטטוס עד שהווידאו מוכן לניגון
+            # (פלייליסט מקטעים אפשר לנגן כבר כשהמקטעים הראשונים נכתבים)
+            status_url = reply["status_url"].replace("http://", "https://")
+            print(f"🕒 Job {reply['job_id']} queued")
+            stream_url = None
+            while True:
+                with urllib.request.urlopen(status_url, context=ssl._create_unverified_context()) as response:
+                    job = json.load(response)
+                if job["status"] == "failed":
+                    print(f"❌ Analysis failed: {job['error']}")
+                    return
+                if job.get("video_url") and stream_url is None:
+                    stream_url = job["video_url"]
+                    if stream_url.startswith("http://"):
+                        stream_url = stream_url.replace("http://", "https://")
+                    print(f"🎬 Video URL received: {stream_url}")
+                    self.video_ready.emit(stream_url)
+                # פלייליסט שעדיין גדל מתנגן כבר עכשיו, ממשיכים לדווח התקדמות עד שהעבודה מסתיימת
+                if job["status"] == "done":
+                    return
+                progress = job.get("progress") or {}
+                if progress.get("total"):
+                    print(f"⏳ {job['status']} {progress['stage']}: {progress['done']}/{progress['total']} frames")
+                time.sleep(JOB_POLL_INTERVAL)
+        except Exception as e:
+            print(f"❌ Error during receiving URL: {e}")
+
 
 class SoccerAnalysisApp(QMainWindow):
     def __init__(self):
@@ -180,54 +263,15 @@ class SoccerAnalysisApp(QMainWindow):
     def upload_video(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select a Soccer Video", "", "Video Files (*.mp4 *.avi *.mov *.mkv)")
         if file_path:
-            self.send_video_to_server(file_path)
-
-    def send_video_to_server(self, file_path):
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect(self.server_address)
-
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-            client_socket.sendall(f"{file_name}<SEPARATOR>{file_size}".encode())
-
-
-        # קריאה אחת בלבד לקובץ והצפנה שלו
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-
-            encrypted_data = xor_encrypt_decrypt(file_data, SECRET_KEY)
-
-        # שליחה בהדרגה של כל הנתונים המוצפנים
-            progress = tqdm.tqdm(unit="B", unit_scale=True, total=len(encrypted_data), desc="Uploading", colour="green")
-            client_socket.sendall(encrypted_data)
-            progress.update(len(encrypted_data))
-
-            print("✅ Video sent to server successfully.")
-            self.receive_video_stream(client_socket)
-
-        except Exception as e:
-            print(f"❌ Error: {e}")
-
-
-    def receive_video_stream(self, client_socket):
-        print("📡 Receiving video stream URL...")
-        try:
-            url_data = b""
-            while True:
-                chunk = client_socket.recv(4096)
-                if not chunk:
-                    break
-                url_data += chunk
-            stream_url = url_data.decode().strip()
-            if stream_url.startswith("http://"):
-                stream_url = stream_url.replace("http://", "https://")
-            print(f"🎬 Video URL received: {stream_url}")
-            self.player.setMedia(QMediaContent(QUrl(stream_url)))
-            self.player.play()
-        except Exception as e:
-            print(f"❌ Error during receiving URL: {e}")
-        
+            self.upload_button.setEnabled(False)
+            self.upload_worker = UploadWorker(self.server_address, file_path)
+            self.upload_worker.video_ready.connect(self.play_video)
+            self.upload_worker.finished.connect(lambda: self.upload_button.setEnabled(True))
+            self.upload_worker.start()
+
+    def play_video(self, stream_url):
+        self.player.setMedia(QMediaContent(QUrl(stream_url)))
+        self.player.play()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
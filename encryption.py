@@ -1,8 +1,41 @@
+import numpy as np
 
-def xor_encrypt_decrypt(data: bytes, key: bytes) -> bytes:
-    key_length = len(key)
-    return bytes([data[i] ^ key[i % key_length] for i in range(len(data))])
+
+class XorCipher:
+    """
+    Streaming XOR cipher: the position in the key is kept across calls, so
+    encrypting a file chunk by chunk gives the same bytes as encrypting it at once.
+    Chunks are XORed with NumPy against a pre-tiled key stream of block_size bytes.
+    """
+
+    def __init__(self, key: bytes, offset: int = 0, block_size: int = 1 << 20):
+        self.key = np.frombuffer(key, dtype=np.uint8)
+        self.offset = offset
+        key_length = len(self.key)
+        self._block_size = max(block_size // key_length, 1) * key_length
+        # one extra key length so a block can start at any phase of the key
+        self._key_stream = np.tile(self.key, self._block_size // key_length + 1)
+
+    def process_into(self, buffer):
+        # encrypt / decrypt a writable buffer (bytearray, memoryview, uint8 array) in place
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        key_length = len(self.key)
+        for start in range(0, len(data), self._block_size):
+            block = data[start:start + self._block_size]
+            phase = (self.offset + start) % key_length
+            np.bitwise_xor(block, self._key_stream[phase:phase + len(block)], out=block)
+        self.offset += len(data)
+        return buffer
+
+    def process(self, data) -> bytearray:
+        # same as process_into, on a copy of data
+        return self.process_into(bytearray(data))
+
+
+def xor_encrypt_decrypt(data: bytes, key: bytes, offset: int = 0) -> bytes:
+    # offset: position of data in the whole stream, so a stream can be decrypted chunk by chunk
+    return bytes(XorCipher(key, offset).process(data))
 
 # מפתח הצפנה - חשוב שיהיה זהה גם לשרת וגם ללקוח
-SECRET_KEY = b'SuperSecret123'  
+SECRET_KEY = b'SuperSecret123'
 # אתה יכול לשנות אבל תשמור אותו זהה גם בלקוח וגם בשרת
@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+import sys
+sys.path.append('../')
+from utils import get_foot_position
+
+
+class FrameCompositor:
+    """
+    Draws every annotation layer of a frame in one pass, in place: player and
+    referee ellipses, ball / possession triangles, the team ball control box,
+    the camera movement box and the speed / distance labels.
+
+    Same output as Tracker.draw_annotations + draw_camera_movment +
+    draw_speed_and_distance, but without copying the frame: only the two
+    semi-transparent boxes are blended, on their own ROI. Ball control
+    percentages come from cumulative counts computed once for the whole video
+    instead of rescanning team_ball_control[:frame_num+1] on every frame.
+    When the tracks are one window of a longer video, initial_control holds the
+    frames each team had the ball before it.
+    """
+
+    def __init__(self, tracker, tracks, team_ball_control, camera_movment_per_frame, initial_control=(0, 0)):
+        self.tracker = tracker
+        self.tracks = tracks
+        self.camera_movment_per_frame = camera_movment_per_frame
+
+        team_ball_control = np.asarray(team_ball_control)
+        team_1_num_frames = np.cumsum(team_ball_control == 1) + initial_control[0]
+        team_2_num_frames = np.cumsum(team_ball_control == 2) + initial_control[1]
+        total = team_1_num_frames + team_2_num_frames
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.team_1_control = np.where(total > 0, team_1_num_frames / total, 0.0)
+            self.team_2_control = np.where(total > 0, team_2_num_frames / total, 0.0)
+
+    def blend_rectangle(self, frame, top_left, bottom_right, color, alpha):
+        # cv2.rectangle(overlay, ..., -1) + addWeighted, restricted to the rectangle
+        x1, y1 = max(top_left[0], 0), max(top_left[1], 0)
+        x2, y2 = min(bottom_right[0] + 1, frame.shape[1]), min(bottom_right[1] + 1, frame.shape[0])
+        if x1 >= x2 or y1 >= y2:
+            return frame
+        roi = frame[y1:y2, x1:x2]
+        overlay = np.empty_like(roi)
+        overlay[:] = color
+        frame[y1:y2, x1:x2] = cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0)
+        return frame
+
+    def draw_objects(self, frame, player_dict, referee_dict, ball_dict):
+        for track_id, player in player_dict.items():
+            color = player.get("team_color", (0,0,225))
+            self.tracker.draw_ellipse(frame, player["bbox"], color, track_id)
+            if player.get('has_ball', False):
+                self.tracker.draw_traingle(frame, player['bbox'], (0,0,225))
+
+        for _, referee in referee_dict.items():
+            self.tracker.draw_ellipse(frame, referee["bbox"], (0,255,225))
+
+        for _, ball in ball_dict.items():
+            self.tracker.draw_traingle(frame, ball["bbox"], (0,255,0))
+
+    def draw_team_ball_control(self, frame, frame_num):
+        self.blend_rectangle(frame, (1350, 850), (1900, 970), (255, 255, 255), 0.4)
+        cv2.putText(frame, f"Team 1 Ball Control: {self.team_1_control[frame_num] * 100:.2f}%", (1400, 900),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
+        cv2.putText(frame, f"Team 2 Ball Control: {self.team_2_control[frame_num] * 100:.2f}%", (1400, 950),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
+
+    def draw_camera_movment(self, frame, frame_num):
+        self.blend_rectangle(frame, (0, 0), (500, 100), (255, 255, 255), 0.6)
+        x_movment, y_movment = self.camera_movment_per_frame[frame_num]
+        cv2.putText(frame, f"Camera Movment x: {x_movment: .2f}", (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,0), 3)
+        cv2.putText(frame, f"Camera Movment y: {y_movment: .2f}", (10,60), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,0), 3)
+
+    def draw_speed_and_distance(self, frame, player_dict):
+        for _, track_info in player_dict.items():
+            speed = track_info.get('speed', None)
+            distance = track_info.get('distance', None)
+            if speed is None or distance is None:
+                continue
+
+            position = list(get_foot_position(track_info['bbox']))
+            position[1] += 40
+            position = tuple(map(int, position))
+            cv2.putText(frame, f"{speed: .2f} km/h", position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 2)
+            cv2.putText(frame, f"{distance: .2f} m", (position[0], position[1]+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 2)
+
+    def draw_frame(self, frame, frame_num):
+        player_dict = self.tracks["player"][frame_num]
+        self.draw_objects(frame, player_dict, self.tracks["referees"][frame_num], self.tracks["ball"][frame_num])
+        self.draw_team_ball_control(frame, frame_num)
+        self.draw_camera_movment(frame, frame_num)
+        self.draw_speed_and_distance(frame, player_dict)
+        return frame
+
+    def draw_frames(self, frames, start_frame=0):
+        # frames are annotated in place and yielded as they are done
+        for frame_num, frame in enumerate(frames, start_frame):
+            yield self.draw_frame(frame, frame_num)
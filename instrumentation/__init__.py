@@ -0,0 +1 @@
+from .registry import MetricsRegistry, JobProfile, metrics, read_snapshots, render_prometheus
\ No newline at end of file
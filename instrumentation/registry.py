@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+PREFIX = "soccer_"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 15, 20, 25, 30, 40, 50)
+
+# name: (type, help, histogram buckets)
+METRIC_DEFINITIONS = {
+    "frames_decoded_total": ("counter", "Video frames decoded", None),
+    "stage_seconds": ("histogram", "Busy time of a pipeline stage per batch or run", SECONDS_BUCKETS),
+    "stage_frames_total": ("counter", "Frames processed by a pipeline stage", None),
+    "inference_batch_seconds": ("histogram", "Detector latency per inference batch and pass", SECONDS_BUCKETS),
+    "ball_detections_total": ("counter", "Keyframes by where the ball was found (crop, full_frame or missed)", None),
+    "ball_measurements_total": ("counter", "Ball detections the ball filter accepted, rejected, restarted on or missed", None),
+    "detection_frames_total": ("counter", "Frames the detector ran on (keyframe) or skipped (propagated)", None),
+    "detections_per_frame": ("histogram", "Detections returned by the detector per frame", COUNT_BUCKETS),
+    "encode_frames_total": ("counter", "Frames written by the video encoders", None),
+    "encode_seconds_total": ("counter", "Time the encoder threads spent writing frames", None),
+    "encode_fps": ("gauge", "Frames per second of the last finished video encoder", None),
+    "queue_depth": ("gauge", "Items waiting in a bounded queue", None),
+    "uploads_active": ("gauge", "Uploads being received", None),
+    "uploads_total": ("counter", "Finished upload connections by result", None),
+    "upload_bytes_total": ("counter", "Upload bytes received", None),
+    "upload_seconds_total": ("counter", "Time spent receiving uploads per stage", None),
+    "job_duration_seconds": ("histogram", "Wall-clock time of analysis jobs", JOB_BUCKETS),
+    "jobs_pending": ("gauge", "Analysis jobs waiting or running", None),
+    "jobs": ("gauge", "Analysis jobs on disk by status", None),
+}
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of one process.
+
+    Recording takes a lock and a dict update, cheap enough for per-batch and
+    per-frame calls. Hooks added with add_hook(hook) are called as
+    hook(kind, name, value, labels) for every recorded value (used for the
+    per-job profiles). Job worker processes write their values to a snapshot
+    file (start_snapshots / write_snapshot) that the server merges into /metrics.
+    """
+
+    def __init__(self, definitions=METRIC_DEFINITIONS):
+        self.definitions = definitions
+        self._values = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._snapshot_path = None
+
+    def _get_key(self, name, labels):
+        if name not in self.definitions:
+            raise KeyError(f"Unknown metric: {name}")
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def _notify(self, kind, name, value, labels):
+        for hook in self._hooks:
+            hook(kind, name, value, labels)
+
+    def inc(self, name, value=1, **labels):
+        # also adds to (or with a negative value, subtracts from) a gauge
+        key = self._get_key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        self._notify(self.definitions[name][0], name, value, labels)
+
+    def set_gauge(self, name, value, **labels):
+        key = self._get_key(name, labels)
+        with self._lock:
+            self._values[key] = value
+        self._notify("gauge", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = self._get_key(name, labels)
+        buckets = self.definitions[name][2]
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                # per-bucket counts (not cumulative) plus the +Inf bucket
+                histogram = self._values[key] = {"buckets": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            histogram["buckets"][bisect_left(buckets, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+        self._notify("histogram", name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_hook(self, hook):
+        self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        self._hooks = [other for other in self._hooks if other is not hook]
+
+    def snapshot(self):
+        with self._lock:
+            values = [[name, dict(labels), json.loads(json.dumps(value))] for (name, labels), value in self._values.items()]
+        return {"pid": os.getpid(), "time": time.time(), "values": values}
+
+    def write_snapshot(self, path=None):
+        path = path or self._snapshot_path
+        if path is None:
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start_snapshots(self, path, interval=5.0):
+        """
+        Write a snapshot to path every interval seconds from a daemon thread,
+        and on every write_snapshot() without a path.
+        """
+        self._snapshot_path = path
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    print(f"Unable to write metrics snapshot: {e}")
+
+        threading.Thread(target=write_periodically, daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class JobProfile:
+    """
+    Hook that aggregates everything recorded while one job runs: count, sum
+    and max of every series (the last value for gauges).
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.series = {}
+
+    def __call__(self, kind, name, value, labels):
+        key = name + ''.join(f",{label}={labels[label]}" for label in sorted(labels))
+        series = self.series.setdefault(key, {"type": kind, "count": 0, "sum": 0.0, "max": value})
+        series["count"] += 1
+        series["sum"] += value
+        series["max"] = max(series["max"], value)
+        if kind == "gauge":
+            series["last"] = value
+
+    def to_dict(self):
+        return {"started": self.start, "wall_seconds": time.time() - self.start,
+                "series": dict(sorted(self.series.items()))}
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots(metrics_dir):
+    """
+    The snapshots in metrics_dir. Counters and histograms of processes that
+    have exited are kept, their gauges are dropped.
+    """
+    snapshots = []
+    if not os.path.isdir(metrics_dir):
+        return snapshots
+    for name in os.listdir(metrics_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not _process_alive(snapshot["pid"]):
+            snapshot["values"] = [value for value in snapshot["values"]
+                                  if METRIC_DEFINITIONS.get(value[0], ("gauge",))[0] != "gauge"]
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in items]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render_prometheus(snapshots, definitions=METRIC_DEFINITIONS, prefix=PREFIX):
+    """
+    Merge the snapshots (counters, histograms and gauges are summed across
+    processes) and format them in the Prometheus text exposition format.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["values"]:
+            if name not in definitions:
+                continue
+            key = name, tuple(sorted(labels.items()))
+            if isinstance(value, dict):
+                total = merged.setdefault(key, {"buckets": [0] * len(value["buckets"]), "sum": 0.0, "count": 0})
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], value["buckets"])]
+                total["sum"] += value["sum"]
+                total["count"] += value["count"]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+    lines = []
+    for name, (kind, help_text, buckets) in definitions.items():
+        series = sorted(((labels, value) for (series_name, labels), value in merged.items() if series_name == name),
+                        key=lambda item: item[0])
+        if not series:
+            continue
+        lines.append(f"# HELP {prefix}{name} {help_text}")
+        lines.append(f"# TYPE {prefix}{name} {kind}")
+        for labels, value in series:
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{prefix}{name}_count{_format_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
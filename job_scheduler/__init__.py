@@ -0,0 +1 @@
+from .job_scheduler import JobScheduler, JobRejected
@@ -0,0 +1,243 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from instrumentation import metrics, JobProfile
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+MAX_ATTEMPTS = 2
+
+
+class JobRejected(Exception):
+    pass
+
+
+class JobScheduler:
+    """
+    Runs video analysis jobs on a fixed-size process pool.
+
+    Every job is a JSON file in job_dir (status, progress, error, paths), so the
+    queue survives a restart: jobs that were queued or running are submitted
+    again when the scheduler starts. At most max_pending jobs may be waiting
+    or running; submit() raises JobRejected beyond that instead of letting the
+    server run out of memory. Each worker process runs one job at a time and
+    is limited to memory_limit_bytes of memory (None = no limit). If a worker
+    dies the pool is replaced, and the jobs it was running are retried up to
+    MAX_ATTEMPTS times.
+
+    target(input_path, output_path, on_progress=...) runs in the worker, and
+    worker_initializer() once in every new worker process (e.g. to load models);
+    both must be module-level functions so they can be sent to the workers.
+
+    With metrics_dir, every worker writes its metrics snapshot there (for the
+    server's /metrics); with profile_dir, every job dumps the metrics recorded
+    while it ran to <profile_dir>/<job_id>.json.
+    """
+
+    def __init__(self, target, job_dir='jobs', num_workers=2, max_pending=8, memory_limit_bytes=None,
+                 worker_initializer=None, metrics_dir=None, profile_dir=None):
+        self.target = target
+        self.worker_initializer = worker_initializer
+        self.job_dir = job_dir
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.memory_limit_bytes = memory_limit_bytes
+        self.metrics_dir = metrics_dir
+        self.profile_dir = profile_dir
+        self._lock = threading.RLock()
+        self._futures = {}
+        os.makedirs(self.job_dir, exist_ok=True)
+        if self.metrics_dir is not None:
+            # snapshots of an earlier server run
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            for name in os.listdir(self.metrics_dir):
+                os.remove(os.path.join(self.metrics_dir, name))
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        self._executor = self._create_executor()
+
+        for job in sorted(self.list_jobs(), key=lambda job: job["created"]):
+            if job["status"] not in FINISHED_STATES:
+                _update_job(self.get_job_path(job["job_id"]), status=QUEUED)
+                self._submit(job["job_id"])
+
+    def _create_executor(self):
+        # spawn: the workers do not inherit the server's threads and sockets
+        return ProcessPoolExecutor(max_workers=self.num_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(self.memory_limit_bytes, self.worker_initializer, self.metrics_dir))
+
+    def get_job_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def get_profile(self, job_id):
+        if self.profile_dir is None or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(os.path.join(self.profile_dir, f"{job_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get_job(self, job_id):
+        if not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self.get_job_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def list_jobs(self):
+        jobs = []
+        for name in os.listdir(self.job_dir):
+            if name.endswith('.json'):
+                job = self.get_job(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def get_pending_count(self):
+        with self._lock:
+            return sum(not future.done() for future in self._futures.values())
+
+    def submit(self, input_path, output_path, remove_input=True, **params):
+        """
+        Queue a job and return its id right away. With remove_input the job owns
+        input_path and deletes it when it finishes.
+        """
+        with self._lock:
+            if self.get_pending_count() >= self.max_pending:
+                raise JobRejected(f"Server busy: {self.max_pending} jobs already waiting")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "status": QUEUED,
+                "created": time.time(),
+                "attempts": 0,
+                "input_path": input_path,
+                "output_path": output_path,
+                "remove_input": remove_input,
+                "params": params,
+                "progress": {},
+                "error": None,
+            }
+            _write_job(self.get_job_path(job_id), job)
+            self._submit(job_id)
+        return job_id
+
+    def _submit(self, job_id):
+        with self._lock:
+            executor = self._executor
+            future = executor.submit(_run_job, self.target, self.get_job_path(job_id), self.profile_dir)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda future: self._on_done(job_id, future, executor))
+
+    def _on_done(self, job_id, future, executor):
+        try:
+            future.result()
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for using too much memory) and took the pool with it
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._create_executor()
+            job = self.get_job(job_id)
+            if job is None:
+                return
+            if job["status"] == QUEUED or job.get("attempts", 0) < MAX_ATTEMPTS:
+                _update_job(self.get_job_path(job_id), status=QUEUED)
+                self._submit(job_id)
+            else:
+                _update_job(self.get_job_path(job_id), status=FAILED, error="Worker process died")
+                _remove_input(job)
+        except Exception as e:
+            _update_job(self.get_job_path(job_id), status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                if self._futures.get(job_id) is future:
+                    del self._futures[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _write_job(job_path, job):
+    # atomic, the status routes may read the file at any time
+    tmp_path = f"{job_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, job_path)
+
+
+def _update_job(job_path, **changes):
+    with open(job_path) as f:
+        job = json.load(f)
+    job.update(changes)
+    _write_job(job_path, job)
+    return job
+
+
+def _remove_input(job):
+    if job.get("remove_input") and os.path.exists(job["input_path"]):
+        os.remove(job["input_path"])
+
+
+def _init_worker(memory_limit_bytes, worker_initializer, metrics_dir):
+    if memory_limit_bytes is not None:
+        import resource
+        # RLIMIT_DATA counts heap and anonymous mappings on Linux, so large frame buffers hit it
+        limit = getattr(resource, 'RLIMIT_DATA', resource.RLIMIT_AS)
+        resource.setrlimit(limit, (memory_limit_bytes, memory_limit_bytes))
+    if metrics_dir is not None:
+        metrics.start_snapshots(os.path.join(metrics_dir, f"{os.getpid()}.json"))
+    if worker_initializer is not None:
+        worker_initializer()
+
+
+def _run_job(target, job_path, profile_dir=None, progress_interval=0.5):
+    with open(job_path) as f:
+        attempts = json.load(f).get("attempts", 0) + 1
+    job = _update_job(job_path, status=RUNNING, started=time.time(), attempts=attempts)
+    last_update = 0.0
+    start = time.perf_counter()
+    profile = JobProfile() if profile_dir is not None else None
+    if profile is not None:
+        # a worker runs one job at a time, so everything recorded meanwhile belongs to this job
+        metrics.add_hook(profile)
+
+    def on_progress(stage, done, total):
+        nonlocal last_update
+        now = time.time()
+        if now - last_update >= progress_interval or done >= total:
+            last_update = now
+            _update_job(job_path, progress={"stage": stage, "done": done, "total": total})
+
+    status = FAILED
+    try:
+        target(job["input_path"], job["output_path"], on_progress=on_progress, **job["params"])
+    except MemoryError:
+        _update_job(job_path, status=FAILED, finished=time.time(), error="Memory limit exceeded")
+    except Exception as e:
+        traceback.print_exc()
+        _update_job(job_path, status=FAILED, finished=time.time(), error=str(e))
+    else:
+        status = DONE
+        _update_job(job_path, status=DONE, finished=time.time())
+    finally:
+        _remove_input(job)
+        metrics.observe("job_duration_seconds", time.perf_counter() - start, status=status)
+        if profile is not None:
+            metrics.remove_hook(profile)
+            _write_job(os.path.join(profile_dir, f"{job['job_id']}.json"), dict(profile.to_dict(), job_id=job["job_id"]))
+        metrics.write_snapshot()
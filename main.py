@@ -3,13 +3,15 @@ import os
 import sqlite3
 import numpy as np
 from PassCounter import PassCounter
-from utils import save_video, read_video  # פונקציות לקריאת ושמירת וידאו
+from utils import save_video, read_video, get_video_info, FrameStore  # פונקציות לקריאת ושמירת וידאו
 from trackers import Tracker  # מעקב אחרי אובייקטים בסרטון
 from team_assigner import TeamAssigner  # קביעת הקבוצות של השחקנים
 from player_ball_assigner import PlayerBallAssigner  # קביעת השחקן שמחזיק בכדור
 from camera_movment_estimator import CameraMovmentEstimator  # הערכת תנועת המצלמה
 from view_transformer import ViewTransformer  # שינוי מיקום נקודות בסרטון
 from speed_and_distance_estimator import SpeedAndDistance_Estimator  # הערכת מהירות ומרחק של השחקנים
+from stage_cache import StageCache  # מטמון לתוצאות שלבים לפי תוכן הסרטון
+from frame_compositor import FrameCompositor  # ציור כל שכבות ההערות על הפריים במעבר אחד
 import cv2  # עבור תצוגה ועריכה של תמונות וידאו
 import pandas as pd  # עבור עבודה עם נתונים בטבלאות (כמו עם מיקום הכדור)
 import pickle  # עבור שמירה וטעינה של נתונים מוקטבים
@@ -19,10 +21,8 @@ import supervision as s  # לצורך שימוש בפונקציות מעקב
 def read_video_file(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Video file not found: {file_path}")
-    video_frames = read_video(file_path)
-    if video_frames is None:
-        raise ValueError(f"Unable to process video file: {file_path}")
-    return video_frames
+    # הפריימים מפוענחים פעם אחת לקובץ ממופה לזיכרון (FrameStore) במקום לרשימה בזיכרון
+    return FrameStore.from_video(file_path)
 
 def main():
     # יצירת חיבור לשרת
@@ -50,60 +50,63 @@ def main():
     print("Video received.")
 
     # קריאת הסרטון וניתוחו
-    video_frames = read_video_file("received_video.mp4")
-    tracker = Tracker('models/best.pt')
-    tracks = tracker.get_object_tracks(video_frames, read_from_stub=True, stub_path='stubs/track_stubs.pkl')
-    tracker.add_position_to_tracks(tracks)
+    with read_video_file("received_video.mp4") as video_frames:
+        stage_cache = StageCache()
+        video_hash = stage_cache.hash_file("received_video.mp4")
+        tracker = Tracker('models/best.pt')
+        tracks_stub = stage_cache.stub_path('tracks', video_hash, tracker.get_cache_params(stage_cache))
+        tracks = tracker.get_object_tracks(video_frames, read_from_stub=True, stub_path=tracks_stub)
     
-    # הערכת תנועת המצלמה
-    camera_movment_estimator = CameraMovmentEstimator(video_frames[0])
-    camera_movment_per_frame = camera_movment_estimator.get_camera_movment(video_frames, read_from_stub=True, stub_path='stubs/camera_movment_stub.pkl')
-    camera_movment_estimator.add_adjust_positions_to_tracks(tracks, camera_movment_per_frame)
+        # הערכת תנועת המצלמה
+        camera_movment_estimator = CameraMovmentEstimator(video_frames[0])
+        camera_stub = stage_cache.stub_path('camera_movement', video_hash, camera_movment_estimator.get_cache_params())
+        camera_movment_per_frame = camera_movment_estimator.get_camera_movment(video_frames, read_from_stub=True, stub_path=camera_stub)
+        stage_cache.evict(keep=[tracks_stub, camera_stub])
     
-    # שינוי מיקום נקודות
-    view_transformer = ViewTransformer()
-    view_transformer.add_transformed_position_to_tracks(tracks)
+        # שינוי מיקום נקודות
+        view_transformer = ViewTransformer()
+        view_transformer.add_all_positions_to_tracks(tracks, camera_movment_per_frame)
     
-    # אינטרפולציה למיקומים של הכדור
-    tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"])
+        # אינטרפולציה למיקומים של הכדור
+        tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"])
     
-    # חישוב מהירות ומרחק של השחקנים
-    speed_and_distance_estimator = SpeedAndDistance_Estimator()
-    speed_and_distance_estimator.add_speed_and_distance_to_tracks(tracks)
-
-    # קביעת צבעי הקבוצות
-    team_assigner = TeamAssigner()
-    team_assigner.assign_team_color(video_frames[0], tracks['player'][0])
-
-    # ניהול מסירות ותרגול ניתוח השחקנים
-    pass_counter = PassCounter(team_assigner)
-    player_assigner = PlayerBallAssigner()
+        # חישוב מהירות ומרחק של השחקנים
+        video_fps = get_video_info("received_video.mp4")["fps"]
+        speed_and_distance_estimator = SpeedAndDistance_Estimator(frame_rate=video_fps)
+        speed_and_distance_estimator.add_speed_and_distance_to_tracks(tracks)
+
+        # קביעת צבעי הקבוצות
+        team_assigner = TeamAssigner()
+        team_assigner.assign_team_color(video_frames[0], tracks['player'][0])
+
+        # ניהול מסירות ותרגול ניתוח השחקנים
+        pass_counter = PassCounter(team_assigner)
+        player_assigner = PlayerBallAssigner()
     
-    team_ball_control = []
-    for frame_num, player_track in enumerate(tracks['player']):
-        ball_bbox = tracks['ball'][frame_num][1]['bbox']
-        assigned_player = player_assigner.assign_ball_to_player(player_track, ball_bbox)
-
-        if assigned_player != -1:
-            player_data = tracks['player'][frame_num][assigned_player]
-            current_team = player_data.get('team')
-            if current_team is not None and int(current_team) in [0, 1]:
-                team_ball_control.append(int(current_team))
-                pass_counter.count_pass(player_track, ball_bbox, frame_num)
+        team_ball_control = []
+        assigned_players = player_assigner.assign_ball_to_players(tracks)  # החזקת הכדור לכל הפריימים בבת אחת
+        for frame_num, player_track in enumerate(tracks['player']):
+            ball_bbox = tracks['ball'][frame_num][1]['bbox']
+            assigned_player = int(assigned_players[frame_num])
+
+            if assigned_player != -1:
+                player_data = tracks['player'][frame_num][assigned_player]
+                current_team = player_data.get('team')
+                if current_team is not None and int(current_team) in [0, 1]:
+                    team_ball_control.append(int(current_team))
+                    pass_counter.count_pass(player_track, ball_bbox, frame_num, assigned_player)
+                else:
+                    print(f"Warning: 'team' key missing for player {assigned_player} in frame {frame_num}")
             else:
-                print(f"Warning: 'team' key missing for player {assigned_player} in frame {frame_num}")
-        else:
-            team_ball_control.append(team_ball_control[-1] if team_ball_control else None)
+                team_ball_control.append(team_ball_control[-1] if team_ball_control else None)
 
-    clean_passes = {team: count for team, count in pass_counter.passes_count.items() if team in [0, 1]}
+        clean_passes = {team: count for team, count in pass_counter.passes_count.items() if team in [0, 1]}
 
-    # שמירת הסרטון המנותח
-    output_video_frames = tracker.draw_annotations(video_frames, tracks, team_ball_control)
-    output_video_frames = camera_movment_estimator.draw_camera_movment(output_video_frames, camera_movment_per_frame)
-    speed_and_distance_estimator.draw_speed_and_distance(output_video_frames, tracks)
+        # שמירת הסרטון המנותח
+        compositor = FrameCompositor(tracker, tracks, team_ball_control, camera_movment_per_frame)
     
-    processed_video_path = 'output_videos/output_video1.avi'
-    save_video(output_video_frames, processed_video_path)
+        processed_video_path = 'output_videos/output_video1.avi'
+        save_video(compositor.draw_frames(video_frames.iter_copies()), processed_video_path, fps=video_fps)
     print(f"Processed video saved at {processed_video_path}")
 
     # שמירה למסד נתונים של נתוני הקבוצות
@@ -1,6 +1,7 @@
 import sys
 sys.path.append('../')
-from utils import get_center_of_bbox, measure_distance
+import numpy as np
+from utils import get_center_of_bbox, measure_distance, get_centers_of_bboxes, TrackTable
 from team_assigner import TeamAssigner
 
 class PlayerBallAssigner():
@@ -8,6 +9,9 @@ class PlayerBallAssigner():
         self.max_player_ball_distance = 70
         self.team_assigner = TeamAssigner()
         self.current_frame = None
+        # last holder of the previous assign_ball_to_players_batch call, at its frame relative to the next call
+        self.last_assigned_player = -1
+        self.last_assigned_frame = -1
 
     def assign_ball_to_player(self, players, ball_bbox):
         ball_position = get_center_of_bbox(ball_bbox)
@@ -27,4 +31,91 @@ class PlayerBallAssigner():
                     minimum_distance = distance
                     assigned_player = player_id
         return assigned_player
-    
+
+    def assign_ball_to_players_batch(self, ball_positions, player_ids, player_corners, hysteresis_frames=0):
+        """
+        assign_ball_to_player for every frame at once.
+
+        ball_positions: (frames, 2) ball centres, NaN when there is no ball.
+        player_ids: (frames, players) track ids, -1 for padding.
+        player_corners: (frames, players, 2, 2) bottom-left / bottom-right corner of
+        every player bbox, NaN for padding.
+        With hysteresis_frames > 0 the last holder keeps the ball through up to that
+        many frames without an assignment, as long as they are still in the frame;
+        the holder carries over to the next call, so a video can be assigned window by window.
+        Returns the assigned player id per frame (-1 for nobody).
+        """
+        distances = np.linalg.norm(player_corners - ball_positions[:, None, None, :], axis=-1).min(axis=-1)
+        distances = np.where(np.isnan(distances) | (player_ids < 0), np.inf, distances)
+
+        assigned_player = np.full(len(ball_positions), -1, dtype=np.int64)
+        if player_ids.shape[1] == 0:
+            self.last_assigned_frame -= len(ball_positions)
+            return assigned_player
+        closest = distances.argmin(axis=1)
+        frame_index = np.arange(len(ball_positions))
+        has_player = distances[frame_index, closest] < self.max_player_ball_distance
+        assigned_player[has_player] = player_ids[frame_index, closest][has_player]
+
+        if hysteresis_frames > 0:
+            last_assigned_frame = np.maximum.accumulate(np.where(assigned_player != -1, frame_index, self.last_assigned_frame))
+            previous_player = np.where(last_assigned_frame >= 0, assigned_player[np.maximum(last_assigned_frame, 0)],
+                                       self.last_assigned_player)
+            if len(ball_positions):
+                self.last_assigned_player = int(previous_player[-1])
+                self.last_assigned_frame = int(last_assigned_frame[-1]) - len(ball_positions)
+            still_in_frame = (player_ids == previous_player[:, None]).any(axis=1)
+            keep = (assigned_player == -1) & (previous_player != -1) & \
+                   (frame_index - last_assigned_frame <= hysteresis_frames) & still_in_frame
+            assigned_player[keep] = previous_player[keep]
+        return assigned_player
+
+    def get_ball_positions(self, tracks):
+        # ball centres per frame as a (frames, 2) array, NaN when the ball is missing
+        if isinstance(tracks, TrackTable):
+            ball_positions = np.full((tracks.num_frames, 2), np.nan)
+            rows = tracks.get_object_rows('ball')
+            ball_positions[tracks.frame[rows]] = get_centers_of_bboxes(tracks.bbox[rows].astype(np.float64))
+            return ball_positions
+
+        ball_bboxes = np.full((len(tracks['ball']), 4), np.nan)
+        for frame_num, ball in enumerate(tracks['ball']):
+            bbox = ball.get(1, {}).get('bbox', [])
+            if len(bbox) == 4:
+                ball_bboxes[frame_num] = bbox
+        return get_centers_of_bboxes(ball_bboxes)
+
+    def get_player_corners(self, tracks):
+        # padded (frames, players) ids and (frames, players, 2, 2) bottom corners for the batch API
+        if isinstance(tracks, TrackTable):
+            rows = tracks.get_object_rows('player')
+            frames = tracks.frame[rows]
+            ids = tracks.track_id[rows]
+            bboxes = tracks.bbox[rows].astype(np.float64)
+            num_frames = tracks.num_frames
+        else:
+            frames, ids, bboxes = [], [], []
+            for frame_num, player_track in enumerate(tracks['player']):
+                for player_id, player in player_track.items():
+                    frames.append(frame_num)
+                    ids.append(player_id)
+                    bboxes.append(player['bbox'])
+            frames = np.asarray(frames, dtype=np.int64)
+            ids = np.asarray(ids, dtype=np.int64)
+            bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+            num_frames = len(tracks['player'])
+
+        # slot of each player inside its frame (rows are grouped by frame in both layouts)
+        slots = np.arange(len(frames)) - np.searchsorted(frames, frames)
+        num_slots = int(slots.max()) + 1 if len(slots) else 0
+        player_ids = np.full((num_frames, num_slots), -1, dtype=np.int64)
+        player_corners = np.full((num_frames, num_slots, 2, 2), np.nan)
+        player_ids[frames, slots] = ids
+        player_corners[frames, slots, 0] = bboxes[:, [0, 3]]
+        player_corners[frames, slots, 1] = bboxes[:, [2, 3]]
+        return player_ids, player_corners
+
+    def assign_ball_to_players(self, tracks, hysteresis_frames=0):
+        ball_positions = self.get_ball_positions(tracks)
+        player_ids, player_corners = self.get_player_corners(tracks)
+        return self.assign_ball_to_players_batch(ball_positions, player_ids, player_corners, hysteresis_frames)
@@ -1,13 +1,17 @@
 import socket
+import asyncio
 import tqdm
 import os
 import cv2
 import struct
 import threading
+import time
+import shutil
+import uuid
 from main import read_video_file, Tracker, CameraMovmentEstimator, ViewTransformer, SpeedAndDistance_Estimator, PlayerBallAssigner, PassCounter, save_video
 from PassCounter import PassCounter
-from utils import save_video, read_video
-from trackers import Tracker
+from utils import save_video, read_video, iter_video_frames, read_video_chunks, get_video_info, save_stub, TrackTable, open_video_encoder
+from trackers import Tracker, get_model, select_backend
 from team_assigner import TeamAssigner
 from player_ball_assigner import PlayerBallAssigner
 from camera_movment_estimator import CameraMovmentEstimator
@@ -17,20 +21,134 @@ import pandas as pd
 import pickle
 import supervision as s
 import numpy as np
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Response, request, send_from_directory, jsonify
 from threading import Thread
 from sklearn.cluster import KMeans
 from collections import defaultdict
-from encryption import xor_encrypt_decrypt, SECRET_KEY
+from itertools import islice
+from encryption import SECRET_KEY
+from upload_protocol import UploadStore, receive_file_async, send_message_async, DEFAULT_CHUNK_SIZE
+from job_scheduler import JobScheduler, JobRejected
+from stage_cache import StageCache
+from frame_compositor import FrameCompositor
+from instrumentation import metrics, read_snapshots, render_prometheus
 
 
 app = Flask(__name__)
 OUTPUT_FOLDER = 'output_videos'
-
-@app.route('/video/<filename>')
+STREAMING_WINDOW_SIZE = 64
+# streaming jobs fix the team colours on the first STREAMING_TEAM_VOTE_FRAMES frames and only then start rendering
+STREAMING_TEAM_VOTE_FRAMES = 250
+DETECTION_BATCH_SIZE = 20
+DETECTION_QUEUE_SIZE = 4
+# YOLO on every DETECTION_STRIDE-th frame (and on pans / uncertain tracks), boxes propagated in between
+DETECTION_STRIDE = 1
+DETECTION_KEYFRAME_MOTION_THRESHOLD = None
+# uncertain-track keyframes apply to process_video only, streaming jobs detect in a pipeline
+DETECTION_KEYFRAME_UNCERTAINTY_THRESHOLD = None
+DETECTION_PROPAGATION = "motion"
+# full-frame inference size (None: the model's), and the ball from full-resolution crops of this size
+DETECTION_IMGSZ = None
+BALL_CROP_SIZE = None
+# "pytorch", or "onnx" / "openvino" to run an export of MODEL_PATH (e.g. {"int8": True}) on CPU-only workers;
+# an export whose detections do not match PyTorch's (settings "min_parity") falls back to "pytorch"
+DETECTOR_BACKEND = "pytorch"
+DETECTOR_BACKEND_SETTINGS = {}
+BALL_HYSTERESIS_FRAMES = 0
+# Kalman ball filter: "velocity" or "acceleration" model; the streaming analysis smooths the ball
+# window by window, each frame with BALL_FILTER_LOOKAHEAD frames after it
+BALL_MOTION_MODEL = "velocity"
+BALL_FILTER_LOOKAHEAD = 25
+# 0 keeps camera movement inside the detection pipeline; > 0 runs it on a process pool of that size
+CAMERA_MOVEMENT_WORKERS = 0
+CAMERA_MOVEMENT_DOWNSCALE = 1.0
+# "lucas_kanade" (feature tracking) or "phase_correlation" (faster, global translation only)
+CAMERA_MOVEMENT_BACKEND = "lucas_kanade"
+CAMERA_MOVEMENT_BACKEND_PARAMS = {}
+# "ffmpeg" writes H.264 for the browser player (OpenCV mp4v is used when ffmpeg is not installed)
+VIDEO_ENCODER_BACKEND = "ffmpeg"
+VIDEO_ENCODER_OPTIONS = {"crf": 23, "preset": "veryfast"}
+# jobs write an HLS playlist of short segments that the client can play while the video is still rendering;
+# HLS needs the MPEG-TS segments of ffmpeg, without it jobs write a single MP4 file
+SEGMENTED_OUTPUT = True
+OUTPUT_SEGMENT_SECONDS = 2
+UPLOAD_DIR = 'uploads'
+# uploads are received on one asyncio event loop; a client that sends nothing for UPLOAD_TIMEOUT seconds is dropped
+MAX_CONCURRENT_UPLOADS = 64
+UPLOAD_TIMEOUT = 60
+# analysis jobs run on a process pool; uploads beyond JOB_MAX_PENDING waiting / running jobs are refused
+JOB_DIR = 'jobs'
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 8
+JOB_MEMORY_LIMIT_BYTES = 8 * 1024**3
+# job workers write their metrics here for /metrics; every job dumps its own metrics to JOB_PROFILE_DIR (None = off)
+METRICS_DIR = os.path.join(JOB_DIR, 'metrics')
+JOB_PROFILE_DIR = os.path.join(JOB_DIR, 'profiles')
+MODEL_PATH = 'models/best.pt'
+STAGE_CACHE_DIR = 'stubs/cache'
+STAGE_CACHE_MAX_BYTES = 2 * 1024**3
+
+stage_cache = StageCache(STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES)
+upload_store = UploadStore(UPLOAD_DIR)
+# created in main(): the job workers import this module too and must not start their own scheduler
+job_scheduler = None
+
+@app.route('/video/<path:filename>')
 def serve_video(filename):
+    if filename.endswith('.m3u8'):
+        # the playlist grows while the job renders, players must not cache it
+        response = send_from_directory(OUTPUT_FOLDER, filename, mimetype='application/vnd.apple.mpegurl')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    if filename.endswith('.ts'):
+        return send_from_directory(OUTPUT_FOLDER, filename, mimetype='video/mp2t')
     return send_from_directory(OUTPUT_FOLDER, filename)
 
+def get_video_url(output_path):
+    return f"http://localhost:8000/video/{os.path.relpath(output_path, OUTPUT_FOLDER).replace(os.sep, '/')}"
+
+def get_job_summary(job):
+    summary = {key: job.get(key) for key in ("job_id", "status", "progress", "error", "created", "started", "finished")}
+    output_path = job["output_path"]
+    # a segmented output can be played as soon as its playlist has been written
+    playable = job["status"] == "running" and output_path.endswith('.m3u8') and os.path.exists(output_path)
+    if job["status"] == "done" or playable:
+        summary["video_url"] = get_video_url(output_path)
+    return summary
+
+@app.route('/jobs')
+def list_jobs():
+    if job_scheduler is None:
+        return jsonify({"error": "Job scheduler is not running"}), 503
+    jobs = sorted(job_scheduler.list_jobs(), key=lambda job: job["created"], reverse=True)
+    return jsonify({"pending": job_scheduler.get_pending_count(), "jobs": [get_job_summary(job) for job in jobs]})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_scheduler.get_job(job_id) if job_scheduler is not None else None
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(get_job_summary(job))
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    profile = job_scheduler.get_profile(job_id) if job_scheduler is not None else None
+    if profile is None:
+        return jsonify({"error": "No profile for this job"}), 404
+    return jsonify(profile)
+
+@app.route('/metrics')
+def get_metrics():
+    if job_scheduler is not None:
+        metrics.set_gauge("jobs_pending", job_scheduler.get_pending_count())
+        status_counts = defaultdict(int)
+        for job in job_scheduler.list_jobs():
+            status_counts[job["status"]] += 1
+        for status in ("queued", "running", "done", "failed"):
+            metrics.set_gauge("jobs", status_counts[status], status=status)
+    snapshots = [metrics.snapshot()] + read_snapshots(METRICS_DIR)
+    return Response(render_prometheus(snapshots), mimetype='text/plain; version=0.0.4')
+
 def run_flask_server():
     app.run(host='0.0.0.0', port=8000, ssl_context='adhoc')
 
@@ -74,40 +192,29 @@ def save_speed_data(tracks, output_csv_path):
     df = pd.DataFrame(rows)
     df.to_csv(output_csv_path, index=False)
 
-def process_video(input_path, output_path):
-    print("Processing video...")
-    video_frames = read_video_file(input_path)
-    tracker = Tracker('models/best.pt')
-    tracks = tracker.get_object_tracks(video_frames, read_from_stub=True, stub_path='stubs/track_stubs.pkl')
-    tracker.add_position_to_tracks(tracks)
-
-    camera_movment_estimator = CameraMovmentEstimator(video_frames[0])
-    camera_movment_per_frame = camera_movment_estimator.get_camera_movment(video_frames, read_from_stub=True, stub_path='stubs/camera_movment_stub.pkl')
-    camera_movment_estimator.add_adjust_positions_to_tracks(tracks, camera_movment_per_frame)
-
-    view_transformer = ViewTransformer()
-    view_transformer.add_transformed_position_to_tracks(tracks)
-
-    tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"])
-
-    speed_and_distance_estimator = SpeedAndDistance_Estimator()
-    speed_and_distance_estimator.add_speed_and_distance_to_tracks(tracks)
-
-    team_assigner = TeamAssigner()
-    team_assigner.assign_team_color(video_frames[0], tracks['player'][0])
-    for frame_num, player_track in enumerate(tracks['player']):
-        for player_id, track in player_track.items():
-            team = team_assigner.get_player_team(video_frames[frame_num], track['bbox'], player_id)
-            tracks['player'][frame_num][player_id]['team'] = team
-            tracks['player'][frame_num][player_id]['team_color'] = team_assigner.team_colors[team]
-
-    pass_counter = PassCounter(team_assigner)
-    player_assigner = PlayerBallAssigner()
+def warm_up_models():
+    # runs once in every job worker, so the jobs get an already loaded detector;
+    # a failure here would break the pool, the job reports it instead
+    try:
+        # the same detector as create_tracker, so the first job does not load it cold
+        get_model(MODEL_PATH, **select_backend(MODEL_PATH, DETECTOR_BACKEND, **DETECTOR_BACKEND_SETTINGS))
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+def get_team_ball_control(tracks, team_assigner, hysteresis_frames=BALL_HYSTERESIS_FRAMES,
+                          player_assigner=None, pass_counter=None, start_frame=0, last_team=None):
+    # a video rendered window by window passes the same player_assigner / pass_counter for every window,
+    # its first frame and the team that had the ball at the end of the previous one
+    pass_counter = pass_counter if pass_counter is not None else PassCounter(team_assigner)
+    player_assigner = player_assigner if player_assigner is not None else PlayerBallAssigner()
     team_ball_control = []
 
+    # possession for the whole window in one vectorized call
+    assigned_players = player_assigner.assign_ball_to_players(tracks, hysteresis_frames)
     for frame_num, player_track in enumerate(tracks['player']):
         ball_bbox = tracks['ball'][frame_num][1]['bbox']
-        assigned_player = player_assigner.assign_ball_to_player(player_track, ball_bbox)
+        assigned_player = int(assigned_players[frame_num])
+        previous_team = team_ball_control[-1] if team_ball_control else last_team
 
         if assigned_player != -1:
             player_data = tracks['player'][frame_num][assigned_player]
@@ -117,102 +224,293 @@ def process_video(input_path, output_path):
                 team_ball_control.append(current_team)
 
                 if current_team is not None and int(current_team) in [0, 1]:
-                    pass_counter.count_pass(player_track, ball_bbox, frame_num)
+                    pass_counter.count_pass(player_track, ball_bbox, start_frame + frame_num, assigned_player)
                 else:
-                    print(f"Warning: 'team' key missing or invalid for player {assigned_player} in frame {frame_num}")
+                    print(f"Warning: 'team' key missing or invalid for player {assigned_player} in frame {start_frame + frame_num}")
             else:
-                print(f"Warning: 'team' key missing for player {assigned_player} in frame {frame_num}")
-                team_ball_control.append(team_ball_control[-1] if team_ball_control else None)
+                print(f"Warning: 'team' key missing for player {assigned_player} in frame {start_frame + frame_num}")
+                team_ball_control.append(previous_team)
         else:
-            team_ball_control.append(team_ball_control[-1] if team_ball_control else None)
+            team_ball_control.append(previous_team)
+
+    return np.array(team_ball_control)
+
+def create_tracker(batch_size=DETECTION_BATCH_SIZE):
+    return Tracker(MODEL_PATH, batch_size=batch_size, detection_stride=DETECTION_STRIDE,
+                   keyframe_motion_threshold=DETECTION_KEYFRAME_MOTION_THRESHOLD,
+                   keyframe_uncertainty_threshold=DETECTION_KEYFRAME_UNCERTAINTY_THRESHOLD,
+                   propagation=DETECTION_PROPAGATION, imgsz=DETECTION_IMGSZ, ball_crop_size=BALL_CROP_SIZE,
+                   detector_backend=DETECTOR_BACKEND, detector_settings=DETECTOR_BACKEND_SETTINGS,
+                   ball_motion_model=BALL_MOTION_MODEL, ball_lookahead=BALL_FILTER_LOOKAHEAD)
+
+def process_video(input_path, output_path):
+    print("Processing video...")
+    with read_video_file(input_path) as video_frames:
+        video_info = get_video_info(input_path)
+        video_hash = stage_cache.hash_file(input_path)
+        tracker = create_tracker()
+        tracks_stub = stage_cache.stub_path('tracks', video_hash, tracker.get_cache_params(stage_cache))
+        tracks = tracker.get_object_tracks(video_frames, read_from_stub=True, stub_path=tracks_stub)
 
-    team_ball_control = np.array(team_ball_control)
-    output_video_frames = tracker.draw_annotations(video_frames, tracks, team_ball_control)
-    output_video_frames = camera_movment_estimator.draw_camera_movment(output_video_frames, camera_movment_per_frame)
-    speed_and_distance_estimator.draw_speed_and_distance(output_video_frames, tracks)
-    save_video(output_video_frames, output_path, codec='mp4v')
+        camera_movment_estimator = CameraMovmentEstimator(video_frames[0])
+        camera_stub = stage_cache.stub_path('camera_movement', video_hash, camera_movment_estimator.get_cache_params())
+        camera_movment_per_frame = camera_movment_estimator.get_camera_movment(video_frames, read_from_stub=True, stub_path=camera_stub)
+        stage_cache.evict(keep=[tracks_stub, camera_stub])
+
+        view_transformer = ViewTransformer()
+        view_transformer.add_all_positions_to_tracks(tracks, camera_movment_per_frame)
+
+        tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"])
+
+        speed_and_distance_estimator = SpeedAndDistance_Estimator(frame_rate=video_info["fps"])
+        speed_and_distance_estimator.add_speed_and_distance_to_tracks(tracks)
+
+        team_assigner = TeamAssigner()
+        team_assigner.add_color_samples(video_frames, tracks['player'])
+        team_assigner.assign_teams_by_vote()
+        team_assigner.add_teams_to_tracks(tracks)
+
+        team_ball_control = get_team_ball_control(tracks, team_assigner)
+        compositor = FrameCompositor(tracker, tracks, team_ball_control, camera_movment_per_frame)
+        # the stored frames are read-only, the compositor draws on copies
+        save_video(compositor.draw_frames(video_frames.iter_copies()), output_path, codec='mp4v', fps=video_info["fps"],
+                   backend=VIDEO_ENCODER_BACKEND, **VIDEO_ENCODER_OPTIONS)
 
     detect_formation(tracks, team_id=0 , frame_sample_rate=5)
     detect_formation(tracks, team_id=1, frame_sample_rate=5)
 
     print(f"Processed video saved as {output_path}")
 
-def handle_client(client):
-    try:
-        received = client.recv(1024).decode().strip()
-        file_name, file_size_data = received.split("<SEPARATOR>")
-
-        print(f"Received file name: {file_name}")
-
-        if not file_size_data.isdigit():
-            print("Error: Invalid file size received.")
-            client.close()
-            return
-        file_size = int(file_size_data)
-
-        print(f"File size: {file_size} bytes")
-        
-
-        video_data = b""
-        received_bytes = 0
-        progress = tqdm.tqdm(unit="B", unit_scale=True, unit_divisor=1000, total=file_size)
-        
-        while received_bytes < file_size:
-            chunk = client.recv(min(4096, file_size - received_bytes))
-            if not chunk:
-                break
-            video_data += chunk
-            received_bytes += len(chunk)
-            progress.update(len(chunk))
-        
-        if received_bytes != file_size:
-            print(f"Warning: Expected {file_size} bytes, but received {received_bytes} bytes.")
-            client.close()
-            return
-        
-        # שמירה של הווידאו המוצפן כפי שהתקבל
-        encrypted_path = f"received_{threading.get_ident()}_encrypted.mp4"
-        with open(encrypted_path, "wb") as f:
-            f.write(video_data)
-        print(f"Encrypted video saved at {encrypted_path}")
-
-        # פענוח הווידאו
-        video_data = xor_encrypt_decrypt(video_data, SECRET_KEY)
-
-        # שמירה של הווידאו אחרי פענוח
-        decrypted_path = f"received_{threading.get_ident()}_decrypted.mp4"
-        with open(decrypted_path, "wb") as f:
-            f.write(video_data)
-        print(f"Decrypted video saved at {decrypted_path}")
-
-        input_path = decrypted_path
-        output_path = f"output_videos/output_video_{threading.get_ident()}.avi"
-
-        print("Processing video...")
-        process_video(input_path, output_path)
-
-        video_url = f"http://localhost:8000/video/{os.path.basename(output_path)}"
-        client.sendall(video_url.encode())
-
-        print("Finished sending processed video URL. Closing connection.")
-        client.close()
+def process_video_streaming(input_path, output_path, window_size=STREAMING_WINDOW_SIZE,
+                            batch_size=DETECTION_BATCH_SIZE, queue_size=DETECTION_QUEUE_SIZE,
+                            motion_backend=CAMERA_MOVEMENT_BACKEND, backend_params=CAMERA_MOVEMENT_BACKEND_PARAMS,
+                            on_progress=None):
+    """
+    Same analysis as process_video, but frames are never all in memory at once.
+    Decoding, detection and tracking run as a DetectionPipeline (skipped when
+    the stage cache already has the tracks); behind it, batch by batch, jersey
+    colours and camera movement are sampled and the ball track is smoothed with
+    BALL_FILTER_LOOKAHEAD frames of delay. As soon as the frames of a window are
+    final (ball smoothed, team colours fixed after STREAMING_TEAM_VOTE_FRAMES
+    frames), the track-level stages run on that window and a second decoder
+    renders and encodes it, so the output grows while the analysis goes on.
+    on_progress(stage, done_frames, total_frames) is called for the "analysis"
+    and "render" stages. An output_path ending in .m3u8 is written as a growing
+    playlist of OUTPUT_SEGMENT_SECONDS segments.
+    """
+    print("Processing video (streaming)...")
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Video file not found: {input_path}")
+
+    first_frame = next(iter_video_frames(input_path), None)
+    if first_frame is None:
+        raise ValueError(f"Unable to process video file: {input_path}")
+
+    video_info = get_video_info(input_path)
+    video_hash = stage_cache.hash_file(input_path)
+    tracker = create_tracker(batch_size=batch_size)
+    team_assigner = TeamAssigner()
+    camera_movment_estimator = CameraMovmentEstimator(first_frame, downscale=CAMERA_MOVEMENT_DOWNSCALE,
+                                                      motion_backend=motion_backend, backend_params=backend_params)
+
+    tracks_stub = stage_cache.stub_path('tracks', video_hash, tracker.get_cache_params(stage_cache, pipelined=True))
+    camera_stub = stage_cache.stub_path('camera_movement', video_hash, camera_movment_estimator.get_cache_params())
+    camera_cached = os.path.exists(camera_stub)
+    if camera_cached:
+        with open(camera_stub, 'rb') as f:
+            camera_movment_per_frame = pickle.load(f)
+    elif CAMERA_MOVEMENT_WORKERS > 0:
+        with metrics.timer("stage_seconds", stage="camera_movement"):
+            camera_movment_per_frame = camera_movment_estimator.get_camera_movment_parallel(
+                input_path, num_workers=CAMERA_MOVEMENT_WORKERS, stub_path=camera_stub)
+        camera_cached = True
+    else:
+        camera_movment_per_frame = []
+
+    ball_positions = []
+    view_transformer = ViewTransformer()
+    speed_and_distance_estimator = SpeedAndDistance_Estimator(frame_rate=video_info["fps"])
+    player_assigner = PlayerBallAssigner()
+    pass_counter = PassCounter(team_assigner)
+    # windows start on a speed window, so every speed window is inside one render window
+    frame_window = speed_and_distance_estimator.frame_window
+    render_window = max(window_size // frame_window, 1) * frame_window
+    render_frames = iter_video_frames(input_path)
+    render_state = {"rendered": 0, "last_team": None, "control": [0, 0]}
+    segment_options = {"segment_seconds": OUTPUT_SEGMENT_SECONDS} if output_path.endswith('.m3u8') else {}
+    encoder = open_video_encoder(output_path, codec='mp4v', fps=video_info["fps"], backend=VIDEO_ENCODER_BACKEND,
+                                 **VIDEO_ENCODER_OPTIONS, **segment_options)
+
+    def render_window_frames(tracks, start, stop):
+        # speed needs the frame after the window (the end of its last speed window), if there is one
+        end = min(stop + 1, len(ball_positions))
+        window_tracks = TrackTable.from_tracks({name: (ball_positions if name == 'ball' else object_tracks)[start:end]
+                                                for name, object_tracks in tracks.items()})
+        with metrics.timer("stage_seconds", stage="team_assignment"):
+            team_assigner.assign_new_tracks_by_vote(window_tracks.track_id[window_tracks.get_object_rows('player')].tolist())
+            team_assigner.add_teams_to_tracks(window_tracks)
+
+        with metrics.timer("stage_seconds", stage="view_transform"):
+            view_transformer.add_all_positions_to_tracks(window_tracks, camera_movment_per_frame[start:end])
+
+        with metrics.timer("stage_seconds", stage="speed_and_distance"):
+            speed_and_distance_estimator.add_speed_and_distance_to_tracks(window_tracks)
+        window_tracks = window_tracks.get_frames(0, stop - start)
+
+        with metrics.timer("stage_seconds", stage="ball_control"):
+            team_ball_control = get_team_ball_control(window_tracks, team_assigner, player_assigner=player_assigner,
+                                                      pass_counter=pass_counter, start_frame=start,
+                                                      last_team=render_state["last_team"])
+
+        control = render_state["control"]
+        compositor = FrameCompositor(tracker, window_tracks, team_ball_control, camera_movment_per_frame[start:stop],
+                                     initial_control=tuple(control))
+        frames = list(islice(render_frames, stop - start))
+        render_start = time.perf_counter()
+        # frames are drawn in place, so drawing the whole window first costs no memory
+        frames = list(compositor.draw_frames(frames))
+        metrics.observe("stage_seconds", time.perf_counter() - render_start, stage="render")
+        metrics.inc("stage_frames_total", len(frames), stage="render")
+        for frame in frames:
+            encoder.write(frame)
+
+        control[0] += int(np.sum(team_ball_control == 1))
+        control[1] += int(np.sum(team_ball_control == 2))
+        if len(team_ball_control):
+            render_state["last_team"] = team_ball_control[-1]
+        render_state["rendered"] = stop
+        if on_progress is not None:
+            on_progress("render", stop, video_info["frame_count"])
+
+    def render_until(tracks, end_frame):
+        while render_state["rendered"] < end_frame:
+            start = render_state["rendered"]
+            render_window_frames(tracks, start, min(start + render_window, end_frame))
+
+    def analyze_batch(tracks, frames, start_frame):
+        ball_positions.extend(tracker.ball_filter.update(tracks['ball'][start_frame:start_frame + len(frames)]))
+        if not camera_cached:
+            camera_movment_per_frame.extend(camera_movment_estimator.update_camera_movment(frames))
+        team_assigner.add_color_samples(frames, tracks['player'][start_frame:start_frame + len(frames)], start_frame)
+        if on_progress is not None:
+            on_progress("analysis", start_frame + len(frames), video_info["frame_count"])
+
+        # render what is final: whole speed windows whose last frame has a smoothed ball
+        if start_frame + len(frames) >= STREAMING_TEAM_VOTE_FRAMES:
+            render_until(tracks, (len(ball_positions) - 1) // frame_window * frame_window)
+
+    with encoder:
+        if os.path.exists(tracks_stub):
+            # detection is cached, decode only for the stages that need the pixels
+            tracks = tracker.get_object_tracks([], read_from_stub=True, stub_path=tracks_stub)
+            start_frame = 0
+            for frames in read_video_chunks(input_path, window_size):
+                analyze_batch(tracks, frames, start_frame)
+                start_frame += len(frames)
+        else:
+            # decoding, detection and tracking overlap; the callback runs in frame order behind them
+            tracks = tracker.get_object_tracks_pipelined(iter_video_frames(input_path), stub_path=tracks_stub,
+                                                         queue_size=queue_size, on_batch=analyze_batch)
 
-    except Exception as e:
-        print(f"Error handling client: {e}")
-        client.close()
+        if not camera_cached:
+            save_stub(camera_stub, camera_movment_per_frame)
+        stage_cache.evict(keep=[tracks_stub, camera_stub])
+
+        with metrics.timer("stage_seconds", stage="ball_interpolation"):
+            ball_positions.extend(tracker.ball_filter.flush())
+        render_until(tracks, len(ball_positions))
+
+    team_assigner.add_teams_to_tracks(tracks)
+    detect_formation(tracks, team_id=0 , frame_sample_rate=5)
+    detect_formation(tracks, team_id=1, frame_sample_rate=5)
 
+    print(f"Processed video saved as {output_path}")
+
+def print_upload_stats(received_bytes, stats):
+    megabytes = received_bytes / 1e6
+    total = sum(stats.values())
+    for stage, seconds in stats.items():
+        rate = megabytes / seconds if seconds > 0 else float('inf')
+        print(f"{stage:>8}: {seconds:.2f}s ({rate:.1f} MB/s)")
+    if total > 0:
+        bottleneck = max(stats, key=stats.get)
+        bound = "network-bound" if bottleneck == "network" else "CPU-bound" if bottleneck == "decrypt" else "disk-bound"
+        print(f"Upload: {megabytes:.1f} MB in {total:.2f}s ({megabytes / total:.1f} MB/s), {bound}")
+
+def queue_upload(upload):
+    """
+    Hand a completed upload to the job scheduler and return the reply for the client.
+    The job takes over the uploaded file; if it is refused the upload stays
+    complete in the upload store for a retry.
+    """
+    suffix = os.path.splitext(upload['file_name'])[1] or '.mp4'
+    name = uuid.uuid4().hex
+    input_path = os.path.join(JOB_DIR, f"input_{name}{suffix}")
+    if SEGMENTED_OUTPUT and VIDEO_ENCODER_BACKEND == "ffmpeg" and shutil.which('ffmpeg') is not None:
+        output_path = os.path.join(OUTPUT_FOLDER, f"output_video_{name}", "index.m3u8")
+    else:
+        output_path = os.path.join(OUTPUT_FOLDER, f"output_video_{name}.mp4")
+    os.replace(upload['path'], input_path)
+    try:
+        job_id = job_scheduler.submit(input_path, output_path)
+    except JobRejected as e:
+        os.replace(input_path, upload['path'])
+        print(f"Job refused: {e}")
+        return {"error": str(e)}
+    upload_store.remove(upload['upload_id'])
+
+    print(f"Queued job {job_id}")
+    return {"job_id": job_id, "status_url": f"http://localhost:8000/jobs/{job_id}", "video_url": get_video_url(output_path)}
+
+async def handle_upload(reader, writer, upload_slots):
+    peer = writer.get_extra_info('peername')
+    try:
+        # connections beyond MAX_CONCURRENT_UPLOADS wait here without being read
+        async with upload_slots:
+            metrics.inc("uploads_active")
+            stats = {}
+            try:
+                upload = await receive_file_async(reader, writer, upload_store, SECRET_KEY, UPLOAD_TIMEOUT, stats)
+            finally:
+                metrics.inc("uploads_active", -1)
+                for stage, seconds in stats.items():
+                    metrics.inc("upload_seconds_total", seconds, stage=stage)
+            metrics.inc("upload_bytes_total", upload['received_bytes'])
+            print(f"Received file name: {upload['file_name']} ({upload['file_size']} bytes) from {peer}")
+            print_upload_stats(upload['received_bytes'], stats)
+
+            reply = await asyncio.get_running_loop().run_in_executor(None, queue_upload, upload)
+            await send_message_async(writer, reply)
+            metrics.inc("uploads_total", result="refused" if "error" in reply else "queued")
+
+    except asyncio.TimeoutError:
+        # committed chunks are kept in the upload store, the client resumes from there
+        metrics.inc("uploads_total", result="timeout")
+        print(f"Upload from {peer} stalled for {UPLOAD_TIMEOUT}s, closing connection")
+    except Exception as e:
+        metrics.inc("uploads_total", result="error")
+        print(f"Error handling client {peer}: {e}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def serve_uploads(host="localhost", port=9999):
+    upload_slots = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+    server = await asyncio.start_server(lambda reader, writer: handle_upload(reader, writer, upload_slots),
+                                        host, port, limit=2 * DEFAULT_CHUNK_SIZE)
+    print(f"Server listening on port {port}...")
+    async with server:
+        await server.serve_forever()
 
 def main():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("localhost", 9999))
-    server.listen(5)
-    print("Server listening on port 9999...")
-
-    while True:
-        client, addr = server.accept()
-        print(f"Connection from {addr}")
-        client_thread = Thread(target=handle_client, args=(client,))
-        client_thread.start()
+    global job_scheduler
+    job_scheduler = JobScheduler(process_video_streaming, JOB_DIR, JOB_WORKERS, JOB_MAX_PENDING, JOB_MEMORY_LIMIT_BYTES,
+                                 worker_initializer=warm_up_models, metrics_dir=METRICS_DIR,
+                                 profile_dir=JOB_PROFILE_DIR)
+    asyncio.run(serve_uploads())
 
 if __name__ == "__main__":
     flask_thread = Thread(target=run_flask_server)
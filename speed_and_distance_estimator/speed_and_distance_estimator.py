@@ -1,18 +1,22 @@
 import sys
 sys.path.append('../')
 import cv2
-from utils import measure_distance, get_foot_position
+import numpy as np
+from utils import measure_distance, get_foot_position, get_foot_positions, TrackTable
 from camera_movment_estimator import CameraMovmentEstimator
 
 class SpeedAndDistance_Estimator():
-    def __init__(self):
+    def __init__(self, frame_rate=24):
         self.frame_window = 5
-        self.frame_rate = 24
+        self.frame_rate = frame_rate
         self.persistent_data = {}
 
     
     
     def add_speed_and_distance_to_tracks(self, tracks):
+        if isinstance(tracks, TrackTable):
+            self.add_speed_and_distance_to_table(tracks)
+            return
         total_distance = {}
         for object, object_tracks in tracks.items():
             if object == "ball" or object == "referees":
@@ -65,9 +69,81 @@ class SpeedAndDistance_Estimator():
                         tracks[object][frame_num_batch][track_id]['distance'] = self.persistent_data[track_id]["distance"]
 
                         
-    def draw_speed_and_distance(self, frames, tracks):
+    def add_speed_and_distance_to_table(self, tracks):
+        """
+        Same windows and results as the dict version, computed on the TrackTable columns:
+        every window start is matched with the same track at the window end by key lookup.
+        """
+        skipped = [tracks.get_object_id(name) for name in ("ball", "referees") if name in tracks]
+        rows = np.flatnonzero(~np.isin(tracks.object_id, skipped))
+        if len(rows) == 0:
+            return
+        num_frames = tracks.num_frames
+        frames = tracks.frame[rows].astype(np.int64)
+        object_ids = tracks.object_id[rows].astype(np.int64)
+        track_ids = tracks.track_id[rows].astype(np.int64)
+
+        positions = tracks.position_transformed[rows].astype(np.float64)
+        missing = np.isnan(positions[:, 0])
+        positions[missing] = get_foot_positions(tracks.bbox[rows[missing]].astype(np.float64))
+
+        # rows are sorted by (frame, object, track_id), so these keys are sorted too
+        min_track_id = track_ids.min()
+        id_range = track_ids.max() - min_track_id + 1
+        num_objects = len(tracks.object_names)
+        def get_keys(frame, object_id, track_id):
+            return (frame * num_objects + object_id) * id_range + (track_id - min_track_id)
+        keys = get_keys(frames, object_ids, track_ids)
+
+        starts = np.flatnonzero(frames % self.frame_window == 0)
+        for track_id in np.unique(track_ids[starts]).tolist():
+            self.persistent_data.setdefault(track_id, {"speed": 0, "distance": 0})
+        start_frames = frames[starts]
+        last_frames = np.minimum(start_frames + self.frame_window, num_frames - 1)
+        end_keys = get_keys(last_frames, object_ids[starts], track_ids[starts])
+        ends = np.minimum(np.searchsorted(keys, end_keys), len(keys) - 1)
+        valid = (keys[ends] == end_keys) & (last_frames > start_frames)
+        starts, ends = starts[valid], ends[valid]
+        start_frames, last_frames = start_frames[valid], last_frames[valid]
+        if len(starts) == 0:
+            return
+
+        distance_covered = np.linalg.norm(positions[ends] - positions[starts], axis=1)
+        time_elapsed = (last_frames - start_frames) / self.frame_rate
+        speed_km_per_hour = distance_covered / time_elapsed * 3.6
+
+        # distance accumulates per track id over its windows, on top of what persistent_data already holds
+        window_track_ids = track_ids[starts]
+        order = np.lexsort((start_frames, window_track_ids))
+        sorted_ids = window_track_ids[order]
+        cumulative = np.cumsum(distance_covered[order])
+        group_start = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+        group_index = np.cumsum(group_start) - 1
+        group_base = (cumulative - distance_covered[order])[group_start]
+        unique_ids = sorted_ids[group_start]
+        previous_distance = np.array([self.persistent_data[track_id]["distance"] for track_id in unique_ids.tolist()], dtype=np.float64)
+        total_distance = np.empty_like(cumulative)
+        total_distance[order] = cumulative - group_base[group_index] + previous_distance[group_index]
+
+        last_of_group = np.r_[group_start[1:], True]
+        for track_id, speed, distance in zip(unique_ids.tolist(),
+                                             speed_km_per_hour[order][last_of_group].tolist(),
+                                             total_distance[order][last_of_group].tolist()):
+            self.persistent_data[track_id] = {"speed": speed, "distance": distance}
+
+        # every row takes the values of its window, except the video's last frame (as in the dict version)
+        window_keys = keys[starts]
+        row_window_start = frames - frames % self.frame_window
+        row_last_frame = np.minimum(row_window_start + self.frame_window, num_frames - 1)
+        lookup = get_keys(row_window_start, object_ids, track_ids)
+        window_index = np.minimum(np.searchsorted(window_keys, lookup), len(window_keys) - 1)
+        found = (window_keys[window_index] == lookup) & (frames < row_last_frame)
+        tracks.speed[rows[found]] = speed_km_per_hour[window_index[found]]
+        tracks.distance[rows[found]] = total_distance[window_index[found]]
+
+    def draw_speed_and_distance(self, frames, tracks, start_frame=0):
         output_frames = []
-        for frame_num, frame in enumerate(frames):
+        for frame_num, frame in enumerate(frames, start_frame):
             for object, object_tracks in tracks.items():
                 if object == "ball" or object == "referees":
                     continue
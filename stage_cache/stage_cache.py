@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+
+class StageCache:
+    """
+    Content-addressed store for stage results (tracks, camera movement, ...).
+
+    Every entry is a pickle stub named after the stage and a hash of everything
+    that determines its result: the video content, the model weights and the
+    stage parameters. The stubs are plain files, so they plug into the existing
+    read_from_stub / stub_path arguments. The directory is kept under max_bytes
+    by deleting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir='stubs/cache', max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._file_hashes = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def hash_file(self, path, chunk_size=1024 * 1024):
+        # remembered per (path, size, mtime) so the model weights are only hashed once
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if file_key in self._file_hashes:
+            return self._file_hashes[file_key]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self._file_hashes[file_key] = digest
+        return digest
+
+    def get_key(self, stage, video_hash, params):
+        key_data = json.dumps({"stage": stage, "video": video_hash, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+    def stub_path(self, stage, video_hash, params):
+        """
+        Return the stub path for this stage result. If the entry already exists
+        it is marked as recently used.
+        """
+        path = os.path.join(self.cache_dir, f"{stage}_{self.get_key(stage, video_hash, params)}.pkl")
+        if os.path.exists(path):
+            os.utime(path)
+        return path
+
+    def get_size(self):
+        return sum(stat.st_size for _, stat in self._list_entries())
+
+    def _list_entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat))
+        return entries
+
+    def evict(self, keep=()):
+        """
+        Delete least recently used stubs until the cache fits in max_bytes.
+        Paths in keep (the stubs of the current job) are never deleted.
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        entries = sorted(self._list_entries(), key=lambda entry: entry[1].st_mtime)
+        total_size = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total_size <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= stat.st_size
+        return total_size
@@ -1,13 +1,25 @@
 from sklearn.cluster import KMeans
 import numpy as np
 import cv2
+import sys
+sys.path.append('../')
+from utils import TrackTable
 
 class TeamAssigner:
-    def __init__(self):
+    def __init__(self, votes_per_track=5, sample_stride=10, crop_size=16, color_iterations=8):
         self.team_colors = {}
         self.player_team_dict = {}
         self.kmeans = None
 
+        # batched colour engine: each track is sampled up to votes_per_track times,
+        # at least sample_stride frames apart, on crop_size x crop_size Lab crops
+        self.votes_per_track = votes_per_track
+        self.sample_stride = sample_stride
+        self.crop_size = crop_size
+        self.color_iterations = color_iterations
+        self.color_samples = {}
+        self.last_sample_frame = {}
+
     def get_clustering_model(self, image):
         image_2d = image.reshape(-1, 3)
         kmeans = KMeans(n_clusters=2, init="k-means++", n_init=10)
@@ -75,8 +87,146 @@ class TeamAssigner:
 
         return team_id
 
+    def get_top_half_crop(self, frame, bbox):
+        # top half of the player bbox downsampled to crop_size x crop_size, None when it is too small
+        x1, y1, x2, y2 = map(int, bbox)
+        image = frame[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)]
+        if image.shape[0] < 5 or image.shape[1] < 5:
+            return None
+        top_half = image[:image.shape[0] // 2, :]
+        return cv2.resize(top_half, (self.crop_size, self.crop_size), interpolation=cv2.INTER_AREA)
+
+    def get_player_colors(self, crops):
+        """
+        Jersey colour of many crops at once, in Lab.
+        Runs a vectorized 2-means over the pixels of every crop (background cluster
+        seeded from the corners, player cluster from the centre) and, as in
+        get_player_color, keeps the cluster that does not own most of the corners.
+        """
+        crops = np.asarray(crops, dtype=np.uint8)
+        num_crops, size = crops.shape[0], crops.shape[1]
+        lab = cv2.cvtColor(crops.reshape(num_crops * size, size, 3), cv2.COLOR_BGR2Lab)
+        pixels = lab.reshape(num_crops, size * size, 3).astype(np.float32)
+
+        corners = [0, size - 1, size * (size - 1), size * size - 1]
+        centre = (size // 2) * size + size // 2
+        centers = np.stack([pixels[:, corners].mean(axis=1), pixels[:, centre]], axis=1)
+        for _ in range(self.color_iterations):
+            distances = ((pixels[:, :, None, :] - centers[:, None, :, :]) ** 2).sum(axis=-1)
+            labels = distances.argmin(axis=-1)
+            members = labels[..., None] == np.arange(2)
+            counts = members.sum(axis=1)
+            sums = np.einsum('npk,npc->nkc', members.astype(np.float32), pixels)
+            centers = np.where(counts[..., None] > 0, sums / np.maximum(counts, 1)[..., None], centers)
+
+        non_player_cluster = (labels[:, corners].sum(axis=1) > 2).astype(int)
+        player_cluster = 1 - non_player_cluster
+        return centers[np.arange(num_crops), player_cluster].astype(np.float64)
+
+    def add_color_samples(self, video_frames, player_tracks, start_frame=0):
+        """
+        Collect jersey colour samples for the players of a window of frames.
+        player_tracks[i] is the player dict of video_frames[i]. All crops of the
+        window go through get_player_colors in one batch.
+        """
+        crops = []
+        crop_player_ids = []
+        for frame_num, (frame, player_track) in enumerate(zip(video_frames, player_tracks), start_frame):
+            for player_id, track in player_track.items():
+                samples = self.color_samples.setdefault(player_id, [])
+                if len(samples) >= self.votes_per_track:
+                    continue
+                last_frame = self.last_sample_frame.get(player_id)
+                if last_frame is not None and frame_num - last_frame < self.sample_stride:
+                    continue
+                self.last_sample_frame[player_id] = frame_num
+                crop = self.get_top_half_crop(frame, track['bbox'])
+                if crop is not None:
+                    crops.append(crop)
+                    crop_player_ids.append(player_id)
+
+        if crops:
+            for player_id, color in zip(crop_player_ids, self.get_player_colors(crops)):
+                self.color_samples[player_id].append(color)
+
+    def assign_teams_by_vote(self):
+        """
+        Fit the two team colours on the median colour of every sampled track, then give
+        every track the team most of its samples were predicted as. Fills team_colors
+        (BGR, for drawing) and player_team_dict like assign_team_color / get_player_team.
+        """
+        sampled_ids = [player_id for player_id, samples in self.color_samples.items() if samples]
+        if len(sampled_ids) < 2:
+            print("⚠️ Not enough players to cluster teams.")
+            return
+
+        track_colors = np.array([np.median(self.color_samples[player_id], axis=0) for player_id in sampled_ids])
+        kmeans = KMeans(n_clusters=2, init="k-means++", n_init=10)
+        kmeans.fit(track_colors)
+        self.kmeans = kmeans
+
+        centers_lab = np.clip(kmeans.cluster_centers_, 0, 255).astype(np.uint8).reshape(1, 2, 3)
+        centers_bgr = cv2.cvtColor(centers_lab, cv2.COLOR_Lab2BGR).reshape(2, 3).astype(np.float64)
+        self.team_colors[1] = centers_bgr[0]
+        self.team_colors[2] = centers_bgr[1]
+
+        self.vote_teams(list(self.color_samples.keys()))
+
+    def vote_teams(self, player_ids):
+        # tracks whose crops were all too small vote with a black crop, as get_player_color does
+        black = cv2.cvtColor(np.zeros((1, 1, 3), np.uint8), cv2.COLOR_BGR2Lab).reshape(3).astype(np.float64)
+        colors = []
+        owners = []
+        for index, player_id in enumerate(player_ids):
+            samples = self.color_samples.get(player_id) or [black]
+            colors.extend(samples)
+            owners.extend([index] * len(samples))
+        if not colors:
+            return
+        predictions = self.kmeans.predict(np.array(colors))
+        votes = np.zeros((len(player_ids), 2), dtype=np.int64)
+        np.add.at(votes, (np.array(owners), predictions), 1)
+        for player_id, team_id in zip(player_ids, votes.argmax(axis=1) + 1):
+            self.player_team_dict[player_id] = team_id
 
+    def assign_new_tracks_by_vote(self, player_ids):
+        """
+        Give the tracks in player_ids that have no team yet the team most of their
+        samples so far are predicted as, on the team colours already fitted (fitted
+        here by assign_teams_by_vote the first time). Teams already given never change,
+        so a video can be assigned window by window.
+        """
+        if self.kmeans is None:
+            self.assign_teams_by_vote()
+            if self.kmeans is None:
+                return
+        new_ids = [player_id for player_id in dict.fromkeys(player_ids) if player_id not in self.player_team_dict]
+        self.vote_teams(new_ids)
+
+    def add_teams_to_tracks(self, tracks):
+        # write team / team_color of every player row from player_team_dict
+        if self.kmeans is None:
+            return
+        if isinstance(tracks, TrackTable):
+            rows = tracks.get_object_rows('player')
+            player_ids = np.array(list(self.player_team_dict.keys()), dtype=np.int64)
+            teams = np.array(list(self.player_team_dict.values()), dtype=np.int64)
+            order = np.argsort(player_ids)
+            player_ids, teams = player_ids[order], teams[order]
+            track_ids = tracks.track_id[rows].astype(np.int64)
+            index = np.minimum(np.searchsorted(player_ids, track_ids), len(player_ids) - 1)
+            known = player_ids[index] == track_ids
+            row_teams = teams[index[known]]
+            tracks.team[rows[known]] = row_teams
+            team_colors = np.array([self.team_colors[1], self.team_colors[2]], dtype=np.float32)
+            tracks.team_color[rows[known]] = team_colors[row_teams - 1]
+            return
 
+        for player_track in tracks['player']:
+            for player_id, track in player_track.items():
+                team = self.player_team_dict.get(player_id)
+                if team is None:
+                    continue
+                track['team'] = team
+                track['team_color'] = self.team_colors[team]
 
-        
-            
\ No newline at end of file
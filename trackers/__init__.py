@@ -1 +1,7 @@
-from .tracker import Tracker
\ No newline at end of file
+from .tracker import Tracker
+from .detection_pipeline import DetectionPipeline
+from .model_registry import ModelRegistry, get_model
+from .keyframes import KeyframeSelector, BoxPropagator
+from .ball_crops import BallCropDetector
+from .detector_backends import DETECTOR_BACKENDS, export_model, select_backend
+from .ball_filter import BallKalmanFilter, BALL_MOTION_MODELS
\ No newline at end of file
@@ -0,0 +1,125 @@
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from instrumentation import metrics
+
+
+class BallCropDetector:
+    """
+    Second, high-resolution detection pass for the ball.
+
+    The full-frame pass can run downscaled (Tracker imgsz) for the players and
+    referees; the ball is then searched in a crop_size x crop_size crop of the
+    full-resolution frame around its expected position: the ball the
+    full-frame pass found in that frame, or else the position extrapolated
+    from the last balls found (constant velocity). The best ball in the crop
+    replaces the full-frame ones, and the full-frame ball is the fallback when
+    the crop has none. After lost_frames frames without a ball there is no
+    expected position anymore and only the full-frame pass can find it again.
+    crop_imgsz is the inference size of the crops, crop_size (no resizing) by default.
+    """
+
+    def __init__(self, crop_size=320, crop_imgsz=None, lost_frames=10):
+        self.crop_size = crop_size
+        self.crop_imgsz = crop_imgsz or crop_size
+        self.lost_frames = lost_frames
+        self.reset()
+
+    def get_params(self):
+        return {
+            "crop_size": self.crop_size,
+            "crop_imgsz": self.crop_imgsz,
+            "lost_frames": self.lost_frames,
+        }
+
+    def reset(self):
+        # last ball center found, its velocity per frame and the frames since
+        self.center = None
+        self.velocity = np.zeros(2)
+        self.frames_since = 0
+
+    def get_ball_rows(self, detection):
+        ball_ids = [class_id for class_id, name in detection.names.items() if name == 'ball']
+        return torch.isin(detection.boxes.cls, torch.tensor(ball_ids, device=detection.boxes.cls.device))
+
+    def get_best_ball(self, detection):
+        # (x1, y1, x2, y2, conf, cls) row of the most confident ball, None without one
+        boxes = detection.boxes.data[self.get_ball_rows(detection)]
+        return boxes[boxes[:, 4].argmax()] if len(boxes) else None
+
+    def expected_centers(self, detections):
+        # the ball center to crop around for every frame, None when the ball is lost
+        centers = []
+        center, velocity, frames_since = self.center, self.velocity, self.frames_since
+        for detection in detections:
+            ball = self.get_best_ball(detection)
+            frames_since += 1
+            if ball is not None:
+                ball = ball[:4].tolist()
+                found = np.array([(ball[0] + ball[2]) / 2, (ball[1] + ball[3]) / 2])
+                centers.append(found)
+                # the velocity is only updated from the crop results in update()
+                center, frames_since = found, 0
+            elif center is not None and frames_since <= self.lost_frames:
+                centers.append(center + velocity * frames_since)
+            else:
+                centers.append(None)
+        return centers
+
+    def get_crop_box(self, frame, center):
+        height, width = frame.shape[:2]
+        size_x, size_y = min(self.crop_size, width), min(self.crop_size, height)
+        x1 = int(np.clip(round(center[0] - size_x / 2), 0, width - size_x))
+        y1 = int(np.clip(round(center[1] - size_y / 2), 0, height - size_y))
+        return x1, y1, x1 + size_x, y1 + size_y
+
+    def update(self, ball):
+        self.frames_since += 1
+        if ball is None:
+            return
+        center = np.array([(ball[0] + ball[2]) / 2, (ball[1] + ball[3]) / 2])
+        if self.center is not None and self.frames_since <= self.lost_frames:
+            self.velocity = (center - self.center) / self.frames_since
+        else:
+            self.velocity = np.zeros(2)
+        self.center, self.frames_since = center, 0
+
+    def detect(self, model, frames, detections, conf):
+        """
+        Run the crop pass on frames and return detections with the ball of each
+        frame replaced by the crop result (or the full-frame fallback).
+        """
+        centers = self.expected_centers(detections)
+        crop_boxes = [self.get_crop_box(frame, center) if center is not None else None
+                      for frame, center in zip(frames, centers)]
+        crops = [np.ascontiguousarray(frame[y1:y2, x1:x2])
+                 for frame, crop_box in zip(frames, crop_boxes) if crop_box is not None
+                 for x1, y1, x2, y2 in [crop_box]]
+        ball_ids = [class_id for class_id, name in detections[0].names.items() if name == 'ball'] if detections else []
+        crop_detections = []
+        if crops:
+            with metrics.timer("inference_batch_seconds", stage="ball_crop"):
+                crop_detections = model.predict(crops, conf=conf, imgsz=self.crop_imgsz, classes=ball_ids)
+        crop_detections = iter(crop_detections)
+
+        results = []
+        for frame, detection, crop_box in zip(frames, detections, crop_boxes):
+            ball, source = None, "missed"
+            if crop_box is not None:
+                ball = self.get_best_ball(next(crop_detections))
+                if ball is not None:
+                    ball = ball.clone()
+                    ball[:4] += torch.tensor([crop_box[0], crop_box[1]] * 2, dtype=ball.dtype, device=ball.device)
+                    source = "crop"
+            if ball is None:
+                ball = self.get_best_ball(detection)
+                source = "full_frame" if ball is not None else source
+            metrics.inc("ball_detections_total", source=source)
+            self.update(ball[:4].tolist() if ball is not None else None)
+
+            boxes = detection.boxes.data[~self.get_ball_rows(detection)]
+            if ball is not None:
+                boxes = torch.cat([boxes, ball[None]])
+            results.append(Results(frame, path=detection.path, names=detection.names, boxes=boxes))
+        return results
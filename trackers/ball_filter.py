@@ -0,0 +1,256 @@
+import numpy as np
+
+from instrumentation import metrics
+
+BALL_MOTION_MODELS = ("velocity", "acceleration")
+
+
+def get_kinematic_model(motion_model, process_noise):
+    # per-axis transition and discrete white noise (acceleration / jerk) of [position, velocity(, acceleration)]
+    if motion_model == "velocity":
+        transition = np.array([[1.0, 1.0], [0.0, 1.0]])
+        noise_gain = np.array([0.5, 1.0])
+    else:
+        transition = np.array([[1.0, 1.0, 0.5], [0.0, 1.0, 1.0], [0.0, 0.0, 1.0]])
+        noise_gain = np.array([1 / 6, 0.5, 1.0])
+    return transition, process_noise ** 2 * np.outer(noise_gain, noise_gain)
+
+
+class BallKalmanFilter:
+    """
+    Kalman filter and Rauch-Tung-Striebel smoother for the ball track.
+
+    The ball center follows a constant velocity ("velocity" motion model) or
+    constant acceleration ("acceleration") model, the box width and height a
+    random walk. A detection whose center is further than gate_threshold
+    (squared Mahalanobis distance) from the prediction is dropped as a false
+    positive; after max_rejections dropped detections in a row they are
+    filtered again as a kick, or else the filter restarts on the last one, in
+    case it was following a false positive itself. After lost_frames frames
+    without a detection the ball is held in place instead of extrapolated, so
+    long gaps are bridged linearly once it is found again.
+
+    smooth() runs on a whole track (batch mode). update() takes the ball track
+    window by window and returns the frames that have at least lookahead
+    frames after them, smoothed on those (streaming mode); flush() returns the
+    rest. Both return the {1: {"bbox": [x1, y1, x2, y2]}} per frame of the
+    tracks, for every frame: before the first detection the first position is
+    used (streaming mode holds those frames until it is found), and only a
+    track without any ball gets NaN boxes.
+    """
+
+    def __init__(self, motion_model="velocity", process_noise=None, measurement_noise=3.0, size_noise=0.5,
+                 gate_threshold=16.0, max_rejections=3, lost_frames=10, lookahead=None, initial_velocity=15.0):
+        if motion_model not in BALL_MOTION_MODELS:
+            raise ValueError(f"Unknown ball motion model: {motion_model}, expected one of {BALL_MOTION_MODELS}")
+        # px/frame^2 of acceleration, or px/frame^3 of jerk for the acceleration model
+        if process_noise is None:
+            process_noise = 3.0 if motion_model == "velocity" else 1.0
+        self.motion_model = motion_model
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.size_noise = size_noise
+        self.gate_threshold = gate_threshold
+        self.max_rejections = max_rejections
+        self.lost_frames = lost_frames
+        self.lookahead = lookahead
+        self.initial_velocity = initial_velocity
+
+        # x and y are always measured together with the same noise, so they share
+        # one covariance over [position, velocity(, acceleration)]
+        self.F, self.Q = get_kinematic_model(motion_model, process_noise)
+        order = len(self.F)
+        derivative_variances = [initial_velocity ** 2] + [process_noise ** 2] * (order - 2)
+        self.P0 = np.diag([measurement_noise ** 2] + derivative_variances)
+        # lost: the derivatives start over and the center is a random walk
+        self.F_lost = np.diag([1.0] + [0.0] * (order - 1))
+        self.Q_lost = np.diag([initial_velocity ** 2] + derivative_variances)
+        # a kick: position and derivatives unknown, the replayed detections decide them
+        self.Q_maneuver = np.diag([1e6] * order)
+        self.reset()
+
+    def get_params(self):
+        return {
+            "motion_model": self.motion_model,
+            "process_noise": self.process_noise,
+            "measurement_noise": self.measurement_noise,
+            "size_noise": self.size_noise,
+            "gate_threshold": self.gate_threshold,
+            "max_rejections": self.max_rejections,
+            "lost_frames": self.lost_frames,
+            "lookahead": self.lookahead,
+            "initial_velocity": self.initial_velocity,
+        }
+
+    def reset(self):
+        # center state (order x 2, one column per axis) and its covariance, box size and its variance
+        self.state = None
+        self.frames_since = 0
+        self.rejections = 0
+        # per frame not returned yet: (filtered center state, box size, link to the frame before), None
+        # before the first ball; the link holds what the RTS smoother needs and is None where the filter (re)started
+        self.pending = []
+        self.popped = 0
+        self.last_bbox = [np.nan] * 4
+        # the state before the current run of rejected detections, its frame number and the boxes since
+        self.checkpoint = None
+        self.replay = []
+
+    def initialize(self, center, size):
+        mean = np.zeros((len(self.F), 2))
+        mean[0] = center
+        self.state = (mean, self.P0, size, self.size_noise ** 2)
+        self.frames_since = 0
+        self.rejections = 0
+        self.pending.append((mean, size, None))
+
+    def get_measurement(self, bbox):
+        if len(bbox) != 4 or np.isnan(bbox).any():
+            return None, None
+        x1, y1, x2, y2 = bbox
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2]), np.array([x2 - x1, y2 - y1])
+
+    def step(self, bbox):
+        center, size = self.get_measurement(bbox)
+        if self.state is None:
+            if center is None:
+                self.pending.append(None)
+                return None
+            self.initialize(center, size)
+            return "accepted"
+
+        if self.rejections == 0:
+            self.checkpoint = (self.state, self.frames_since, self.popped + len(self.pending))
+            self.replay = []
+        self.replay.append(bbox)
+        result = self.filter(center, size)
+        if result == "rejected" and self.rejections >= self.max_rejections:
+            self.restart()
+            return "restarted"
+        return result
+
+    def restart(self):
+        """
+        max_rejections detections in a row did not fit: either the ball changed
+        direction or speed (a kick) or the filter followed a false positive.
+        The rejected frames are filtered again from the state before the first
+        of them, with the position and velocity unknown at the first one, so
+        a kick keeps its detections; if they still do not fit, the filter
+        starts over on the last one.
+        """
+        state, frames_since, frame_num = self.checkpoint
+        start = frame_num - self.popped
+        if start >= 0:
+            del self.pending[start:]
+            self.state, self.frames_since, self.rejections = state, frames_since, 0
+            for index, bbox in enumerate(self.replay):
+                center, size = self.get_measurement(bbox)
+                self.filter(center, size, maneuver=index == 0)
+            if self.rejections < self.max_rejections:
+                return
+            self.pending.pop()
+        else:
+            # the first rejected frames are already returned (streaming mode)
+            self.pending.pop()
+            center, size = self.get_measurement(self.replay[-1])
+        self.initialize(center, size)
+
+    def filter(self, center, size, maneuver=False):
+        previous_mean, previous_P, mean_size, previous_size_variance = self.state
+        F, Q = (self.F, self.Q) if self.frames_since < self.lost_frames else (self.F_lost, self.Q_lost)
+        mean = F @ previous_mean
+        P = F @ previous_P @ F.T + Q
+        if maneuver:
+            P = P + self.Q_maneuver
+        size_variance = previous_size_variance + self.size_noise ** 2
+        # smoother gains back to the previous frame, with the predictions they correct
+        link = (previous_P @ F.T @ np.linalg.inv(P), mean, previous_size_variance / size_variance, mean_size)
+        self.frames_since += 1
+        result = "missing"
+        if center is not None:
+            innovation = center - mean[0]
+            innovation_variance = P[0, 0] + self.measurement_noise ** 2
+            if maneuver or innovation @ innovation / innovation_variance <= self.gate_threshold:
+                gain = P[:, 0] / innovation_variance
+                mean = mean + gain[:, None] * innovation
+                P = P - gain[:, None] * P[0]
+                size_gain = size_variance / (size_variance + self.size_noise ** 2)
+                mean_size = mean_size + size_gain * (size - mean_size)
+                size_variance = (1 - size_gain) * size_variance
+                self.frames_since = 0
+                self.rejections = 0
+                result = "accepted"
+            else:
+                self.rejections += 1
+                result = "rejected"
+        self.state = (mean, P, mean_size, size_variance)
+        self.pending.append((mean, mean_size, link))
+        return result
+
+    def get_smoothed_boxes(self):
+        # RTS backward pass over the pending frames, from the newest filtered state; NaN rows before the first ball
+        centers = np.full((len(self.pending), 2), np.nan)
+        sizes = np.full((len(self.pending), 2), np.nan)
+        smoothed = link = None
+        for index in range(len(self.pending) - 1, -1, -1):
+            if self.pending[index] is None:
+                smoothed = link = None
+                continue
+            mean, mean_size, previous_link = self.pending[index]
+            if smoothed is not None and link is not None:
+                C, mean_pred, size_gain, mean_size_pred = link
+                mean = mean + C @ (smoothed[0] - mean_pred)
+                mean_size = mean_size + size_gain * (smoothed[1] - mean_size_pred)
+            smoothed, link = (mean, mean_size), previous_link
+            centers[index], sizes[index] = mean[0], mean_size
+        return np.hstack([centers - sizes / 2, centers + sizes / 2])
+
+    def pop_frames(self, count):
+        boxes = self.get_smoothed_boxes()
+        # before the first ball: the next position found, else the last one
+        frame_nums = np.arange(len(boxes))
+        next_found = np.minimum.accumulate(np.where(np.isnan(boxes[:, 0]), len(boxes), frame_nums)[::-1])[::-1]
+        boxes = boxes.tolist()
+        ball_positions = []
+        for index in next_found[:count].tolist():
+            if index < len(boxes):
+                self.last_bbox = boxes[index]
+            ball_positions.append({1: {"bbox": list(self.last_bbox)}})
+        del self.pending[:count]
+        self.popped += count
+        return ball_positions
+
+    def add_frames(self, ball_positions):
+        counts = {}
+        for ball in ball_positions:
+            result = self.step(ball.get(1, {}).get('bbox', []))
+            if result is not None:
+                counts[result] = counts.get(result, 0) + 1
+        for result, count in counts.items():
+            metrics.inc("ball_measurements_total", count, result=result)
+
+    def update(self, ball_positions):
+        """
+        Feed the next frames of the ball track; returns the frames now final.
+        A frame is held until lookahead frames after it are in, and frames are
+        returned in blocks of at least lookahead frames (at most 2 * lookahead
+        are held when the windows are no longer than lookahead). Frames before
+        the first ball are held until it is found, however long that takes.
+        Without lookahead nothing is returned before flush().
+        """
+        self.add_frames(ball_positions)
+        # frames before the first ball stay pending until it is found, so they get its position
+        if self.lookahead is None or self.state is None:
+            return []
+        ready = len(self.pending) - self.lookahead
+        return self.pop_frames(ready) if ready >= max(self.lookahead, 1) else []
+
+    def flush(self):
+        return self.pop_frames(len(self.pending))
+
+    def smooth(self, ball_positions):
+        self.reset()
+        self.add_frames(ball_positions)
+        ball_positions = self.flush()
+        self.reset()
+        return ball_positions
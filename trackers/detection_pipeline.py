@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+
+from instrumentation import metrics
+
+_END = object()
+
+
+class DetectionPipeline:
+    """
+    Overlaps decoding, YOLO inference and ByteTrack tracking.
+
+    A decoder thread groups incoming frames into batches of batch_size and puts
+    them on a bounded queue, an inference thread runs the model on each batch as
+    soon as it is ready, and the calling thread runs ByteTrack on the results in
+    frame order. queue_size bounds how many batches wait between two stages, so
+    memory stays at roughly (2 * queue_size + 2) * batch_size frames.
+    """
+
+    def __init__(self, tracker, batch_size=20, queue_size=4):
+        self.tracker = tracker
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stats = {}
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _add_stat(self, stage, frames, seconds):
+        with self._lock:
+            stage_stats = self.stats.setdefault(stage, {"frames": 0, "seconds": 0.0})
+            stage_stats["frames"] += frames
+            stage_stats["seconds"] += seconds
+        if stage != "total":
+            metrics.observe("stage_seconds", seconds, stage=stage)
+            metrics.inc("stage_frames_total", frames, stage=stage)
+
+    def _put(self, out_queue, item):
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue):
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _decode(self, frames, out_queue):
+        try:
+            frames = iter(frames)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                batch = []
+                for frame in frames:
+                    batch.append(frame)
+                    if len(batch) == self.batch_size:
+                        break
+                self._add_stat("decode", len(batch), time.perf_counter() - start)
+                if not batch:
+                    break
+                if not self._put(out_queue, batch):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_queue, _END)
+
+    def _infer(self, in_queue, out_queue):
+        try:
+            while True:
+                batch = self._get(in_queue)
+                if batch is _END:
+                    break
+                start = time.perf_counter()
+                detections = self.tracker.detect_frames(batch)
+                self._add_stat("inference", len(batch), time.perf_counter() - start)
+                if not self._put(out_queue, (batch, detections)):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_queue, _END)
+
+    def run(self, frames, on_batch=None):
+        """
+        Detect and track every frame of the iterable frames and return the tracks.
+        on_batch(tracks, frames, start_frame) is called on the calling thread after
+        each batch has been tracked, for stages that need the decoded frames as well.
+        """
+        self.stats = {}
+        self._stop.clear()
+        self._error = None
+
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        detection_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._decode, args=(frames, frame_queue), daemon=True),
+            threading.Thread(target=self._infer, args=(frame_queue, detection_queue), daemon=True),
+        ]
+
+        tracks = {
+            "player": [],
+            "referees": [],
+            "ball": []
+        }
+        wall_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(detection_queue)
+                if item is _END:
+                    break
+                batch, detections = item
+                start_frame = len(tracks["player"])
+                metrics.set_gauge("queue_depth", frame_queue.qsize(), queue="detection_frames")
+                metrics.set_gauge("queue_depth", detection_queue.qsize(), queue="detection_results")
+
+                start = time.perf_counter()
+                self.tracker.add_detections_to_tracks(tracks, detections, batch)
+                self._add_stat("tracking", len(batch), time.perf_counter() - start)
+
+                if on_batch is not None:
+                    start = time.perf_counter()
+                    on_batch(tracks, batch, start_frame)
+                    self._add_stat("on_batch", len(batch), time.perf_counter() - start)
+        except BaseException as e:
+            self._fail(e)
+            raise
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            metrics.set_gauge("queue_depth", 0, queue="detection_frames")
+            metrics.set_gauge("queue_depth", 0, queue="detection_results")
+            self._add_stat("total", len(tracks["player"]), time.perf_counter() - wall_start)
+
+        if self._error is not None:
+            raise self._error
+        return tracks
+
+    def get_throughput(self):
+        # frames per second of busy time for every stage, "total" is wall-clock
+        return {
+            stage: stage_stats["frames"] / stage_stats["seconds"] if stage_stats["seconds"] > 0 else 0.0
+            for stage, stage_stats in self.stats.items()
+        }
+
+    def print_stats(self):
+        for stage, fps in self.get_throughput().items():
+            stage_stats = self.stats[stage]
+            print(f"{stage:>10}: {stage_stats['frames']} frames in {stage_stats['seconds']:.2f}s ({fps:.1f} fps)")
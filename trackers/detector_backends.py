@@ -0,0 +1,206 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import supervision as sv
+from scipy.optimize import linear_sum_assignment
+from ultralytics import YOLO
+
+# backend: (ultralytics export format, module the runtime needs)
+DETECTOR_BACKENDS = {
+    "pytorch": (None, "torch"),
+    "onnx": ("onnx", "onnxruntime"),
+    "openvino": ("openvino", "openvino"),
+}
+DEFAULT_CALIBRATION_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'training',
+                                        'football-players-detection-1', 'data.yaml')
+# held-out images an export is compared to the PyTorch model on before it is used
+DEFAULT_PARITY_IMAGES = os.path.join(os.path.dirname(DEFAULT_CALIBRATION_DATA), 'football-players-detection-1',
+                                     'valid', 'images', '*.jpg')
+DEFAULT_MIN_PARITY = 0.95
+
+
+def hash_weights(model_path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_export_settings(backend="pytorch", imgsz=640, int8=False, batch=20, calibration_data=DEFAULT_CALIBRATION_DATA,
+                        calibration_split="train", calibration_fraction=0.5):
+    # every setting that changes the exported model, in a stable form
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend}, expected one of {list(DETECTOR_BACKENDS)}")
+    if backend == "pytorch":
+        if int8:
+            raise ValueError("INT8 needs an exported backend (onnx or openvino)")
+        return {"backend": backend}
+    settings = {"backend": backend, "imgsz": imgsz, "int8": int8, "batch": batch}
+    if int8:
+        settings.update(calibration_data=os.path.normpath(calibration_data), calibration_split=calibration_split,
+                        calibration_fraction=calibration_fraction)
+    return settings
+
+
+def get_export_dir(model_path, export_dir, settings):
+    key = hashlib.sha256((hash_weights(model_path) + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(export_dir, f"{stem}_{settings['backend']}{'_int8' if settings['int8'] else ''}_{key[:16]}")
+
+
+def export_model(model_path, export_dir=None, **settings):
+    """
+    Path of the model to load for a backend: model_path itself for "pytorch",
+    otherwise an export of it with dynamic batch and image size, made on first
+    use and kept in export_dir (models/exported next to the weights by default)
+    under the weights hash and the settings. With int8=True the export is
+    statically quantized, calibrated on calibration_fraction of the
+    calibration_split images of the calibration_data dataset.
+    """
+    settings = get_export_settings(**settings)
+    export_format, runtime = DETECTOR_BACKENDS[settings["backend"]]
+    if importlib.util.find_spec(runtime) is None:
+        raise ImportError(f"The {settings['backend']} detector backend needs the {runtime} package")
+    if export_format is None:
+        return model_path
+
+    export_dir = export_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), 'exported')
+    target_dir = get_export_dir(model_path, export_dir, settings)
+    info_path = os.path.join(target_dir, 'export.json')
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            return os.path.join(target_dir, json.load(f)["path"])
+
+    # export into a temporary directory next to the target, then rename it, so
+    # concurrent workers never load a half-written export
+    os.makedirs(export_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.export_', dir=export_dir)
+    try:
+        work_weights = os.path.join(work_dir, os.path.basename(model_path))
+        shutil.copyfile(model_path, work_weights)
+        export_args = dict(format=export_format, imgsz=settings["imgsz"], dynamic=True, batch=settings["batch"])
+        if settings["int8"]:
+            export_args.update(quantize=8, data=settings["calibration_data"], split=settings["calibration_split"],
+                               fraction=settings["calibration_fraction"])
+        exported = YOLO(work_weights).export(**export_args)
+        os.remove(work_weights)
+        with open(os.path.join(work_dir, 'export.json'), 'w') as f:
+            json.dump({"path": os.path.relpath(exported, work_dir), "settings": settings}, f)
+        try:
+            os.rename(work_dir, target_dir)
+        except OSError:
+            # another process finished the same export first
+            if not os.path.exists(info_path):
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(info_path) as f:
+        return os.path.join(target_dir, json.load(f)["path"])
+
+
+def get_iou(boxes_a, boxes_b):
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def detect(model, images, batch_size, conf, imgsz):
+    detections = []
+    for i in range(0, len(images), batch_size):
+        results = model.predict(images[i:i + batch_size], conf=conf, imgsz=imgsz, verbose=False)
+        detections += [sv.Detections.from_ultralytics(result) for result in results]
+    return detections
+
+
+def compare_detections(detections, reference, conf):
+    """
+    Match per image and class the detections of a backend to the reference
+    (PyTorch) ones, Hungarian matching on IoU:
+    - recall / precision: reference / backend boxes above conf matched with
+      IoU >= 0.5; both sides should be detected at half of conf, so a box whose
+      confidence only moved across conf still counts as matched;
+    - mean_iou and conf_diff (mean |conf diff|) of the matched boxes.
+    """
+    matched_reference, total, matched_found, found, ious, conf_diffs = 0, 0, 0, 0, [], []
+    for frame_detections, frame_reference in zip(detections, reference):
+        total += int((frame_reference.confidence >= conf).sum())
+        found += int((frame_detections.confidence >= conf).sum())
+        for class_id in np.unique(np.concatenate([frame_detections.class_id, frame_reference.class_id])):
+            boxes = frame_detections[frame_detections.class_id == class_id]
+            reference_boxes = frame_reference[frame_reference.class_id == class_id]
+            if not len(boxes) or not len(reference_boxes):
+                continue
+            iou = get_iou(reference_boxes.xyxy, boxes.xyxy)
+            rows, cols = linear_sum_assignment(-iou)
+            good = iou[rows, cols] >= 0.5
+            rows, cols = rows[good], cols[good]
+            matched_reference += int((reference_boxes.confidence[rows] >= conf).sum())
+            matched_found += int((boxes.confidence[cols] >= conf).sum())
+            above = (reference_boxes.confidence[rows] >= conf) | (boxes.confidence[cols] >= conf)
+            ious.extend(iou[rows, cols][above])
+            conf_diffs.extend(np.abs(reference_boxes.confidence[rows] - boxes.confidence[cols])[above])
+    return {
+        "recall": matched_reference / total if total else 1.0,
+        "precision": matched_found / found if found else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+        "conf_diff": float(np.mean(conf_diffs)) if conf_diffs else 0.0,
+    }
+
+
+def measure_parity(model_path, exported_path, images, imgsz=640, conf=0.1, batch_size=8):
+    reference = detect(YOLO(model_path, task='detect'), images, batch_size, conf / 2, imgsz)
+    detections = detect(YOLO(exported_path, task='detect'), images, batch_size, conf / 2, imgsz)
+    return compare_detections(detections, reference, conf)
+
+
+def select_backend(model_path, backend="pytorch", min_parity=DEFAULT_MIN_PARITY, parity_images=DEFAULT_PARITY_IMAGES,
+                   export_dir=None, **export_settings):
+    """
+    Export settings of the detector to run: those of backend when its export
+    detects like the PyTorch model (recall and precision of
+    compare_detections at least min_parity on the parity_images glob), else
+    PyTorch's. Every export is measured once, on first use, and the result is
+    kept next to it in parity.json. min_parity=None skips the check.
+    """
+    settings = get_export_settings(backend, **export_settings)
+    if backend == "pytorch" or min_parity is None:
+        return settings
+
+    exported_path = export_model(model_path, export_dir=export_dir, **settings)
+    export_dir = export_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), 'exported')
+    parity_path = os.path.join(get_export_dir(model_path, export_dir, settings), 'parity.json')
+    if os.path.exists(parity_path):
+        with open(parity_path) as f:
+            parity = json.load(f)
+    else:
+        images = [cv2.imread(path) for path in sorted(glob.glob(parity_images))]
+        if not images:
+            print(f"No parity images in {parity_images}, running the detector on pytorch instead of {backend}")
+            return get_export_settings("pytorch")
+        parity = dict(measure_parity(model_path, exported_path, images, settings["imgsz"]), images=len(images))
+        # atomic, other workers may read it at any time
+        tmp_path = f"{parity_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(parity, f)
+        os.replace(tmp_path, parity_path)
+
+    if min(parity["recall"], parity["precision"]) < min_parity:
+        print(f"The {backend} export of {model_path} ({settings}) does not match PyTorch: recall {parity['recall']:.1%}, "
+              f"precision {parity['precision']:.1%}, required {min_parity:.0%}; running the detector on pytorch")
+        return get_export_settings("pytorch")
+    return settings
@@ -0,0 +1,163 @@
+import cv2
+import numpy as np
+
+PROPAGATION_METHODS = ("motion", "flow")
+
+
+class KeyframeSelector:
+    """
+    Decides which frames the detector runs on.
+
+    Every stride-th frame is a keyframe. With motion_threshold, a frame whose
+    small grayscale thumbnail differs from the last keyframe's by more than
+    motion_threshold grey levels on average (a fast pan or a cut) is a keyframe
+    as well, and request_keyframe() makes the next frame one (used when the
+    tracks become uncertain; it must run on the thread that calls
+    is_keyframe(), so the pipelined tracker does not use it). stride=1 detects
+    on every frame.
+    """
+
+    def __init__(self, stride=1, motion_threshold=None, thumbnail_size=(64, 36)):
+        self.stride = max(int(stride), 1)
+        self.motion_threshold = motion_threshold
+        self.thumbnail_size = thumbnail_size
+        self.reset()
+
+    def get_params(self):
+        return {
+            "stride": self.stride,
+            "motion_threshold": self.motion_threshold,
+            "thumbnail_size": list(self.thumbnail_size),
+        }
+
+    def reset(self):
+        self.frame_num = 0
+        self.last_keyframe = None
+        self.last_thumbnail = None
+        self.keyframe_requested = False
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def get_thumbnail(self, frame):
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame_gray, self.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def is_keyframe(self, frame):
+        frame_num = self.frame_num
+        self.frame_num += 1
+        if self.stride == 1:
+            return True
+
+        thumbnail = self.get_thumbnail(frame) if self.motion_threshold is not None else None
+        keyframe = (self.last_keyframe is None or self.keyframe_requested
+                    or frame_num - self.last_keyframe >= self.stride)
+        if not keyframe and thumbnail is not None:
+            keyframe = np.abs(thumbnail - self.last_thumbnail).mean() > self.motion_threshold
+        if keyframe:
+            self.last_keyframe = frame_num
+            self.last_thumbnail = thumbnail
+            self.keyframe_requested = False
+        return keyframe
+
+
+class BoxPropagator:
+    """
+    Detections for the frames between keyframes.
+
+    observe() takes the detections of every keyframe as sv.Detections, with the
+    ByteTrack tracker_id of each box (-1 for boxes without a confirmed track),
+    and propagate() returns them moved to the next frame, with the same class
+    ids and confidences:
+    - "motion": constant velocity per track, measured between the last two
+      keyframes the track was seen on (the same model ByteTrack predicts with);
+      boxes without a track stay in place;
+    - "flow": each box follows the median Lucas-Kanade flow of a grid of
+      points inside it from the previous frame.
+    With uncertainty_threshold, on_uncertain() is called when the share of
+    track ids that appeared or vanished between two keyframes exceeds it.
+    """
+
+    def __init__(self, method="motion", uncertainty_threshold=None, on_uncertain=None, grid_size=3):
+        if method not in PROPAGATION_METHODS:
+            raise ValueError(f"Unknown propagation method: {method}, expected one of {PROPAGATION_METHODS}")
+        self.method = method
+        self.uncertainty_threshold = uncertainty_threshold
+        self.on_uncertain = on_uncertain
+        self.grid_size = grid_size
+        self.lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+        self.reset()
+
+    def get_params(self):
+        return {
+            "method": self.method,
+            "uncertainty_threshold": self.uncertainty_threshold,
+            "grid_size": self.grid_size,
+        }
+
+    def reset(self):
+        self.frame_num = 0
+        # tracker_id -> (frame_num, bbox) of the last keyframe the track was seen on
+        self.observed = {}
+        self.detections = None
+        self.velocities = np.zeros((0, 4))
+        self.old_gray = None
+
+    def observe(self, detections, frame=None):
+        tracker_ids = detections.tracker_id
+        previous_ids = set() if self.detections is None else set(self.detections.tracker_id[self.detections.tracker_id >= 0].tolist())
+        current_ids = set(tracker_ids[tracker_ids >= 0].tolist())
+
+        self.velocities = np.zeros((len(detections), 4))
+        for index, (tracker_id, bbox) in enumerate(zip(tracker_ids.tolist(), detections.xyxy.astype(np.float64))):
+            if tracker_id < 0:
+                continue
+            if tracker_id in self.observed:
+                last_frame, last_bbox = self.observed[tracker_id]
+                self.velocities[index] = (bbox - last_bbox) / (self.frame_num - last_frame)
+            self.observed[tracker_id] = (self.frame_num, bbox)
+        self.detections = detections
+
+        if self.uncertainty_threshold is not None and self.on_uncertain is not None and previous_ids:
+            changed = len(previous_ids ^ current_ids) / len(previous_ids | current_ids)
+            if changed > self.uncertainty_threshold:
+                self.on_uncertain()
+
+        if self.method == "flow":
+            self.old_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.frame_num += 1
+
+    def get_flow_shifts(self, frame_gray, boxes):
+        # median displacement of a grid of points inside every box, 0 where tracking failed
+        steps = (np.arange(self.grid_size) + 0.5) / self.grid_size
+        grid_x, grid_y = np.meshgrid(steps, steps)
+        grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+        points = np.stack([boxes[:, None, 0] + grid_x * (boxes[:, None, 2] - boxes[:, None, 0]),
+                           boxes[:, None, 1] + grid_y * (boxes[:, None, 3] - boxes[:, None, 1])], axis=-1)
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.old_gray, frame_gray, points, None, **self.lk_params)
+
+        displacements = (new_points - points).reshape(len(boxes), -1, 2)
+        valid = status.reshape(len(boxes), -1).astype(bool)
+        shifts = np.zeros((len(boxes), 2))
+        for index in range(len(boxes)):
+            if valid[index].any():
+                shifts[index] = np.median(displacements[index][valid[index]], axis=0)
+        return shifts
+
+    def propagate(self, frame=None):
+        detections = self.detections
+        if self.method == "flow":
+            frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if len(detections) and self.old_gray is not None:
+                shifts = self.get_flow_shifts(frame_gray, detections.xyxy)
+                detections.xyxy = (detections.xyxy + np.tile(shifts, 2)).astype(np.float32)
+            self.old_gray = frame_gray
+        else:
+            detections.xyxy = (detections.xyxy + self.velocities).astype(np.float32)
+        self.frame_num += 1
+        return detections[:]
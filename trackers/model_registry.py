@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+
+import numpy as np
+from ultralytics import YOLO
+
+from .detector_backends import export_model, get_export_settings
+
+
+class ModelRegistry:
+    """
+    Detectors loaded once per process and shared by every Tracker that asks for
+    the same weights. Entries are keyed by the weights path, size and mtime, so
+    replacing the file on disk loads the new weights on the next request.
+    A warm-up inference on a blank frame runs right after loading, so the first
+    real batch does not pay for runtime initialisation.
+    The models are stateless across calls; tracking state (ByteTrack) lives on
+    each Tracker, so every job still starts from fresh tracks.
+    backend and export_settings select the runtime (see export_model); every
+    backend is loaded through ultralytics, so all of them return the same Results.
+    """
+
+    def __init__(self, warmup_size=640):
+        self.warmup_size = warmup_size
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get_key(self, model_path):
+        stat = os.stat(model_path)
+        return os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns
+
+    def get_model(self, model_path, backend="pytorch", **export_settings):
+        settings = get_export_settings(backend, **export_settings)
+        file_key = self.get_key(model_path)
+        key = file_key + (json.dumps(settings, sort_keys=True),)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self.load_model(model_path, **settings)
+                # drop older versions of the same weights
+                for old_key in [old_key for old_key in self._models
+                                if old_key[0] == file_key[0] and old_key[:3] != file_key]:
+                    del self._models[old_key]
+                self._models[key] = model
+        return model
+
+    def load_model(self, model_path, **settings):
+        model = YOLO(export_model(model_path, **settings), task='detect')
+        model.predict(np.zeros((self.warmup_size, self.warmup_size, 3), dtype=np.uint8), verbose=False)
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+_registry = ModelRegistry()
+
+
+def get_model(model_path, backend="pytorch", **export_settings):
+    # the per-process registry shared by all Trackers
+    return _registry.get_model(model_path, backend, **export_settings)
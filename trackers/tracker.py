@@ -1,23 +1,73 @@
-from ultralytics import YOLO
 import supervision as  sv
 import pickle
 import os
 import numpy as np
 import cv2
 import sys
-import pandas as pd
 sys.path.append('../')
-from utils import get_center_of_bbox, get_bbox_width, get_foot_position
+from utils import get_center_of_bbox, get_bbox_width, get_foot_position, get_positions_of_bboxes, save_stub, TrackTable
 from PassCounter import PassCounter  
+from .detection_pipeline import DetectionPipeline
+from .model_registry import get_model
+from .detector_backends import get_export_settings, select_backend
+from .keyframes import KeyframeSelector, BoxPropagator
+from .ball_crops import BallCropDetector
+from .ball_filter import BallKalmanFilter
+from instrumentation import metrics
 
 
 class Tracker:
-    def __init__(self, model_path):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path, batch_size=20, conf=0.1, detection_stride=1, keyframe_motion_threshold=None,
+                 keyframe_uncertainty_threshold=None, propagation="motion", imgsz=None, ball_crop_size=None,
+                 ball_crop_imgsz=None, detector_backend="pytorch", detector_settings=None, ball_motion_model="velocity",
+                 ball_lookahead=None, model=None):
+        self.model_path = model_path
+        # shared, already warmed-up model; the ByteTrack state below is per Tracker
+        # a given model (anything with YOLO's predict()) is used as is, model_path is then only for the stage cache
+        if model is None:
+            # an exported backend that does not match the PyTorch detections falls back to PyTorch
+            self.detector_settings = select_backend(model_path, detector_backend, **(detector_settings or {}))
+            model = get_model(model_path, **self.detector_settings)
+        else:
+            self.detector_settings = get_export_settings(detector_backend, **(detector_settings or {}))
+        self.model = model
+        self.batch_size = batch_size
+        self.conf = conf
+        # inference size of the full-frame pass, the model's own when None
+        self.imgsz = imgsz
+        # with ball_crop_size, the ball comes from a full-resolution crop around its expected position
+        self.ball_crop_detector = BallCropDetector(ball_crop_size, ball_crop_imgsz) if ball_crop_size else None
+        # fills in and smooths the ball track, update() / flush() give it window by window with ball_lookahead frames of delay
+        self.ball_filter = BallKalmanFilter(ball_motion_model, lookahead=ball_lookahead)
         self.tracker = sv.ByteTrack()
+        # YOLO runs on keyframes only, the boxes in between are propagated
+        self.keyframe_selector = KeyframeSelector(detection_stride, motion_threshold=keyframe_motion_threshold)
+        self.box_propagator = BoxPropagator(propagation, uncertainty_threshold=keyframe_uncertainty_threshold,
+                                            on_uncertain=self.keyframe_selector.request_keyframe)
         self.team_passes = {1: 0, 2: 0}
         
+    def get_cache_params(self, stage_cache, pipelined=False):
+        # everything besides the video that changes the detections / tracks
+        if self.model_path is None:
+            raise ValueError("The stage cache needs the model weights, the Tracker was given a model without model_path")
+        return {
+            "model": stage_cache.hash_file(self.model_path),
+            "detector": self.detector_settings,
+            "conf": self.conf,
+            "batch_size": self.batch_size,
+            "keyframes": self.keyframe_selector.get_params(),
+            # the pipelined path makes no uncertainty keyframe requests
+            "propagation": dict(self.box_propagator.get_params(), uncertainty_threshold=None) if pipelined
+                           else self.box_propagator.get_params(),
+            "imgsz": self.imgsz,
+            "ball_crops": self.ball_crop_detector.get_params() if self.ball_crop_detector is not None else None,
+        }
+
     def add_position_to_tracks(self, tracks):
+        if isinstance(tracks, TrackTable):
+            is_ball = tracks.object_id == tracks.get_object_id('ball') if 'ball' in tracks else np.zeros(len(tracks), bool)
+            tracks.position = get_positions_of_bboxes(tracks.bbox, is_ball).astype(np.float32)
+            return
         for object, object_tracks in tracks.items():
             for frame_num, track in enumerate(object_tracks):
                 for track_id, track_info in track.items():
@@ -29,49 +79,75 @@ class Tracker:
                     tracks[object][frame_num][track_id]['position'] = position        
         
     def interpolate_ball_positions(self, ball_positions):
-        ball_positions = [x.get(1,{}).get('bbox', []) for x in ball_positions]
-        df_ball_positions = pd.DataFrame(ball_positions, columns=['x1', 'y1', 'x2', 'y2'])
-        # Interpolate missing values
-        df_ball_positions = df_ball_positions.interpolate()
-        df_ball_positions = df_ball_positions.bfill()
-        
-        ball_positions = [{1: {"bbox": x}} for x in df_ball_positions.to_numpy().tolist()]
-        
-        return ball_positions
+        # Kalman smoothing over the whole track, false positive balls are dropped
+        return self.ball_filter.smooth(ball_positions)
         
     def detect_frames(self, frames):
-        batch_size = 20
-        detections = []
-        for i in range(0, len(frames),batch_size):
-            detections_batch =  self.model.predict(frames[i:i+batch_size],conf =0.1)
-            detections += detections_batch
+        """
+        Detections for every frame, None for the frames that are not keyframes.
+        The keyframe selector keeps its position between calls, like ByteTrack.
+        """
+        batch_size = self.batch_size
+        is_keyframe = [self.keyframe_selector.is_keyframe(frame) for frame in frames]
+        keyframes = [frame for frame, keyframe in zip(frames, is_keyframe) if keyframe]
+        metrics.inc("detection_frames_total", len(keyframes), kind="keyframe")
+        metrics.inc("detection_frames_total", len(frames) - len(keyframes), kind="propagated")
+
+        predict_args = {"imgsz": self.imgsz} if self.imgsz is not None else {}
+        keyframe_detections = []
+        for i in range(0, len(keyframes),batch_size):
+            with metrics.timer("inference_batch_seconds", stage="full_frame"):
+                detections_batch =  self.model.predict(keyframes[i:i+batch_size],conf =self.conf, **predict_args)
+            if self.ball_crop_detector is not None:
+                detections_batch = self.ball_crop_detector.detect(self.model, keyframes[i:i+batch_size],
+                                                                  detections_batch, self.conf)
+            keyframe_detections += detections_batch
+        keyframe_detections = iter(keyframe_detections)
+        return [next(keyframe_detections) if keyframe else None for keyframe in is_keyframe]
+
+    def get_detections_to_propagate(self, detections, detections_with_tracks, cls_names):
+        # the players and referees of a keyframe; boxes ByteTrack has not confirmed yet are
+        # propagated as well (tracker_id -1), so their tracks can be confirmed between keyframes
+        class_ids = [k for k,v in cls_names.items() if v in ("player", "referee")]
+        tracked = detections_with_tracks[np.isin(detections_with_tracks.class_id, class_ids)]
+        tracked_boxes = {tuple(bbox) for bbox in tracked.xyxy.tolist()}
+        untracked = detections[np.isin(detections.class_id, class_ids)
+                               & np.array([tuple(bbox) not in tracked_boxes for bbox in detections.xyxy.tolist()], dtype=bool)]
+        untracked.tracker_id = np.full(len(untracked), -1, dtype=int)
+        detections = sv.Detections.merge([tracked, untracked])
+        if detections.tracker_id is None:
+            detections.tracker_id = np.zeros(0, dtype=int)
         return detections
-    def get_object_tracks(self, frames, read_from_stub = False, stub_path =None):
-        
-        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
-            with open(stub_path, 'rb') as f:
-                tracks = pickle.load(f)
-            return tracks 
-        
-        detections = self.detect_frames(frames)
-        
-        tracks = {
-            "player": [],
-            "referees": [],
-            "ball": []
-        }
-        
-        for frame_num, detection in enumerate(detections):
-            cls_names = detection.names
-            cls_names_inv = {v:k for k,v in cls_names.items() }
-            
-            # convert to supervision detecion format
-            detection_supervision = sv.Detections.from_ultralytics(detection)
-            
-            # Conver goalkeeper to player object
-            for object_ind, class_id in enumerate(detection_supervision.class_id):
-                if cls_names[class_id] =="goalkeeper":
-                    detection_supervision.class_id[object_ind] = cls_names_inv["player"]
+
+    def add_detections_to_tracks(self, tracks, detections, frames=None):
+        """
+        Run ByteTrack on a batch of detections and append one entry per frame to tracks.
+        ByteTrack keeps its state between calls, so a video can be fed window by window.
+        Frames without detections (None, see detect_frames) are tracked on the
+        players and referees propagated from the last keyframe, so ByteTrack still
+        steps frame by frame; they get no ball, interpolate_ball_positions fills
+        it in. The "flow" propagation needs the frames.
+        """
+        if frames is None:
+            frames = [None] * len(detections)
+        for detection, frame in zip(detections, frames):
+            frame_num = len(tracks["player"])
+            if detection is None:
+                cls_names = self.class_names
+                cls_names_inv = {v:k for k,v in cls_names.items() }
+                detection_supervision = self.box_propagator.propagate(frame)
+            else:
+                cls_names = self.class_names = detection.names
+                cls_names_inv = {v:k for k,v in cls_names.items() }
+
+                # convert to supervision detecion format
+                detection_supervision = sv.Detections.from_ultralytics(detection)
+                metrics.observe("detections_per_frame", len(detection_supervision))
+
+                # Conver goalkeeper to player object
+                for object_ind, class_id in enumerate(detection_supervision.class_id):
+                    if cls_names[class_id] =="goalkeeper":
+                        detection_supervision.class_id[object_ind] = cls_names_inv["player"]
             
             # Track objects
             detection_with_tracks = self.tracker.update_with_detections(detection_supervision)
@@ -98,15 +174,62 @@ class Tracker:
                
                 if cls_id == cls_names_inv['ball']:
                     tracks["ball"][frame_num][1] = {"bbox": bbox}
+            if detection is not None and self.keyframe_selector.stride > 1:
+                self.box_propagator.observe(
+                    self.get_detections_to_propagate(detection_supervision, detection_with_tracks, cls_names), frame)
+        return tracks
+
+    def get_object_tracks(self, frames, read_from_stub = False, stub_path =None):
+        
+        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
+            with open(stub_path, 'rb') as f:
+                tracks = pickle.load(f)
+            return tracks 
+        
+        tracks = {
+            "player": [],
+            "referees": [],
+            "ball": []
+        }
+        # batch by batch, so a keyframe requested while tracking a batch applies to the first frame of the next one
+        for i in range(0, len(frames), self.batch_size):
+            batch = frames[i:i+self.batch_size]
+            self.add_detections_to_tracks(tracks, self.detect_frames(batch), batch)
        
         if stub_path is not None:
-            with open(stub_path, 'wb') as f:
-                pickle.dump(tracks,f)
+            save_stub(stub_path, tracks)
                
                    
                    
         return tracks
                     
+    def get_object_tracks_pipelined(self, frames, read_from_stub = False, stub_path = None, queue_size = 4, on_batch = None):
+        """
+        Like get_object_tracks, but frames can be any iterable (e.g. iter_video_frames)
+        and decoding, inference and tracking run concurrently in a DetectionPipeline.
+        Keyframes come from the stride and the motion threshold only: the tracks
+        become uncertain on the tracking thread, batches after the inference
+        thread decided the keyframes, so a request would land at a frame that
+        depends on timing. Use get_cache_params(stage_cache, pipelined=True).
+        """
+        if read_from_stub and stub_path is not None and os.path.exists(stub_path):
+            with open(stub_path, 'rb') as f:
+                tracks = pickle.load(f)
+            return tracks
+
+        pipeline = DetectionPipeline(self, batch_size=self.batch_size, queue_size=queue_size)
+        on_uncertain, self.box_propagator.on_uncertain = self.box_propagator.on_uncertain, None
+        try:
+            tracks = pipeline.run(frames, on_batch=on_batch)
+        finally:
+            self.box_propagator.on_uncertain = on_uncertain
+        pipeline.print_stats()
+
+        if stub_path is not None:
+            save_stub(stub_path, tracks)
+
+        return tracks
+
     def draw_ellipse(self, frame, bbox, color,track_id= None):
         y2 = int(bbox[3])
         x_center, _ = get_center_of_bbox(bbox)
@@ -187,9 +310,9 @@ class Tracker:
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 3)
         return frame
 
-    def draw_annotations(self, video_frames, tracks, team_ball_control):
+    def draw_annotations(self, video_frames, tracks, team_ball_control, start_frame=0):
         output_video_frames = []
-        for frame_num, frame in enumerate(video_frames):
+        for frame_num, frame in enumerate(video_frames, start_frame):
             frame = frame.copy()
             
             player_dict = tracks["player"][frame_num] 
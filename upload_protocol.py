@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+import zlib
+
+from encryption import XorCipher
+
+# Framed, resumable upload:
+#   client -> MAGIC + message {"upload_id", "file_name", "file_size", "chunk_size"}
+#   server -> message {"offset", "chunk_size"}: bytes already committed, where the client resumes
+#   client -> CHUNK_HEADER(index, length, crc32) + encrypted payload, for every chunk from offset on
+#   server -> message {"status": "complete"} or {"error", "offset"} (then closes the connection)
+# A message is a 4-byte big-endian length followed by JSON.
+MAGIC = b'SUP1'
+MESSAGE_LENGTH = struct.Struct('!I')
+CHUNK_HEADER = struct.Struct('!QII')
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def recv_exact_into(sock, view):
+    # fill view completely, False if the connection closed first
+    filled = 0
+    while filled < len(view):
+        n = sock.recv_into(view[filled:])
+        if n == 0:
+            return False
+        filled += n
+    return True
+
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    if not recv_exact_into(sock, memoryview(buffer)):
+        raise ConnectionError("Connection closed during upload")
+    return bytes(buffer)
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(MESSAGE_LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    (length,) = MESSAGE_LENGTH.unpack(recv_exact(sock, MESSAGE_LENGTH.size))
+    if length > MAX_MESSAGE_SIZE:
+        raise UploadError(f"Message too large: {length} bytes")
+    return json.loads(recv_exact(sock, length))
+
+
+def get_upload_id(file_path):
+    # stable across retries of the same file, changes when the file is modified
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class UploadStore:
+    """
+    Partial uploads on the server: <upload_id>.part holds the decrypted bytes
+    received so far and <upload_id>.json the file name, size and chunk size.
+    Only whole, checksummed chunks are written, so the committed offset is the
+    part file size rounded down to the chunk size.
+    """
+
+    def __init__(self, upload_dir='uploads'):
+        self.upload_dir = upload_dir
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+    def get_paths(self, upload_id):
+        if not re.fullmatch(r'[0-9a-f]{16,64}', upload_id):
+            raise UploadError(f"Invalid upload id: {upload_id!r}")
+        base = os.path.join(self.upload_dir, upload_id)
+        return base + '.part', base + '.json'
+
+    def open(self, upload_id, file_name, file_size, chunk_size):
+        """
+        Start or resume an upload and return the committed offset.
+        An existing partial upload with a different size or chunk size starts over.
+        """
+        part_path, meta_path = self.get_paths(upload_id)
+        meta = {"file_name": file_name, "file_size": file_size, "chunk_size": chunk_size}
+        if os.path.exists(meta_path) and os.path.exists(part_path):
+            with open(meta_path) as f:
+                if json.load(f) == meta:
+                    part_size = os.path.getsize(part_path)
+                    committed = file_size if part_size >= file_size else part_size // chunk_size * chunk_size
+                    with open(part_path, 'r+b') as part:
+                        part.truncate(committed)
+                    return committed
+
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        open(part_path, 'wb').close()
+        return 0
+
+    def remove(self, upload_id):
+        for path in self.get_paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def send_file(sock, file_path, key, chunk_size=DEFAULT_CHUNK_SIZE, on_progress=None):
+    """
+    Client side: handshake, then encrypt and send the file chunk by chunk from
+    the offset the server has already committed. Only one chunk is in memory.
+    Returns the server's final message.
+    """
+    file_size = os.path.getsize(file_path)
+    sock.sendall(MAGIC)
+    send_message(sock, {
+        "upload_id": get_upload_id(file_path),
+        "file_name": os.path.basename(file_path),
+        "file_size": file_size,
+        "chunk_size": chunk_size,
+    })
+    reply = recv_message(sock)
+    if "error" in reply:
+        raise UploadError(reply["error"])
+    offset, chunk_size = reply["offset"], reply["chunk_size"]
+    if on_progress is not None:
+        on_progress(offset)
+
+    cipher = XorCipher(key, offset=offset)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        index = offset // chunk_size
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            cipher.process_into(view[:n])
+            sock.sendall(CHUNK_HEADER.pack(index, n, zlib.crc32(view[:n])))
+            sock.sendall(view[:n])
+            index += 1
+            if on_progress is not None:
+                on_progress(n)
+
+    reply = recv_message(sock)
+    if "error" in reply:
+        raise UploadError(f"{reply['error']} (server committed {reply.get('offset', 0)} bytes)")
+    return reply
+
+
+def _parse_hello(hello):
+    upload_id = str(hello["upload_id"])
+    file_name = os.path.basename(str(hello["file_name"]))
+    file_size = int(hello["file_size"])
+    chunk_size = min(max(int(hello["chunk_size"]), 1), MAX_CHUNK_SIZE)
+    return upload_id, file_name, file_size, chunk_size
+
+
+def _check_chunk(index, length, committed, chunk_size, file_size):
+    # chunks must arrive in order and be full-sized except for the last one
+    if index != committed // chunk_size or length != min(chunk_size, file_size - committed):
+        return f"Unexpected chunk {index} of {length} bytes at offset {committed}"
+    return None
+
+
+async def recv_exact_async(reader, size, timeout):
+    try:
+        return await asyncio.wait_for(reader.readexactly(size), timeout)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed during upload")
+
+
+async def send_message_async(writer, message):
+    data = json.dumps(message).encode()
+    writer.write(MESSAGE_LENGTH.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def recv_message_async(reader, timeout):
+    (length,) = MESSAGE_LENGTH.unpack(await recv_exact_async(reader, MESSAGE_LENGTH.size, timeout))
+    if length > MAX_MESSAGE_SIZE:
+        raise UploadError(f"Message too large: {length} bytes")
+    return json.loads(await recv_exact_async(reader, length, timeout))
+
+
+async def receive_file_async(reader, writer, store, key, timeout=60, stats=None):
+    """
+    Server side of send_file: handshake, then receive, verify, decrypt and append
+    chunks to the upload's part file until it is complete. A bad chunk or a
+    dropped connection raises, and the committed chunks stay in the store for a
+    resumed upload. Every read waits at most timeout seconds, so a stalled
+    client raises asyncio.TimeoutError instead of holding the connection forever.
+    stats, if given, collects the seconds spent per stage. Returns the upload
+    description (upload_id, file_name, file_size, path and received_bytes, the
+    bytes received on this connection).
+    The socket is only read when the previous chunk has been written, so a fast
+    client is held back by TCP flow control. Opening files and writing chunks
+    run in the default thread pool to keep the event loop free.
+    """
+    stats = stats if stats is not None else {}
+    for stage in ("network", "decrypt", "write"):
+        stats.setdefault(stage, 0.0)
+    loop = asyncio.get_running_loop()
+
+    if await recv_exact_async(reader, len(MAGIC), timeout) != MAGIC:
+        raise UploadError("Unknown upload protocol")
+    upload_id, file_name, file_size, chunk_size = _parse_hello(await recv_message_async(reader, timeout))
+    if file_size <= 0:
+        await send_message_async(writer, {"error": "Invalid file size"})
+        raise UploadError(f"Invalid file size: {file_size}")
+    part_path, _ = store.get_paths(upload_id)
+
+    committed = await loop.run_in_executor(None, store.open, upload_id, file_name, file_size, chunk_size)
+    await send_message_async(writer, {"offset": committed, "chunk_size": chunk_size})
+
+    cipher = XorCipher(key, offset=committed)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    received_bytes = 0
+    f = await loop.run_in_executor(None, open, part_path, 'r+b')
+    try:
+        f.seek(committed)
+        while committed < file_size:
+            start = time.perf_counter()
+            index, length, crc = CHUNK_HEADER.unpack(await recv_exact_async(reader, CHUNK_HEADER.size, timeout))
+            error = _check_chunk(index, length, committed, chunk_size, file_size)
+            if error is not None:
+                await send_message_async(writer, {"error": error, "offset": committed})
+                raise UploadError(error)
+            view[:length] = await recv_exact_async(reader, length, timeout)
+            stats["network"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            if zlib.crc32(view[:length]) != crc:
+                await send_message_async(writer, {"error": f"Checksum mismatch in chunk {index}", "offset": committed})
+                raise UploadError(f"Checksum mismatch in chunk {index}")
+            cipher.process_into(view[:length])
+            stats["decrypt"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            await loop.run_in_executor(None, _write_chunk, f, view[:length])
+            stats["write"] += time.perf_counter() - start
+            committed += length
+            received_bytes += length
+    finally:
+        f.close()
+
+    await send_message_async(writer, {"status": "complete", "offset": committed})
+    return {"upload_id": upload_id, "file_name": file_name, "file_size": file_size, "path": part_path,
+            "received_bytes": received_bytes}
+
+
+def _write_chunk(f, data):
+    f.write(data)
+    f.flush()
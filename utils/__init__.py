@@ -1,2 +1,6 @@
-from .video_utils import read_video, save_video
-from .bbox_utils import get_center_of_bbox, get_bbox_width, measure_distance, measure_xy_distance, get_foot_position
\ No newline at end of file
+from .video_utils import read_video, iter_video_frames, read_video_chunks, get_video_info, save_video, open_video_encoder
+from .video_encoder import VideoEncoder, SegmentedVideoEncoder
+from .frame_store import FrameStore
+from .bbox_utils import get_center_of_bbox, get_bbox_width, measure_distance, measure_xy_distance, get_foot_position, get_centers_of_bboxes, get_foot_positions, get_positions_of_bboxes
+from .stub_utils import save_stub
+from .track_table import TrackTable
\ No newline at end of file
@@ -1,3 +1,5 @@
+import numpy as np
+
 def get_center_of_bbox(bbox):
     x1, y1, x2, y2 = bbox
     return int((x1 + x2)/2), int((y1 + y2)/2)
@@ -17,3 +19,14 @@ def get_foot_position(bbox):
     foot_y = y2  # Bottom edge in y
     return foot_x, foot_y
 
+def get_centers_of_bboxes(bboxes):
+    # vectorized get_center_of_bbox for an (n, 4) array
+    return np.trunc((bboxes[:, 0:2] + bboxes[:, 2:4]) / 2)
+
+def get_foot_positions(bboxes):
+    # vectorized get_foot_position for an (n, 4) array
+    return np.stack([np.trunc((bboxes[:, 0] + bboxes[:, 2]) / 2), bboxes[:, 3]], axis=1)
+
+def get_positions_of_bboxes(bboxes, is_ball):
+    # ball -> centre of the bbox, everything else -> foot position, as in Tracker.add_position_to_tracks
+    return np.where(np.asarray(is_ball)[:, None], get_centers_of_bboxes(bboxes), get_foot_positions(bboxes))
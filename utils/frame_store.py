@@ -0,0 +1,112 @@
+import operator
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from .video_utils import iter_video_frames
+
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class FrameStore:
+    """
+    The decoded frames of a video in a memory-mapped uint8 file, indexed like
+    the list read_video returns: len(), store[i], store[a:b] and iteration.
+
+    The video is decoded once; after that the frames live in the OS page cache
+    instead of resident memory, so random-access stages work on long videos.
+    store[i] keeps the last cache_size frames it returned in an LRU of
+    in-memory copies. Slices and iteration return views of the mapping and
+    bypass the LRU, so sequential passes do not evict the hot frames.
+    Every frame returned is read-only; iter_copies() yields writable copies
+    for drawing in place.
+    """
+
+    def __init__(self, path, num_frames, frame_shape, cache_size=16, delete=False):
+        self.path = path
+        self.cache_size = cache_size
+        self.frame_shape = tuple(frame_shape)
+        # plain ndarray view, the mapping stays open as long as a frame view references it
+        self._frames = np.memmap(path, dtype=np.uint8, mode='r', shape=(num_frames, *self.frame_shape)).view(np.ndarray)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _remove_file, path) if delete else None
+
+    @classmethod
+    def from_video(cls, video_path, store_dir=None, cache_size=16):
+        """
+        Decode video_path into a temporary store file in store_dir (the system
+        temp directory by default), removed on close().
+        """
+        fd, path = tempfile.mkstemp(suffix='.frames', dir=store_dir)
+        num_frames = 0
+        frame_shape = None
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for frame in iter_video_frames(video_path):
+                    f.write(np.ascontiguousarray(frame).data)
+                    frame_shape = frame.shape
+                    num_frames += 1
+            if num_frames == 0:
+                raise ValueError(f"Unable to process video file: {video_path}")
+        except BaseException:
+            _remove_file(path)
+            raise
+        return cls(path, num_frames, frame_shape, cache_size=cache_size, delete=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._frames[i] for i in range(*index.indices(len(self)))]
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+
+        with self._lock:
+            frame = self._cache.get(index)
+            if frame is not None:
+                self._cache.move_to_end(index)
+                return frame
+        frame = np.array(self._frames[index])
+        frame.flags.writeable = False
+        with self._lock:
+            self._cache[index] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._frames[index]
+
+    def iter_copies(self, start=0, stop=None):
+        for index in range(start, len(self) if stop is None else stop):
+            yield np.array(self._frames[index])
+
+    def close(self):
+        """
+        Drop the mapping and remove the file if the store created it. Frames
+        still referenced elsewhere stay valid until they are released.
+        """
+        with self._lock:
+            self._cache.clear()
+        self._frames = np.zeros((0, *self.frame_shape), dtype=np.uint8)
+        if self._finalizer is not None:
+            self._finalizer()
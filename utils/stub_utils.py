@@ -0,0 +1,10 @@
+import os
+import pickle
+import threading
+
+def save_stub(stub_path, data):
+    # write to a temporary file first so a crash or a concurrent job never leaves a half-written stub
+    tmp_path = f"{stub_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, stub_path)
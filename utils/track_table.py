@@ -0,0 +1,231 @@
+import numpy as np
+
+OBJECT_NAMES = ("player", "referees", "ball")
+
+# per-row columns besides frame / object_id / track_id: name -> (width, dtype, empty value)
+COLUMNS = {
+    "bbox": (4, np.float32, np.nan),
+    "position": (2, np.float32, np.nan),
+    "position_adjusted": (2, np.float32, np.nan),
+    "position_transformed": (2, np.float32, np.nan),
+    "speed": (1, np.float32, np.nan),
+    "distance": (1, np.float32, np.nan),
+    "team": (1, np.int8, -1),
+    "team_color": (3, np.float32, np.nan),
+    "has_ball": (1, np.bool_, False),
+}
+
+
+class TrackTable:
+    """
+    Columnar replacement for the nested tracks dict
+    ({"player": [{track_id: {"bbox": ..., "position": ..., ...}}, ...], ...}).
+
+    There is one row per (frame, object, track_id), sorted in that order, and
+    every field is a NumPy column (NaN / -1 / False when it is not set).
+    frame_offsets[f]:frame_offsets[f+1] are the rows of frame f, so stages can
+    work on whole columns at once. table["player"][frame_num] still returns a
+    {track_id: {...}} dict for the existing drawing / analysis code; values
+    written into those dicts are stored back into the columns.
+    """
+
+    def __init__(self, num_frames, frame, object_id, track_id, object_names=OBJECT_NAMES, **columns):
+        self.object_names = list(object_names)
+        self.num_frames = num_frames
+
+        frame = np.asarray(frame, dtype=np.int32)
+        object_id = np.asarray(object_id, dtype=np.int8)
+        track_id = np.asarray(track_id, dtype=np.int32)
+        order = np.lexsort((track_id, object_id, frame))
+        self.frame = frame[order]
+        self.object_id = object_id[order]
+        self.track_id = track_id[order]
+
+        num_rows = len(order)
+        for name, (width, dtype, empty) in COLUMNS.items():
+            shape = (num_rows,) if width == 1 else (num_rows, width)
+            values = columns.get(name)
+            if values is None:
+                setattr(self, name, np.full(shape, empty, dtype=dtype))
+            else:
+                setattr(self, name, np.asarray(values, dtype=dtype).reshape(shape)[order])
+        self._update_frame_offsets()
+
+    def _update_frame_offsets(self):
+        self.frame_offsets = np.searchsorted(self.frame, np.arange(self.num_frames + 1))
+
+    def __len__(self):
+        return len(self.frame)
+
+    @classmethod
+    def from_tracks(cls, tracks):
+        object_names = list(tracks.keys())
+        num_frames = max((len(object_tracks) for object_tracks in tracks.values()), default=0)
+        rows = _rows_from_tracks(tracks, object_names)
+        return cls(num_frames, object_names=object_names, **rows)
+
+    def get_frames(self, start, stop):
+        # a new table with the rows of frames start..stop-1, numbered from 0
+        rows = slice(self.frame_offsets[start], self.frame_offsets[stop])
+        columns = {name: getattr(self, name)[rows] for name in COLUMNS}
+        return TrackTable(stop - start, self.frame[rows] - start, self.object_id[rows], self.track_id[rows],
+                          object_names=self.object_names, **columns)
+
+    def to_tracks(self):
+        return {object_name: list(self[object_name]) for object_name in self.object_names}
+
+    def get_object_id(self, object_name):
+        return self.object_names.index(object_name)
+
+    def get_rows(self, frame_num, object_name=None):
+        rows = np.arange(self.frame_offsets[frame_num], self.frame_offsets[frame_num + 1])
+        if object_name is not None:
+            rows = rows[self.object_id[rows] == self.get_object_id(object_name)]
+        return rows
+
+    def get_object_rows(self, object_name):
+        return np.flatnonzero(self.object_id == self.get_object_id(object_name))
+
+    # dict-like access, so tracks["player"][frame_num] and tracks.items() keep working
+
+    def keys(self):
+        return list(self.object_names)
+
+    def __iter__(self):
+        return iter(self.object_names)
+
+    def __contains__(self, object_name):
+        return object_name in self.object_names
+
+    def __getitem__(self, object_name):
+        if object_name not in self.object_names:
+            raise KeyError(object_name)
+        return TrackFrames(self, object_name)
+
+    def items(self):
+        return [(object_name, self[object_name]) for object_name in self.object_names]
+
+    def values(self):
+        return [self[object_name] for object_name in self.object_names]
+
+    def __setitem__(self, object_name, object_tracks):
+        """
+        Replace every row of one object with a list of per-frame dicts,
+        e.g. tracks["ball"] = tracker.interpolate_ball_positions(tracks["ball"]).
+        """
+        if object_name not in self.object_names:
+            self.object_names.append(object_name)
+        object_id = self.get_object_id(object_name)
+        keep = self.object_id != object_id
+        new_rows = _rows_from_tracks({object_name: object_tracks}, self.object_names)
+        self.num_frames = max(self.num_frames, len(object_tracks))
+
+        frame = np.concatenate([self.frame[keep], np.asarray(new_rows.pop("frame"), dtype=np.int32)])
+        new_object_id = np.concatenate([self.object_id[keep], np.asarray(new_rows.pop("object_id"), dtype=np.int8)])
+        track_id = np.concatenate([self.track_id[keep], np.asarray(new_rows.pop("track_id"), dtype=np.int32)])
+        order = np.lexsort((track_id, new_object_id, frame))
+        self.frame = frame[order]
+        self.object_id = new_object_id[order]
+        self.track_id = track_id[order]
+        for name, (width, dtype, empty) in COLUMNS.items():
+            old = getattr(self, name)[keep]
+            new = np.asarray(new_rows[name], dtype=dtype).reshape((-1,) + old.shape[1:])
+            setattr(self, name, np.concatenate([old, new])[order])
+        self._update_frame_offsets()
+
+    def get_row_dict(self, row):
+        object_name = self.object_names[self.object_id[row]]
+        track_id = int(self.track_id[row])
+        data = {"bbox": self.bbox[row].tolist()}
+        if object_name == "player":
+            data["player_id"] = track_id
+            team = int(self.team[row])
+            data["team"] = team if team >= 0 else None
+            if not np.isnan(self.team_color[row, 0]):
+                data["team_color"] = self.team_color[row].astype(np.float64)
+        for name in ("position", "position_adjusted", "position_transformed"):
+            value = getattr(self, name)[row]
+            if not np.isnan(value[0]):
+                data[name] = value.tolist()
+        for name in ("speed", "distance"):
+            value = getattr(self, name)[row]
+            if not np.isnan(value):
+                data[name] = float(value)
+        if self.has_ball[row]:
+            data["has_ball"] = True
+        return TrackRow(self, row, data)
+
+    def set_value(self, row, key, value):
+        if key not in COLUMNS:
+            return
+        column = getattr(self, key)
+        if key == "team":
+            value = _team_value(value)
+        elif value is None:
+            value = COLUMNS[key][2]
+        column[row] = value
+
+
+class TrackFrames:
+    # list-like view of one object: TrackFrames[frame_num] -> {track_id: TrackRow}
+    def __init__(self, table, object_name):
+        self.table = table
+        self.object_name = object_name
+
+    def __len__(self):
+        return self.table.num_frames
+
+    def __getitem__(self, frame_num):
+        if isinstance(frame_num, slice):
+            return [self[i] for i in range(*frame_num.indices(len(self)))]
+        if frame_num < 0:
+            frame_num += len(self)
+        if not 0 <= frame_num < len(self):
+            raise IndexError(frame_num)
+        rows = self.table.get_rows(frame_num, self.object_name)
+        return {int(self.table.track_id[row]): self.table.get_row_dict(row) for row in rows}
+
+    def __iter__(self):
+        for frame_num in range(len(self)):
+            yield self[frame_num]
+
+
+class TrackRow(dict):
+    # a plain dict whose known keys are written through to the table columns
+    def __init__(self, table, row, data):
+        super().__init__(data)
+        self._table = table
+        self._row = row
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._table.set_value(self._row, key, value)
+
+
+def _team_value(team):
+    return team if isinstance(team, (int, np.integer)) else -1
+
+
+def _rows_from_tracks(tracks, object_names):
+    rows = {"frame": [], "object_id": [], "track_id": []}
+    values = {name: [] for name in COLUMNS}
+    for object_name, object_tracks in tracks.items():
+        object_id = object_names.index(object_name)
+        for frame_num, track in enumerate(object_tracks):
+            for track_id, track_info in track.items():
+                rows["frame"].append(frame_num)
+                rows["object_id"].append(object_id)
+                rows["track_id"].append(track_id)
+                values["bbox"].append(track_info["bbox"] if len(track_info.get("bbox", [])) == 4 else [np.nan] * 4)
+                for name in ("position", "position_adjusted", "position_transformed"):
+                    value = track_info.get(name)
+                    values[name].append(value if value is not None else (np.nan, np.nan))
+                for name in ("speed", "distance"):
+                    value = track_info.get(name)
+                    values[name].append(value if value is not None else np.nan)
+                values["team"].append(_team_value(track_info.get("team")))
+                team_color = track_info.get("team_color")
+                values["team_color"].append(team_color if team_color is not None else (np.nan, np.nan, np.nan))
+                values["has_ball"].append(bool(track_info.get("has_ball", False)))
+    rows.update(values)
+    return rows
@@ -0,0 +1,278 @@
+import math
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import cv2
+
+from instrumentation import metrics
+
+_END = object()
+
+
+class VideoEncoder:
+    """
+    Writes frames to a video file on a background thread.
+
+    write() only puts the frame on a bounded queue (it blocks when the writer
+    falls queue_size frames behind), so rendering and encoding overlap.
+    backend="opencv" uses cv2.VideoWriter with the fourcc codec; backend="ffmpeg"
+    pipes raw BGR frames into a local ffmpeg process and encodes with
+    ffmpeg_codec / crf / preset (H.264 by default, playable in browsers).
+    If ffmpeg is not installed the OpenCV backend is used instead.
+    ffmpeg_output_args replace the default MP4 output options (e.g. to pick
+    another muxer). The frame size is taken from the first frame unless frame_size is given.
+    """
+
+    def __init__(self, output_path, fps=24, frame_size=None, backend="opencv", codec='XVID',
+                 ffmpeg_codec='libx264', crf=23, preset='veryfast', queue_size=32, ffmpeg_output_args=None):
+        if backend == "ffmpeg" and shutil.which('ffmpeg') is None:
+            print("ffmpeg not found, encoding with OpenCV instead")
+            backend = "opencv"
+        if backend not in ("opencv", "ffmpeg"):
+            raise ValueError(f"Unknown encoder backend: {backend}")
+
+        self.output_path = output_path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.backend = backend
+        self.codec = codec
+        self.ffmpeg_codec = ffmpeg_codec
+        self.crf = crf
+        self.preset = preset
+        self.ffmpeg_output_args = ffmpeg_output_args
+        self.frames_written = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception:
+            # an exception already in flight is the real failure, do not replace it
+            if exc_type is None:
+                raise
+
+    def _open_opencv(self):
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, self.frame_size)
+        if not writer.isOpened():
+            raise IOError(f"Unable to open video writer for {self.output_path}")
+        return writer
+
+    def _open_ffmpeg(self):
+        width, height = self.frame_size
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-',
+            '-c:v', self.ffmpeg_codec, '-preset', self.preset, '-crf', str(self.crf),
+            '-pix_fmt', 'yuv420p',
+            *(self.ffmpeg_output_args if self.ffmpeg_output_args is not None else ['-movflags', '+faststart']),
+            self.output_path,
+        ]
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def _write_frames(self):
+        writer = None
+        try:
+            writer = self._open_ffmpeg() if self.backend == "ffmpeg" else self._open_opencv()
+            busy_seconds = 0.0
+            while True:
+                frame = self._queue.get()
+                if frame is _END:
+                    break
+                start = time.perf_counter()
+                if self.backend == "ffmpeg":
+                    writer.stdin.write(frame.tobytes())
+                else:
+                    writer.write(frame)
+                elapsed = time.perf_counter() - start
+                busy_seconds += elapsed
+                self.frames_written += 1
+                metrics.inc("encode_frames_total", backend=self.backend)
+                metrics.inc("encode_seconds_total", elapsed, backend=self.backend)
+            if busy_seconds > 0:
+                metrics.set_gauge("encode_fps", self.frames_written / busy_seconds, backend=self.backend)
+        except Exception as e:
+            # a broken pipe only means ffmpeg died, its exit code is the real failure
+            if isinstance(e, BrokenPipeError) and self.backend == "ffmpeg" and writer is not None:
+                e = IOError(f"ffmpeg exited with code {writer.wait()}")
+            self._error = e
+            # keep draining so write() never blocks on a dead writer
+            while self._queue.get() is not _END:
+                pass
+        finally:
+            if writer is not None:
+                if self.backend == "ffmpeg":
+                    try:
+                        writer.stdin.close()
+                    except (BrokenPipeError, OSError):
+                        # ffmpeg already exited, its exit code is reported below
+                        pass
+                    if writer.wait() != 0 and self._error is None:
+                        self._error = IOError(f"ffmpeg exited with code {writer.returncode}")
+                else:
+                    writer.release()
+
+    def write(self, frame):
+        if self._closed:
+            raise ValueError("write() called on a closed VideoEncoder")
+        if self._error is not None:
+            raise self._error
+        if self._thread is None:
+            if self.frame_size is None:
+                self.frame_size = (frame.shape[1], frame.shape[0])
+            self._thread = threading.Thread(target=self._write_frames, daemon=True)
+            self._thread.start()
+        self._queue.put(frame)
+        metrics.set_gauge("queue_depth", self._queue.qsize(), queue="encoder")
+
+    def close(self):
+        """
+        Wait for the queued frames to be encoded and close the file.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_END)
+            self._thread.join()
+            metrics.set_gauge("queue_depth", 0, queue="encoder")
+        if self._error is not None:
+            raise self._error
+
+
+class SegmentedVideoEncoder:
+    """
+    Writes frames as an HLS-style playlist of short segments, so a player can
+    start on the first segments while the rest are still being rendered.
+
+    playlist_path is the .m3u8 file; the segments are written next to it. The
+    playlist is an EVENT playlist that only grows, and gets #EXT-X-ENDLIST on
+    close(). backend="ffmpeg" runs one ffmpeg process with the HLS muxer
+    (H.264 in MPEG-TS segments, a keyframe at every segment boundary).
+    backend="opencv" (also the fallback without ffmpeg) closes a VideoEncoder
+    every segment_seconds and rewrites the playlist after each finished
+    segment; whether a player accepts those segments depends on the codec.
+    """
+
+    def __init__(self, playlist_path, fps=24, frame_size=None, backend="opencv", codec='mp4v',
+                 segment_seconds=2, segment_extension='.mp4', **encoder_options):
+        if backend == "ffmpeg" and shutil.which('ffmpeg') is None:
+            print("ffmpeg not found, encoding with OpenCV instead")
+            backend = "opencv"
+
+        self.playlist_path = playlist_path
+        self.output_dir = os.path.dirname(playlist_path) or '.'
+        self.fps = fps
+        self.frame_size = frame_size
+        self.backend = backend
+        self.codec = codec
+        self.segment_seconds = segment_seconds
+        self.segment_extension = segment_extension
+        self.encoder_options = encoder_options
+        self.segment_frames = max(1, round(fps * segment_seconds))
+        self.segments = []
+        self.frames_written = 0
+
+        self._encoder = None
+        self._segment_name = None
+        self._segment_length = 0
+        self._closed = False
+        os.makedirs(self.output_dir, exist_ok=True)
+        if os.path.exists(playlist_path):
+            # left over from an earlier attempt, the new playlist starts empty
+            os.remove(playlist_path)
+
+        if self.backend == "ffmpeg":
+            self._encoder = VideoEncoder(playlist_path, fps=fps, frame_size=frame_size, backend="ffmpeg",
+                                         ffmpeg_output_args=self._get_hls_args(), **encoder_options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception:
+            # an exception already in flight is the real failure, do not replace it
+            if exc_type is None:
+                raise
+
+    def _get_hls_args(self):
+        return [
+            '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})',
+            '-f', 'hls', '-hls_time', str(self.segment_seconds), '-hls_list_size', '0',
+            '-hls_playlist_type', 'event', '-hls_flags', 'independent_segments+temp_file',
+            '-hls_segment_filename', os.path.join(self.output_dir, 'segment_%05d.ts'),
+        ]
+
+    def _start_segment(self):
+        self._segment_name = f"segment_{len(self.segments):05d}{self.segment_extension}"
+        self._segment_length = 0
+        self._encoder = VideoEncoder(os.path.join(self.output_dir, self._segment_name), fps=self.fps,
+                                     frame_size=self.frame_size, backend="opencv", codec=self.codec,
+                                     **self.encoder_options)
+
+    def _finish_segment(self):
+        self._encoder.close()
+        self.segments.append((self._segment_name, self._segment_length / self.fps))
+        self._encoder = None
+        self._write_playlist()
+
+    def _write_playlist(self, ended=False):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(self.segment_seconds)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:EVENT',
+        ]
+        for name, duration in self.segments:
+            lines += [f'#EXTINF:{duration:.3f},', name]
+        if ended:
+            lines.append('#EXT-X-ENDLIST')
+        # atomic, the player may fetch the playlist at any time
+        tmp_path = self.playlist_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.playlist_path)
+
+    def write(self, frame):
+        if self._closed:
+            raise ValueError("write() called on a closed SegmentedVideoEncoder")
+        if self.frame_size is None:
+            self.frame_size = (frame.shape[1], frame.shape[0])
+        if self.backend == "opencv":
+            if self._encoder is None:
+                self._start_segment()
+            self._encoder.write(frame)
+            self._segment_length += 1
+            if self._segment_length == self.segment_frames:
+                self._finish_segment()
+        else:
+            self._encoder.write(frame)
+        self.frames_written += 1
+
+    def close(self):
+        """
+        Finish the last segment and mark the playlist as complete.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self.backend == "ffmpeg":
+            self._encoder.close()
+        else:
+            if self._encoder is not None:
+                self._finish_segment()
+            self._write_playlist(ended=True)
@@ -1,4 +1,6 @@
 import cv2
+from instrumentation import metrics
+from .video_encoder import VideoEncoder, SegmentedVideoEncoder
 
 def read_video(video_path):
     cap = cv2.VideoCapture(video_path)
@@ -10,11 +12,53 @@ def read_video(video_path):
         frames.append(frame)
     return frames
 
-def save_video(output_video_frames, output_video_path, codec='XVID'):
-    fourcc = cv2.VideoWriter_fourcc(*codec)
-    out = cv2.VideoWriter(output_video_path, fourcc, 24, (output_video_frames[0].shape[1], output_video_frames[0].shape[0]))
-    for frame in output_video_frames:
-        out.write(frame)
-    out.release()
+def iter_video_frames(video_path):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            metrics.inc("frames_decoded_total")
+            yield frame
+    finally:
+        cap.release()
+
+def read_video_chunks(video_path, chunk_size=64):
+    """
+    Decode the video lazily and yield lists of at most chunk_size frames,
+    so only one window of frames is held in memory at a time.
+    """
+    chunk = []
+    for frame in iter_video_frames(video_path):
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def get_video_info(video_path, default_fps=24):
+    # frame rate, frame size and frame count from the container, default_fps when the fps is missing
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    info = {
+        "fps": fps if fps and fps > 0 else default_fps,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+    }
+    cap.release()
+    return info
 
+def open_video_encoder(output_video_path, codec='XVID', fps=24, backend="opencv", **encoder_options):
+    # a .m3u8 path writes a segmented playlist that can be played while it grows
+    encoder_class = SegmentedVideoEncoder if output_video_path.endswith('.m3u8') else VideoEncoder
+    return encoder_class(output_video_path, fps=fps, backend=backend, codec=codec, **encoder_options)
 
+def save_video(output_video_frames, output_video_path, codec='XVID', fps=24, backend="opencv", **encoder_options):
+    # output_video_frames can be a list or any iterable (e.g. a generator of rendered frames);
+    # frames are encoded on a background thread while the iterable produces the next ones
+    with open_video_encoder(output_video_path, codec, fps, backend, **encoder_options) as encoder:
+        for frame in output_video_frames:
+            encoder.write(frame)
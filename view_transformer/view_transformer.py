@@ -1,5 +1,8 @@
 import cv2
 import numpy as np
+import sys
+sys.path.append('../')
+from utils import TrackTable, get_positions_of_bboxes
 class ViewTransformer():
     def __init__(self):
         court_width = 68
@@ -31,7 +34,17 @@ class ViewTransformer():
         reshaped_point = point.reshape(-1,1,2).astype (np.float32)
         tranform_point = cv2.perspectiveTransform(reshaped_point, self.perspective_transformer)
         return tranform_point.reshape(-1,2)
+    def transform_points(self, points):
+        # all points in a single perspectiveTransform call, points is an (n, 2) array
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if len(points) == 0:
+            return points.reshape(-1, 2)
+        return cv2.perspectiveTransform(points, self.perspective_transformer).reshape(-1, 2)
+
     def add_transformed_position_to_tracks(self, tracks):
+        if isinstance(tracks, TrackTable):
+            tracks.position_transformed = self.transform_points(tracks.position_adjusted)
+            return
         for object, object_tracks in tracks.items():
             for frame_num, track in enumerate(object_tracks):
                 for track_id, track_info in track.items():
@@ -41,5 +54,43 @@ class ViewTransformer():
                     if position_transformed is not None:
                         position_transformed = position_transformed.squeeze().tolist()
                         tracks[object][frame_num][track_id]['position_transformed'] = position_transformed
-        
-        
\ No newline at end of file
+
+    def add_all_positions_to_tracks(self, tracks, camera_movement_per_frame):
+        """
+        Fused Tracker.add_position_to_tracks + CameraMovmentEstimator.add_adjust_positions_to_tracks
+        + add_transformed_position_to_tracks: every bbox of the video is gathered into one array,
+        the anchor points, camera compensation and homography are computed in a few array
+        operations (one perspectiveTransform call) and the results are written back.
+        """
+        camera_movement = np.asarray(camera_movement_per_frame, dtype=np.float64).reshape(-1, 2)
+
+        if isinstance(tracks, TrackTable):
+            is_ball = tracks.object_id == tracks.get_object_id('ball') if 'ball' in tracks else np.zeros(len(tracks), bool)
+            tracks.position = get_positions_of_bboxes(tracks.bbox, is_ball).astype(np.float32)
+            tracks.position_adjusted = tracks.position - camera_movement[tracks.frame].astype(np.float32)
+            tracks.position_transformed = self.transform_points(tracks.position_adjusted)
+            return
+
+        track_infos = []
+        bboxes = []
+        frame_nums = []
+        is_ball = []
+        for object, object_tracks in tracks.items():
+            for frame_num, track in enumerate(object_tracks):
+                for track_id, track_info in track.items():
+                    track_infos.append(track_info)
+                    bboxes.append(track_info['bbox'])
+                    frame_nums.append(frame_num)
+                    is_ball.append(object == 'ball')
+        if not track_infos:
+            return
+
+        positions = get_positions_of_bboxes(np.asarray(bboxes, dtype=np.float64), is_ball)
+        positions_adjusted = positions - camera_movement[frame_nums]
+        positions_transformed = self.transform_points(positions_adjusted)
+
+        for track_info, position, position_adjusted, position_transformed in zip(
+                track_infos, positions.tolist(), positions_adjusted.tolist(), positions_transformed.tolist()):
+            track_info['position'] = tuple(position)
+            track_info['position_adjusted'] = tuple(position_adjusted)
+            track_info['position_transformed'] = position_transformed
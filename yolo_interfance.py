@@ -1,5 +1,7 @@
 from ultralytics import YOLO
-model = YOLO('models/best.pt')
+from trackers import export_model
+# "onnx" / "openvino" (optionally int8=True) run an export of the same weights
+model = YOLO(export_model('models/best.pt', backend="pytorch"), task='detect')
 results = model.predict('input_videos/08fd33_4 - Trim.mp4', save=True)
 print(results[0])
 print("##########")